@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.analysis
+    ~~~~~~~~~~~~~~~~~~~
+
+    Static analysis of templates.  This finds out which variables a
+    template or a fragment of it reads from the context it's rendered
+    with and which other templates it pulls in.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from . import nodes
+from .nodeutils import NodeVisitor, get_node_digest
+from .exceptions import TemplateNotFound
+
+
+class FreeVariableFinder(NodeVisitor):
+    """Finds all the names that are loaded before they are assigned in
+    the scope that loads them.  The result can include names that are
+    in fact always assigned at runtime but it never misses a name.
+
+    Includes, imports and extends are recorded in `references` as
+    ``(behavior, template_names)`` tuples where `template_names` is `None`
+    if the names are not constant.  Callouts and blocks pass the context
+    to code that is not known at analysis time and set the `dynamic`
+    flag.  If `skip_blocks` is enabled blocks are not entered and do not
+    set the flag, they are expected to be analyzed on their own.
+    """
+
+    def __init__(self, config, skip_blocks=False):
+        NodeVisitor.__init__(self)
+        self.config = config
+        self.skip_blocks = skip_blocks
+        self.scopes = [set()]
+        self.free = set()
+        self.references = []
+        self.dynamic = False
+
+    def declare(self, target):
+        if isinstance(target, nodes.Name):
+            self.scopes[-1].add(target.name)
+        else:
+            for item in target.items:
+                self.declare(item)
+
+    def visit_scoped(self, body, targets=()):
+        self.scopes.append(set())
+        for target in targets:
+            self.declare(target)
+        for node in body or ():
+            self.visit(node)
+        self.scopes.pop()
+
+    def add_reference(self, behavior, template):
+        names = None
+        if isinstance(template, nodes.Const):
+            names = template.value
+            if isinstance(names, basestring):
+                names = (names,)
+            elif isinstance(names, (tuple, list)):
+                names = tuple(names)
+            else:
+                names = None
+        self.references.append((behavior, names))
+        self.visit(template)
+
+    def visit_Name(self, node):
+        if node.ctx != 'load':
+            self.declare(node)
+            return
+        for scope in self.scopes:
+            if node.name in scope:
+                return
+        self.free.add(node.name)
+
+    def visit_Assign(self, node):
+        self.visit(node.node)
+        self.declare(node.target)
+
+    def visit_For(self, node):
+        self.visit(node.iter)
+        accessor = nodes.Name(self.config.forloop_accessor, 'load')
+        if self.config.forloop_parent_access:
+            self.visit(accessor)
+        self.visit_scoped(node.body, [node.target, accessor])
+        self.visit_scoped(node.else_)
+
+    def visit_If(self, node):
+        self.visit(node.test)
+        self.visit_scoped(node.body)
+        self.visit_scoped(node.else_)
+
+    def visit_Scope(self, node):
+        self.visit_scoped(node.body)
+
+    def visit_FilterBlock(self, node):
+        for child in node.iter_child_nodes(exclude=('body',)):
+            self.visit(child)
+        self.visit_scoped(node.body)
+
+    def visit_Function(self, node):
+        self.visit(node.name)
+        for default in node.defaults:
+            self.visit(default)
+        self.visit_scoped(node.body, node.args)
+
+    def visit_Include(self, node):
+        self.add_reference('include', node.template)
+
+    def visit_Extends(self, node):
+        self.add_reference('extends', node.template)
+
+    def visit_Import(self, node):
+        self.add_reference('import', node.template)
+        self.declare(node.target)
+
+    def visit_FromImport(self, node):
+        self.add_reference('import', node.template)
+        for item in node.items:
+            self.declare(item.target)
+
+    def visit_Block(self, node):
+        if not self.skip_blocks:
+            self.dynamic = True
+            self.generic_visit(node)
+
+    def visit_CallOut(self, node):
+        self.dynamic = True
+        self.generic_visit(node)
+
+
+class Dependencies(object):
+    """The dependencies of a template or a block that are known without
+    looking at other templates.  `names` is a frozenset of the variables
+    read from the context, `references` a tuple of ``(behavior,
+    template_names)`` tuples for the templates pulled in and `dynamic`
+    is true if the context is passed to callouts.
+    """
+
+    def __init__(self, names=(), references=(), dynamic=False):
+        self.names = frozenset(names)
+        self.references = tuple(references)
+        self.dynamic = dynamic
+
+    def to_const(self):
+        """Returns the dependencies as tuple of constants so that they
+        can be stored in compiled code.
+        """
+        return tuple(sorted(self.names)), self.references, self.dynamic
+
+    @classmethod
+    def from_const(cls, value):
+        return cls(*value)
+
+    def merge(self, other):
+        return self.__class__(self.names | other.names,
+                              self.references + other.references,
+                              self.dynamic or other.dynamic)
+
+    def __repr__(self):
+        return '<%s names=%r references=%r dynamic=%r>' % (
+            self.__class__.__name__,
+            sorted(self.names),
+            self.references,
+            self.dynamic
+        )
+
+
+class FreeVariables(frozenset):
+    """The names a template reads from the context including the ones
+    read by the templates it pulls in.  `unknown` is a tuple of the
+    references that could not be followed, either ``(behavior, None)``
+    for template names that are not constant, ``(behavior, name)`` for
+    templates that could not be loaded or ``('callout', None)``.  Only if
+    it's empty the set is `complete`.
+    """
+
+    def __new__(cls, names=(), unknown=()):
+        rv = frozenset.__new__(cls, names)
+        rv.unknown = tuple(unknown)
+        return rv
+
+    @property
+    def complete(self):
+        return not self.unknown
+
+    def __repr__(self):
+        return '%s(%r, unknown=%r)' % (
+            self.__class__.__name__,
+            sorted(self),
+            self.unknown
+        )
+
+
+def analyze_dependencies(node, config):
+    """Analyzes a template or block node.  Blocks within the node are
+    not entered, they have their own dependencies.
+    """
+    finder = FreeVariableFinder(config, skip_blocks=True)
+    for child in node.body:
+        finder.visit(child)
+    return Dependencies(finder.free, finder.references, finder.dynamic)
+
+
+def analyze_template(node, config):
+    """Returns a ``(dependencies, block_dependencies)`` tuple for a
+    template node.  The dependencies of the template include the ones of
+    all of its blocks, `block_dependencies` is a dictionary with the
+    dependencies of each block by name including the blocks nested in it.
+    """
+    rv = analyze_dependencies(node, config)
+    own = {}
+    for block in node.find_all(nodes.Block):
+        own[block.name] = deps = analyze_dependencies(block, config)
+        rv = rv.merge(deps)
+    blocks = {}
+    for block in node.find_all(nodes.Block):
+        deps = own[block.name]
+        for nested in block.find_all(nodes.Block):
+            deps = deps.merge(own[nested.name])
+        blocks[block.name] = deps
+    return rv, blocks
+
+
+def resolve_free_variables(dependencies, load):
+    """Follows the static references of some dependencies and returns
+    :class:`FreeVariables`.  `load` is called with a template name and
+    has to return the :class:`Dependencies` of that template or `None`
+    if they are not known.  It may raise
+    :exc:`~templatetk.exceptions.TemplateNotFound`.
+    """
+    names = set()
+    unknown = []
+    seen = set()
+    todo = [dependencies]
+    while todo:
+        deps = todo.pop()
+        names.update(deps.names)
+        if deps.dynamic:
+            unknown.append(('callout', None))
+        for behavior, template_names in deps.references:
+            if template_names is None:
+                unknown.append((behavior, None))
+                continue
+            for template_name in template_names:
+                if template_name in seen:
+                    continue
+                seen.add(template_name)
+                try:
+                    child = load(template_name)
+                except TemplateNotFound:
+                    child = None
+                if child is None:
+                    unknown.append((behavior, template_name))
+                else:
+                    todo.append(child)
+    return FreeVariables(names, unknown)
+
+
+def find_free_variables(body, config):
+    """Returns a ``(names, dynamic)`` tuple for a list of nodes where
+    `names` is a frozenset of names read from the context and `dynamic`
+    is `True` if the nodes pass the context on to other templates or
+    callbacks.
+    """
+    finder = FreeVariableFinder(config)
+    for node in body:
+        finder.visit(node)
+    return frozenset(finder.free), finder.dynamic or bool(finder.references)
+
+
+def get_fragment_signature(node, config):
+    """Returns the signature of a template or block node that is used to
+    key the fragment cache.  It's a tuple in the form ``(digest, names)``
+    where `names` is a sorted tuple of the context variables the node
+    reads.  If the output of the node can depend on more than those
+    variables `None` is returned.
+    """
+    names, dynamic = find_free_variables(node.body, config)
+    if dynamic:
+        return None
+    return get_node_digest(node), tuple(sorted(names))
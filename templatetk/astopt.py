@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.astopt
+    ~~~~~~~~~~~~~~~~~
+
+    Optimizations on the Python AST generated by the AST transformer.
+    The transformer emits some code unconditionally because it's simpler
+    to generate, this module removes it again where it's not needed.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import ast
+
+
+def _is_dummy_yield(node):
+    return isinstance(node, ast.If) and \
+           isinstance(node.test, ast.Num) and node.test.n == 0 and \
+           not node.orelse and len(node.body) == 1 and \
+           isinstance(node.body[0], ast.Expr) and \
+           isinstance(node.body[0].value, ast.Yield)
+
+
+def _is_pure(node):
+    """Checks if evaluating an expression has no side effects that the
+    template could notice.  Variable lookups count as pure.
+    """
+    if isinstance(node, (ast.Num, ast.Str, ast.Name)):
+        return True
+    if isinstance(node, ast.Attribute):
+        return _is_pure(node.value)
+    if isinstance(node, ast.Call):
+        func = node.func
+        return isinstance(func, ast.Attribute) and \
+               func.attr == 'lookup_var' and \
+               isinstance(func.value, ast.Name) and \
+               func.value.id == 'rtstate' and \
+               all(_is_pure(x) for x in node.args) and \
+               not node.keywords and node.starargs is None and \
+               node.kwargs is None
+    return False
+
+
+def _iter_scope(node):
+    """Iterates over all nodes in a function that are not part of nested
+    functions.
+    """
+    todo = list(ast.iter_child_nodes(node))
+    while todo:
+        node = todo.pop()
+        yield node
+        if not isinstance(node, (ast.FunctionDef, ast.Lambda)):
+            todo.extend(ast.iter_child_nodes(node))
+
+
+def _is_generator(node):
+    for child in _iter_scope(node):
+        if isinstance(child, ast.Yield):
+            return True
+    return False
+
+
+class DeadCodeEliminator(object):
+    """Removes statements after a return, break or continue, assignments
+    of pure expressions to local variables that are never read, the
+    dummy yields that turn functions into generators where the functions
+    yield anyway and if statements without bodies.  The number of removed
+    items is counted in `removed`.
+    """
+
+    def __init__(self):
+        self.removed = {
+            'unreachable':          0,
+            'unused_assignments':   0,
+            'dummy_yields':         0,
+            'empty_frames':         0
+        }
+
+    def optimize(self, node):
+        for child in ast.walk(node):
+            if isinstance(child, ast.FunctionDef):
+                self.optimize_function(child)
+        return node
+
+    def optimize_function(self, node):
+        generator = _is_generator(node)
+        self.visit_body(node.body)
+        while self.remove_unused_assignments(node):
+            pass
+        # all dummy yields are removed above, if the function was only a
+        # generator because of them it needs one again.
+        if generator and not _is_generator(node):
+            node.body.append(ast.If(ast.Num(0),
+                [ast.Expr(ast.Yield(ast.Num(0)))], []))
+            self.removed['dummy_yields'] -= 1
+        if not node.body:
+            node.body.append(ast.Pass())
+
+    def visit_body(self, body):
+        rv = []
+        for idx, node in enumerate(body):
+            if _is_dummy_yield(node):
+                self.removed['dummy_yields'] += 1
+                continue
+            if not isinstance(node, ast.FunctionDef):
+                for field in 'body', 'orelse':
+                    child_body = getattr(node, field, None)
+                    if child_body:
+                        self.visit_body(child_body)
+            if isinstance(node, ast.If) and not node.body and \
+               not node.orelse and _is_pure(node.test):
+                self.removed['empty_frames'] += 1
+                continue
+            if isinstance(node, (ast.If, ast.For, ast.While)) and \
+               not node.body:
+                node.body.append(ast.Pass())
+            rv.append(node)
+            if isinstance(node, (ast.Return, ast.Break, ast.Continue)):
+                self.removed['unreachable'] += len(body) - idx - 1
+                break
+        body[:] = rv
+
+    def remove_unused_assignments(self, node):
+        loaded = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and \
+               not isinstance(child.ctx, (ast.Store, ast.Param)):
+                loaded.add(child.id)
+
+        changed = [False]
+
+        def visit(body):
+            rv = []
+            for child in body:
+                if isinstance(child, ast.Assign) and \
+                   len(child.targets) == 1 and \
+                   isinstance(child.targets[0], ast.Name) and \
+                   child.targets[0].id not in loaded and \
+                   _is_pure(child.value):
+                    self.removed['unused_assignments'] += 1
+                    changed[0] = True
+                    continue
+                if not isinstance(child, ast.FunctionDef):
+                    for field in 'body', 'orelse':
+                        child_body = getattr(child, field, None)
+                        if child_body:
+                            visit(child_body)
+                            if not child_body:
+                                child_body.append(ast.Pass())
+                rv.append(child)
+            body[:] = rv
+
+        visit(node.body)
+        return changed[0]
+
+
+def eliminate_dead_code(node):
+    """Removes dead code from a module in place and returns a dictionary
+    with the number of removed items by kind.
+    """
+    eliminator = DeadCodeEliminator()
+    eliminator.optimize(node)
+    return eliminator.removed
@@ -20,10 +20,14 @@
 """
 from __future__ import with_statement
 
-from . import nodes
+from timeit import default_timer
+
+from . import nodes, optimizer, astopt, metrics
 from .nodeutils import NodeVisitor
 from .idtracking import IdentManager
 from .fstate import FrameState
+from .exceptions import BlockNotFoundException
+from .analysis import get_fragment_signature, analyze_template
 
 
 try:
@@ -74,27 +78,117 @@ def fix_missing_locations(node):
     return node
 
 
-def to_ast(node):
-    """Converts a template node to a python AST ready for compilation."""
-    transformer = ASTTransformer(node.config)
-    return transformer.transform(node)
+def to_ast(node, block=None, report=None, **options):
+    """Converts a template node to a python AST ready for compilation.
+    The keyword arguments are forwarded to the :class:`ASTTransformer`.
+    If a `block` name is given the module only defines the function of
+    that block (see :meth:`ASTTransformer.transform_block`).  If `report`
+    is a dictionary the counts of removed dead code are added to it.
+    """
+    start = default_timer()
+    transformer = ASTTransformer(node.config, **options)
+    if block is not None:
+        rv = transformer.transform_block(node, block)
+    else:
+        rv = transformer.transform(node)
+    metrics.to_ast_time.observe(default_timer() - start)
+    if report is not None:
+        for key, value in transformer.removed.iteritems():
+            report[key] = report.get(key, 0) + value
+    return rv
 
 
 class ASTTransformer(NodeVisitor):
+    """Transforms a template node into a Python AST.  If `static_blocks`
+    is enabled block tags call the block functions of the same module
+    directly instead of looking up the block at runtime.  That is only
+    correct if the template cannot be extended, such as for flattened
+    templates (see :func:`templatetk.optimizer.flatten_inheritance`).
+
+    If `lazy_blocks` is enabled the functions of the blocks are left out
+    and their names are listed in `lazy_blocks` in the module instead.
+    The frontend has to compile them with :meth:`transform_block` and put
+    them into the module namespace before they are called.
+
+    With `partial_evaluation` the parts of the template that do not
+    depend on the context are evaluated at compile time (see
+    :func:`templatetk.optimizer.partial_evaluate`).
+
+    With `eliminate_dead_code` code that can never run or has no effect
+    is removed from the template before and from the Python AST after
+    the transformation.  The number of removed items is counted in
+    `removed`.
+
+    With `instrument` every template line counts how often it runs in
+    the :class:`~templatetk.bcinterp.LineCounter` of the module (called
+    `line_counter`).  With `instrument_timing` the counter also records
+    the time from each line to the next.
+    """
     bcinterp_module = __name__.split('.')[0] + '.bcinterp'
     exception_module = __name__.split('.')[0] + '.exceptions'
 
-    def __init__(self, config):
+    def __init__(self, config, static_blocks=False, lazy_blocks=False,
+                 eliminate_dead_code=False, partial_evaluation=False,
+                 instrument=False, instrument_timing=False):
         NodeVisitor.__init__(self)
         if not have_ast:
             raise RuntimeError('Python 2.6 or later required for AST')
         self.config = config
+        self.static_blocks = static_blocks
+        self.lazy_blocks = lazy_blocks
+        self.eliminate_dead_code = eliminate_dead_code
+        self.partial_evaluation = partial_evaluation
+        self.instrument = instrument or instrument_timing
+        self.instrument_timing = instrument_timing
+        self.removed = {}
         self.ident_manager = IdentManager()
 
     def transform(self, node):
         assert isinstance(node, nodes.Template), 'can only transform ' \
             'templates, got %r' % node.__class__.__name__
-        return self.visit(node, None)
+        node = self.optimize_template(node)
+        return self.optimize_module(self.visit(node, None))
+
+    def optimize_template(self, node):
+        if self.partial_evaluation:
+            node = optimizer.partial_evaluate(node)
+        if self.eliminate_dead_code:
+            node, removed = optimizer.eliminate_dead_code(node)
+            self.removed['statements'] = removed
+        return node
+
+    def optimize_module(self, node):
+        if self.eliminate_dead_code:
+            self.removed.update(astopt.eliminate_dead_code(node))
+            fix_missing_locations(node)
+        return node
+
+    def transform_block(self, node, name):
+        """Returns a module that only defines the function of the block
+        with the given name of a template node.
+        """
+        assert isinstance(node, nodes.Template), 'can only transform ' \
+            'templates, got %r' % node.__class__.__name__
+        node = self.optimize_template(node)
+        for block_node in node.find_all(nodes.Block):
+            if block_node.name == name:
+                break
+        else:
+            raise BlockNotFoundException(name)
+        fstate = FrameState(self.config, ident_manager=self.ident_manager,
+                            root=True)
+        rv = ast.Module(lineno=1)
+        rv.body = list(self.make_runtime_imports())
+        rv.body.append(self.make_block_func(block_node, fstate))
+        return self.optimize_module(fix_missing_locations(rv))
+
+    def make_block_func(self, node, fstate):
+        block_fstate = fstate.derive(scope='hard')
+        block_fstate.analyze_identfiers(node.body)
+        rv = self.make_rtstate_func('block_' + node.name)
+        rv.body.extend(self.visit_block(node.body, block_fstate))
+        self.inject_scope_code(block_fstate, rv.body)
+        return rv
 
     def visit(self, node, state):
         rv = NodeVisitor.visit(self, node, state)
@@ -103,15 +197,35 @@ class ASTTransformer(NodeVisitor):
 
     def visit_block(self, nodes, state):
         result = []
+        lineno = None
         if nodes:
             for node in nodes:
+                if self.instrument and node.lineno is not None and \
+                   node.lineno != lineno:
+                    lineno = node.lineno
+                    result.append(self.make_line_marker(lineno))
                 rv = self.visit(node, state)
                 if isinstance(rv, ast.AST):
-                    result.append(rv)
-                else:
-                    result.extend(rv)
+                    rv = [rv]
+                # statements without a location get the line of the
+                # template node so that tracebacks and profilers point to
+                # the right template line.
+                if node.lineno is not None:
+                    for stmt in rv:
+                        if getattr(stmt, 'lineno', None) is None:
+                            stmt.lineno = node.lineno
+                result.extend(rv)
         return result
 
+    def make_line_marker(self, lineno):
+        if self.instrument_timing:
+            return ast.Expr(self.make_call('line_counter.mark',
+                                           [ast.Num(lineno)]), lineno=lineno)
+        return ast.AugAssign(ast.Subscript(ast.Name('line_hits', ast.Load()),
+                                           ast.Index(ast.Num(lineno)),
+                                           ast.Store()),
+                             ast.Add(), ast.Num(1), lineno=lineno)
+
     def make_getattr(self, dotted_name, lineno=None):
         parts = dotted_name.split('.')
         expr = ast.Name(parts.pop(0), ast.Load(), lineno=lineno)
@@ -243,12 +357,17 @@ class ASTTransformer(NodeVisitor):
         return ast.Dict(keys, values, lineno=lineno)
 
     def context_to_lookup(self, fstate, reference_node, lineno=None):
-        locals = self.locals_to_dict(fstate, reference_node)
-        if not locals.keys:
+        names = []
+        values = []
+        for name, local_id in fstate.iter_vars(reference_node):
+            names.append(ast.Str(name))
+            values.append(ast.Name(local_id, ast.Load()))
+        if not names:
             return self.make_getattr('rtstate.context')
-        return self.make_call('MultiMappingLookup',
-            [ast.Tuple([locals, self.make_getattr('rtstate.context')],
-                       ast.Load())], lineno=lineno)
+        return self.make_call('OverlayContext',
+            [self.make_getattr('rtstate.context'),
+             ast.Tuple(names, ast.Load()),
+             ast.Tuple(values, ast.Load())], lineno=lineno)
 
     def make_assign(self, target, expr, fstate, lineno=None):
         assert isinstance(target, nodes.Name), 'can only assign to names'
@@ -279,16 +398,18 @@ class ASTTransformer(NodeVisitor):
                                            ast.Str(behavior)]))
 
     def make_template_generator(self, vars):
-        return self.make_call('config.yield_from_template',
-                              [ast.Name('template', ast.Load()),
-                               ast.Name('info', ast.Load()),
-                               vars])
+        return self.make_call('info.yield_from_template',
+                              [ast.Name('template', ast.Load()), vars])
 
     def make_template_render_call(self, vars, behavior):
+        if behavior == 'include':
+            gen = self.make_call('info.include_template',
+                                 [ast.Name('template', ast.Load()), vars])
+        else:
+            gen = self.make_template_generator(vars)
         return [
             self.make_template_info(behavior),
-            ast.For(ast.Name('event', ast.Store()),
-                    self.make_template_generator(vars),
+            ast.For(ast.Name('event', ast.Store()), gen,
                     [ast.Expr(ast.Yield(ast.Name('event', ast.Load())))], [])
         ]
 
@@ -301,21 +422,35 @@ class ASTTransformer(NodeVisitor):
         root = self.make_rtstate_func('root')
         root.body.extend(self.visit_block(node.body, fstate))
         self.inject_scope_code(fstate, root.body)
-        rv.body = list(self.make_runtime_imports()) + [root]
+        rv.body = list(self.make_runtime_imports())
+        if self.instrument:
+            rv.body.append(ast.Assign([ast.Name('line_counter', ast.Store())],
+                                      self.make_call('LineCounter', [])))
+            rv.body.append(ast.Assign([ast.Name('line_hits', ast.Store())],
+                                      self.make_getattr('line_counter.hits')))
+        rv.body.append(root)
 
         setup = self.make_rtstate_func('setup')
         setup.body.append(ast.Expr(self.make_call('register_block_mapping',
             [self.make_getattr('rtstate.info'),
-             ast.Name('blocks', ast.Load())])))
+             ast.Name('blocks', ast.Load()),
+             ast.Name('block_signatures', ast.Load())])))
 
         blocks_keys = []
         blocks_values = []
+        lazy_blocks = []
+        signatures = {}
+        template_signature = None
+        if self.config.fragment_cache is not None:
+            template_signature = get_fragment_signature(node, self.config)
         for block_node in node.find_all(nodes.Block):
-            block_fstate = fstate.derive(scope='hard')
-            block = self.make_rtstate_func('block_' + block_node.name)
-            block.body.extend(self.visit_block(block_node.body, block_fstate))
-            self.inject_scope_code(block_fstate, block.body)
-            rv.body.append(block)
+            if self.config.fragment_cache is not None:
+                signatures[block_node.name] = get_fragment_signature(
+                    block_node, self.config)
+            if self.lazy_blocks:
+                lazy_blocks.append(block_node.name)
+                continue
+            rv.body.append(self.make_block_func(block_node, fstate))
             blocks_keys.append(ast.Str(block_node.name))
             blocks_values.append(ast.Name('block_' + block_node.name,
                                           ast.Load()))
@@ -323,6 +458,22 @@ class ASTTransformer(NodeVisitor):
         rv.body.append(setup)
         rv.body.append(ast.Assign([ast.Name('blocks', ast.Store())],
                                   ast.Dict(blocks_keys, blocks_values)))
+        rv.body.append(ast.Assign([ast.Name('lazy_blocks', ast.Store())],
+                                  self.make_const(tuple(lazy_blocks), fstate)))
+        rv.body.append(ast.Assign([ast.Name('block_signatures', ast.Store())],
+                                  self.make_const(signatures, fstate)))
+        rv.body.append(ast.Assign([ast.Name('template_signature',
+                                            ast.Store())],
+                                  self.make_const(template_signature, fstate)))
+
+        dependencies, block_dependencies = analyze_template(node, self.config)
+        rv.body.append(ast.Assign([ast.Name('dependencies', ast.Store())],
+                                  self.make_const(dependencies.to_const(),
+                                                  fstate)))
+        rv.body.append(ast.Assign([ast.Name('block_dependencies',
+                                            ast.Store())],
+            self.make_const(dict((name, deps.to_const()) for name, deps
+                                 in block_dependencies.iteritems()), fstate)))
 
         return fix_missing_locations(rv)
 
@@ -359,11 +510,8 @@ class ASTTransformer(NodeVisitor):
            isinstance(node.target, nodes.Tuple):
             iter_name = self.ident_manager.temporary()
             target = ast.Name(iter_name, ast.Store())
-            body.append(ast.Assign([self.visit(node.target, loop_fstate)],
-                ast.Call(ast.Name('lenient_unpack_helper', ast.Load()),
-                         [ast.Name('config', ast.Load()),
-                          ast.Name(iter_name, ast.Load()),
-                          self.make_name_tuple(node.target)], [], None, None)))
+            body.append(self.make_lenient_unpack(node.target, iter_name,
+                                                 loop_fstate))
         else:
             target = self.visit(node.target, loop_fstate)
 
@@ -396,6 +544,30 @@ class ASTTransformer(NodeVisitor):
 
         return rv
 
+    def make_lenient_unpack(self, target, iter_name, fstate):
+        """Unpacks the value stored in `iter_name` to a tuple target with
+        the lenient helper.  For flat targets the common case of a tuple
+        with the right length is unpacked inline and the helper is only
+        called on a mismatch.
+        """
+        slow_path = ast.Assign([self.visit(target, fstate)],
+            ast.Call(ast.Name('lenient_unpack_helper', ast.Load()),
+                     [ast.Name('config', ast.Load()),
+                      ast.Name(iter_name, ast.Load()),
+                      self.make_name_tuple(target)], [], None, None))
+        if not all(isinstance(x, nodes.Name) for x in target.items):
+            return slow_path
+        value = ast.Name(iter_name, ast.Load())
+        test = ast.BoolOp(ast.And(), [
+            ast.Compare(ast.Attribute(value, '__class__', ast.Load()),
+                        [ast.Is()], [ast.Name('tuple', ast.Load())]),
+            ast.Compare(ast.Call(ast.Name('len', ast.Load()), [value],
+                                 [], None, None),
+                        [ast.Eq()], [ast.Num(len(target.items))])
+        ])
+        fast_path = ast.Assign([self.visit(target, fstate)], value)
+        return ast.If(test, [fast_path], [slow_path])
+
     def visit_Continue(self, node, fstate):
         return [ast.Continue(lineno=node.lineno)]
 
@@ -483,10 +655,19 @@ class ASTTransformer(NodeVisitor):
                 lineno=node.lineno))
         return rv
 
+    def make_fragment_dispatch(self, func, args):
+        return ast.Expr(ast.Yield(self.make_call('rtstate.info.dispatch_fragment',
+            [self.make_getattr(func)] + args)))
+
     def visit_Include(self, node, fstate):
         vars = self.context_to_lookup(fstate, node)
         lookup = self.make_template_lookup(node.template, fstate)
-        render = self.make_template_render_call(vars, 'include')
+        if self.config.parallel_fragments and not fstate.is_buffered():
+            render = [self.make_template_info('include'),
+                      self.make_fragment_dispatch('info.include_template',
+                          [ast.Name('template', ast.Load()), vars])]
+        else:
+            render = self.make_template_render_call(vars, 'include')
         if node.ignore_missing:
             return ast.TryExcept(lookup, [ast.ExceptHandler(
                 ast.Name('TemplateNotFound', ast.Load()), None,
@@ -502,9 +683,17 @@ class ASTTransformer(NodeVisitor):
     def visit_Block(self, node, fstate):
         block_name = ast.Str(node.name)
         vars = self.context_to_lookup(fstate, node)
+        if self.static_blocks:
+            func = 'block_' + node.name
+            args = [self.make_call('RuntimeState.for_info', [vars,
+                self.make_getattr('rtstate.info')])]
+        else:
+            func = 'rtstate.evaluate_block'
+            args = [block_name, vars]
+        if self.config.parallel_fragments and not fstate.is_buffered():
+            return self.make_fragment_dispatch(func, args)
         return ast.For(ast.Name('event', ast.Store()),
-                       self.make_call('rtstate.evaluate_block',
-                                      [block_name, vars]),
+                       self.make_call(func, args),
                        [ast.Expr(ast.Yield(ast.Name('event', ast.Load())))],
                        [], lineno=node.lineno)
 
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.bccache
+    ~~~~~~~~~~~~~~~~~~
+
+    Caches for the bytecode of compiled templates.  Compiling a template
+    to Python bytecode is a lot slower than loading marshalled code, so
+    the bytecode can be stored once and reused by later processes.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import imp
+import errno
+import marshal
+import tempfile
+from hashlib import sha1
+
+from . import metrics
+
+
+#: the header of all cached bytecode.  It includes the magic of the
+#: Python interpreter as marshalled code is not portable between versions.
+bc_magic = 'tkbc' + imp.get_magic()
+
+
+def dump_bytecode(code):
+    """Returns the bytecode as a string that can be cached."""
+    return bc_magic + marshal.dumps(code)
+
+
+def load_bytecode(data):
+    """Loads bytecode dumped with :func:`dump_bytecode`.  If the data
+    was written by an incompatible version `None` is returned.
+    """
+    if data is None or not data.startswith(bc_magic):
+        return None
+    try:
+        return marshal.loads(data[len(bc_magic):])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+class BytecodeCache(object):
+    """Base class for bytecode caches.  Subclasses have to implement
+    :meth:`load_bytes` and :meth:`dump_bytes` which store strings under a
+    key returned by :meth:`get_cache_key`.
+    """
+
+    def get_cache_key(self, name, checksum, variant=''):
+        """Returns the key for a template.  The `checksum` has to change
+        whenever the template changes, the `variant` is for templates
+        compiled with different options.
+        """
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return sha1('%s|%s|%s' % (name, checksum, variant)).hexdigest()
+
+    def load_bytes(self, key):
+        raise NotImplementedError()
+
+    def dump_bytes(self, key, data):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def load_bytecode(self, key):
+        """Returns the code object for a key or `None`."""
+        rv = load_bytecode(self.load_bytes(key))
+        if rv is None:
+            metrics.bytecode_cache_misses.inc()
+        else:
+            metrics.bytecode_cache_hits.inc()
+        return rv
+
+    def dump_bytecode(self, key, code):
+        self.dump_bytes(key, dump_bytecode(code))
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """Keeps the bytecode in a dictionary."""
+
+    def __init__(self):
+        self.mapping = {}
+
+    def load_bytes(self, key):
+        return self.mapping.get(key)
+
+    def dump_bytes(self, key, data):
+        self.mapping[key] = data
+
+    def clear(self):
+        self.mapping.clear()
+
+
+class FileSystemBytecodeCache(BytecodeCache):
+    """Stores the bytecode in files in a directory.  The files are
+    written atomically so multiple processes can share the directory.
+    """
+
+    def __init__(self, directory, pattern='__templatetk_%s.cache'):
+        self.directory = directory
+        self.pattern = pattern
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, self.pattern % key)
+
+    def load_bytes(self, key):
+        try:
+            f = open(self.get_filename(key), 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def dump_bytes(self, key, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp, self.get_filename(key))
+        except:
+            os.remove(tmp)
+            raise
+
+    def clear(self):
+        prefix, suffix = self.pattern.split('%s', 1)
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith(suffix):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
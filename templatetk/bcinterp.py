@@ -13,12 +13,20 @@ import os
 import sys
 from types import CodeType
 from itertools import izip
+from collections import defaultdict
+from timeit import default_timer
 
-from .asttransform import to_ast
-from .runtime import RuntimeInfo
+from . import metrics
+from .runtime import RuntimeInfo, get_runtime_info_class
 from .nodes import Node
 
 
+#: the filenames of the code objects of compiled templates, registered
+#: by :class:`~templatetk.frontend.CompiledTemplate`.  Samplers use this
+#: to find the frames of templates.
+template_filenames = set()
+
+
 def compile_ast(ast, filename='<string>'):
     """Compiles an AST node to bytecode"""
     if isinstance(filename, unicode):
@@ -32,7 +40,11 @@ def compile_ast(ast, filename='<string>'):
         print >> sys.stderr, ast
         print >> sys.stderr, '-' * 80
 
-    return compile(ast, filename, 'exec')
+    start = default_timer()
+    rv = compile(ast, filename, 'exec')
+    metrics.compile_time.observe(default_timer() - start)
+    metrics.code_size.observe(metrics.get_code_size(rv))
+    return rv
 
 
 def encode_filename(filename):
@@ -42,20 +54,29 @@ def encode_filename(filename):
     return filename
 
 
-def run_bytecode(code_or_node, filename=None):
-    """Evaluates given bytecode, an AST node or an actual ATST node.  This
-    returns a dictionary with the results of the toplevel bytecode execution.
+def to_bytecode(code_or_node, filename=None, **options):
+    """Compiles an AST node or an actual ATST node to a code object.  If
+    a code object is passed it's returned unchanged.  The keyword
+    arguments are passed to :func:`~templatetk.asttransform.to_ast`.
     """
     if isinstance(code_or_node, Node):
-        code_or_node = to_ast(code_or_node)
-        if filename is None:
-            filename = encode_filename(code_or_node.filename)
+        # the compiler is imported on demand so that processes which only
+        # interpret templates or run cached bytecode do not load it.
+        from .asttransform import to_ast
+        code_or_node = to_ast(code_or_node, **options)
     if not isinstance(code_or_node, CodeType):
         if filename is None:
             filename = '<string>'
         code_or_node = compile_ast(code_or_node, filename)
+    return code_or_node
+
+
+def run_bytecode(code_or_node, filename=None):
+    """Evaluates given bytecode, an AST node or an actual ATST node.  This
+    returns a dictionary with the results of the toplevel bytecode execution.
+    """
     namespace = {}
-    exec code_or_node in namespace
+    exec to_bytecode(code_or_node, filename) in namespace
     return namespace
 
 
@@ -105,26 +126,43 @@ def resolve_call_args(*args, **kwargs):
     return args, kwargs
 
 
-def register_block_mapping(info, mapping):
-    def _make_executor(render_func):
+def register_block_mapping(info, mapping, signatures=None):
+    def _make_executor(render_func, signature):
         def executor(info, vars):
-            rtstate = RuntimeState(vars, info.config, info.template_name)
-            return render_func(rtstate)
+            return render_func(RuntimeState.for_info(vars, info))
+        executor.fragment_signature = signature
         return executor
+    if signatures is None:
+        signatures = {}
     for name, render_func in mapping.iteritems():
-        info.register_block(name, _make_executor(render_func))
+        info.register_block(name, _make_executor(render_func,
+                                                 signatures.get(name)))
 
 
 class RuntimeState(object):
+    __slots__ = ('context', 'config', 'info')
     runtime_info_class = RuntimeInfo
 
     def __init__(self, context, config, template_name, info=None):
         self.context = context
         self.config = config
         if info is None:
-            info = self.runtime_info_class(self.config, template_name)
+            info_class = get_runtime_info_class(config,
+                                                self.runtime_info_class)
+            info = info_class(config, template_name)
         self.info = info
 
+    @classmethod
+    def for_info(cls, context, info):
+        """Creates a state for an existing info without going through
+        the constructor.  Used for every block call.
+        """
+        rv = object.__new__(cls)
+        rv.context = context
+        rv.config = info.config
+        rv.info = info
+        return rv
+
     def get_template(self, template_name):
         """Looks up a template."""
         return self.info.get_template(template_name)
@@ -149,6 +187,52 @@ class RuntimeState(object):
             return self.config.undefined_variable(name)
 
 
+class LineCounter(object):
+    """Counts how often the lines of an instrumented template run.  With
+    timing instrumentation :meth:`mark` is called instead which also
+    attributes the time since the previous mark to the previous line.
+    That is wall clock time and includes the time the consumer of the
+    template spends between events.
+    """
+
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.hits = defaultdict(int)
+        self.times = defaultdict(float)
+        self._last = None
+
+    def mark(self, lineno):
+        now = self.timer()
+        if self._last is not None:
+            self.times[self._last[0]] += now - self._last[1]
+        self.hits[lineno] += 1
+        self._last = lineno, now
+
+    def stop(self):
+        """Stops the time of the last marked line."""
+        if self._last is not None:
+            self.times[self._last[0]] += self.timer() - self._last[1]
+            self._last = None
+
+    def reset(self):
+        self.hits.clear()
+        self.times.clear()
+        self._last = None
+
+    def get_stats(self):
+        """Returns a list of ``(lineno, hits, seconds)`` tuples sorted by
+        line number.  `seconds` is `None` without timing.
+        """
+        self.stop()
+        rv = []
+        for lineno, hits in sorted(self.hits.iteritems()):
+            seconds = None
+            if self.times:
+                seconds = self.times.get(lineno, 0.0)
+            rv.append((lineno, hits, seconds))
+        return rv
+
+
 class MultiMappingLookup(object):
 
     def __init__(self, mappings):
@@ -175,3 +259,56 @@ class MultiMappingLookup(object):
                 if key not in found:
                     found.add(key)
                     yield key
+
+
+class OverlayContext(object):
+    """A context that overlays local variables over another context.  The
+    compiled code passes the names and values of the visible locals as
+    tuples, the dictionary for them is only created on the first lookup.
+    If the parent is an overlay itself the locals of both are merged into
+    one dictionary so that lookups need at most two dictionary lookups no
+    matter how deeply includes and blocks are nested.
+    """
+    __slots__ = ('parent', 'names', 'values', '_resolved')
+
+    def __init__(self, parent, names, values):
+        self.parent = parent
+        self.names = names
+        self.values = values
+        self._resolved = None
+
+    def _resolve(self):
+        # returns the merged locals and the first context that is not an
+        # overlay.  Both are stored in one attribute so that threads
+        # rendering fragments in parallel never see half of it.
+        rv = self._resolved
+        if rv is None:
+            parent = self.parent
+            if parent.__class__ is OverlayContext:
+                locals, root = parent._resolve()
+                locals = dict(locals)
+                locals.update(izip(self.names, self.values))
+            else:
+                locals = dict(izip(self.names, self.values))
+                root = parent
+            rv = self._resolved = locals, root
+        return rv
+
+    def __contains__(self, key):
+        locals, root = self._resolve()
+        return key in locals or key in root
+
+    def __getitem__(self, key):
+        locals, root = self._resolve()
+        try:
+            return locals[key]
+        except KeyError:
+            return root[key]
+
+    def __iter__(self):
+        locals, root = self._resolve()
+        for key in locals:
+            yield key
+        for key in root:
+            if key not in locals:
+                yield key
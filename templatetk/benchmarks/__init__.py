@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.benchmarks
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Benchmarks for the interpreter, the bytecode compiler and the
+    JavaScript compiler.  The corpus of templates is in
+    :mod:`templatetk.benchmarks.corpus`, the runner can be invoked from
+    the command line::
+
+        python -m templatetk.benchmarks.runner -n 200 -o results.json
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
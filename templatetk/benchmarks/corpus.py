@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.benchmarks.corpus
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Template trees modelled after the pages real applications render.
+    Every benchmark is a set of templates, the name of the one that is
+    rendered, the context and the filters the templates use.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from cgi import escape
+
+from .. import nodes as n
+
+
+class Benchmark(object):
+    """A named set of templates.  `make_templates` returns a new
+    dictionary of template nodes each time it's called so that every
+    backend gets its own nodes.
+    """
+
+    def __init__(self, name, make_templates, entry, context, filters=None):
+        self.name = name
+        self.make_templates = make_templates
+        self.entry = entry
+        self.context = context
+        self.filters = filters or {}
+
+
+def _truncate(value, length=20):
+    value = unicode(value)
+    if len(value) <= length:
+        return value
+    return value[:length - 3] + u'...'
+
+
+default_filters = {
+    'upper':        lambda x: unicode(x).upper(),
+    'lower':        lambda x: unicode(x).lower(),
+    'title':        lambda x: unicode(x).title(),
+    'strip':        lambda x: unicode(x).strip(),
+    'escape':       lambda x: escape(unicode(x), True),
+    'truncate':     _truncate,
+    'join':         lambda x, d=u'': d.join(map(unicode, x))
+}
+
+
+def _filter(node, name, *args):
+    return n.Filter(node, name, list(args), [], None, None)
+
+
+def _call(node, *args):
+    return n.Call(node, list(args), [], None, None)
+
+
+def _attr(name, attr):
+    return n.Getattr(n.Name(name, 'load'), n.Const(attr))
+
+
+def make_table_templates():
+    return {
+        'table.html': n.Template([
+            n.Output([n.Const('<table>\n')]),
+            n.For(n.Name('row', 'store'), n.Name('rows', 'load'), [
+                n.Output([n.Const('<tr>')]),
+                n.For(n.Name('cell', 'store'), n.Name('row', 'load'), [
+                    n.Output([n.Const('<td>'), n.Name('cell', 'load'),
+                              n.Const('</td>')])
+                ], []),
+                n.Output([n.Const('</tr>\n')])
+            ], []),
+            n.Output([n.Const('</table>')])
+        ])
+    }
+
+
+def make_inheritance_templates():
+    rv = {
+        'base.html': n.Template([
+            n.Output([n.Const('<html><head><title>')]),
+            n.Block('title', [n.Output([n.Const('Site')])]),
+            n.Output([n.Const('</title></head><body>')]),
+            n.Block('body', [
+                n.Block('navigation', []),
+                n.Block('content', []),
+                n.Block('sidebar', [])
+            ]),
+            n.Block('footer', [n.Output([n.Const('<footer/>')])]),
+            n.Output([n.Const('</body></html>')])
+        ]),
+        'page.html': n.Template([
+            n.Extends(n.Const('layout4.html')),
+            n.Block('content', [
+                n.For(n.Name('entry', 'store'), n.Name('entries', 'load'), [
+                    n.Output([n.Const('<h2>'), _attr('entry', 'title'),
+                              n.Const('</h2><p>'), _attr('entry', 'body'),
+                              n.Const('</p>')])
+                ], [])
+            ])
+        ])
+    }
+    overrides = ['title', 'navigation', 'sidebar', 'footer']
+    parent = 'base.html'
+    for level, block in enumerate(overrides):
+        name = 'layout%d.html' % (level + 1)
+        rv[name] = n.Template([
+            n.Extends(n.Const(parent)),
+            n.Block(block, [
+                n.Output([n.Const('<%s level="%d">' % (block, level + 1)),
+                          n.Name('site_name', 'load'),
+                          n.Const('</%s>' % block)])
+            ])
+        ])
+        parent = name
+    return rv
+
+
+def make_include_templates():
+    return {
+        'list.html': n.Template([
+            n.Output([n.Const('<ul>')]),
+            n.For(n.Name('product', 'store'), n.Name('products', 'load'), [
+                n.Include(n.Const('product.html'), False)
+            ], []),
+            n.Output([n.Const('</ul>')])
+        ]),
+        'product.html': n.Template([
+            n.Output([n.Const('<li>'), _attr('product', 'name')]),
+            n.Include(n.Const('price.html'), False),
+            n.Output([n.Const('</li>')])
+        ]),
+        'price.html': n.Template([
+            n.If(_attr('product', 'on_sale'), [
+                n.Output([n.Const(' <s>'), _attr('product', 'price'),
+                          n.Const('</s>')])
+            ], []),
+            n.Output([n.Const(' <b>'), _attr('product', 'current_price'),
+                      n.Const('</b>')])
+        ])
+    }
+
+
+def make_form_templates():
+    field = n.Function(n.Const('field'), [
+        n.Name('name', 'param'), n.Name('value', 'param'),
+        n.Name('type', 'param')
+    ], [n.Const('text')], [
+        n.Output([n.Const('<label for="'), n.Name('name', 'load'),
+                  n.Const('">'), _filter(n.Name('name', 'load'), 'title'),
+                  n.Const('</label><input type="'), n.Name('type', 'load'),
+                  n.Const('" name="'), n.Name('name', 'load'),
+                  n.Const('" value="'),
+                  _filter(n.Name('value', 'load'), 'escape'),
+                  n.Const('">')])
+    ])
+    row = n.Function(n.Const('row'), [n.Name('item', 'param')], [], [
+        n.Output([n.Const('<div class="row">'),
+                  _call(n.Name('field', 'load'), _attr('item', 'name'),
+                        _attr('item', 'value'), _attr('item', 'type')),
+                  n.Const('</div>')])
+    ])
+    return {
+        'form.html': n.Template([
+            n.Assign(n.Name('field', 'store'), field),
+            n.Assign(n.Name('row', 'store'), row),
+            n.Output([n.Const('<form>')]),
+            n.For(n.Name('item', 'store'), n.Name('fields', 'load'), [
+                n.Output([_call(n.Name('row', 'load'),
+                                n.Name('item', 'load'))])
+            ], []),
+            n.Output([n.Const('</form>')])
+        ])
+    }
+
+
+def make_filter_templates():
+    return {
+        'filters.html': n.Template([
+            n.For(n.Name('word', 'store'), n.Name('words', 'load'), [
+                n.Output([
+                    _filter(_filter(_filter(_filter(
+                        n.Name('word', 'load'), 'strip'), 'lower'),
+                        'title'), 'truncate', n.Const(12)),
+                    n.Const(' '),
+                    _filter(_filter(n.Name('word', 'load'), 'upper'),
+                            'escape'),
+                    n.Const('\n')
+                ])
+            ], []),
+            n.Output([_filter(n.Name('words', 'load'), 'join',
+                              n.Const(', '))])
+        ])
+    }
+
+
+class _Entry(object):
+
+    def __init__(self, idx):
+        self.title = 'Entry %d' % idx
+        self.body = 'The body of entry %d. ' % idx * 5
+
+
+class _Product(object):
+
+    def __init__(self, idx):
+        self.name = 'Product %d' % idx
+        self.price = 10 + idx
+        self.on_sale = idx % 3 == 0
+        self.current_price = self.on_sale and self.price - 5 or self.price
+
+
+def get_benchmarks():
+    """Returns the list of all benchmarks."""
+    return [
+        Benchmark('large_table', make_table_templates, 'table.html', {
+            'rows': [range(row * 10, row * 10 + 10) for row in xrange(100)]
+        }),
+        Benchmark('deep_inheritance', make_inheritance_templates,
+                  'page.html', {
+            'site_name': 'Example',
+            'entries': [_Entry(x) for x in xrange(20)]
+        }),
+        Benchmark('include_heavy', make_include_templates, 'list.html', {
+            'products': [_Product(x) for x in xrange(50)]
+        }),
+        Benchmark('macro_forms', make_form_templates, 'form.html', {
+            'fields': [{'name': 'field_%d' % x, 'value': '<value %d>' % x,
+                        'type': x % 4 and 'text' or 'password'}
+                       for x in xrange(30)]
+        }, default_filters),
+        Benchmark('filter_chains', make_filter_templates, 'filters.html', {
+            'words': ['  Word number %d with SOME text  ' % x
+                      for x in xrange(100)]
+        }, default_filters)
+    ]
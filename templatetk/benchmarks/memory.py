@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.benchmarks.memory
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the memory retained by loaded templates and the memory a
+    render allocates.  If :mod:`tracemalloc` is available (Python
+    interpreters patched for pytracemalloc provide it) the numbers are
+    the traced allocations and the breakdown is by allocating module.
+    Otherwise the objects created by the measured code are found with
+    :mod:`gc` and sized with :func:`sys.getsizeof`.  That is an estimate:
+    the peak is the memory alive when the render finished and the
+    breakdown is by the module that defines the type of the objects.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import gc
+import sys
+from types import CodeType, FunctionType
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ..bcinterp import template_filenames
+
+
+#: the name reported for code and allocations of compiled templates
+templates_module = '<templates>'
+
+
+def get_method():
+    """Returns ``'tracemalloc'`` or ``'gc'``."""
+    return tracemalloc is not None and 'tracemalloc' or 'gc'
+
+
+def get_module_for_filename(filename):
+    """Returns the name of the module a file belongs to, the filename if
+    it's not a module or :data:`templates_module` for compiled templates.
+    """
+    if filename in template_filenames:
+        return templates_module
+    base = os.path.splitext(os.path.abspath(filename))[0]
+    for name, module in sys.modules.items():
+        module_file = getattr(module, '__file__', None)
+        if module_file is not None and \
+           os.path.splitext(os.path.abspath(module_file))[0] == base:
+            return name
+    return filename
+
+
+def get_object_module(obj):
+    """Returns the module an object is accounted to by the gc method."""
+    if isinstance(obj, FunctionType):
+        obj = obj.func_code
+    if isinstance(obj, CodeType):
+        return get_module_for_filename(obj.co_filename)
+    return getattr(type(obj), '__module__', None) or '__builtin__'
+
+
+def _get_referents(obj):
+    # code objects do not report their referents to the garbage collector
+    if isinstance(obj, CodeType):
+        return (obj.co_code, obj.co_consts, obj.co_names, obj.co_varnames,
+                obj.co_freevars, obj.co_cellvars, obj.co_lnotab)
+    return gc.get_referents(obj)
+
+
+def _sum_by_module(pairs):
+    rv = {}
+    for module, size in pairs:
+        rv[module] = rv.get(module, 0) + size
+    return rv
+
+
+class _TraceMallocTracker(object):
+
+    def start(self):
+        self.was_tracing = tracemalloc.is_tracing()
+        if not self.was_tracing:
+            tracemalloc.start()
+        gc.collect()
+        tracemalloc.clear_traces()
+
+    def live(self, *roots):
+        """Returns the size of the traced allocations that are alive by
+        module.  The roots are traced anyways.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+        return _sum_by_module((get_module_for_filename(stat.traceback[0]
+                               .filename), stat.size)
+                              for stat in snapshot.statistics('filename'))
+
+    def peak(self):
+        return tracemalloc.get_traced_memory()[1]
+
+    def forget(self, obj):
+        pass
+
+    def stop(self):
+        if not self.was_tracing:
+            tracemalloc.stop()
+
+
+class _GCTracker(object):
+
+    def start(self):
+        gc.collect()
+        self.before = gc.get_objects()
+        self.known = set(map(id, self.before))
+        self.known.update((id(self.before), id(self.known),
+                           id(self.__dict__)))
+
+    def live(self, *roots):
+        """Returns the size of the objects that were created since
+        :meth:`start` and are alive by module.  Objects the garbage
+        collector does not track (strings, code objects) are found
+        through the new objects and the `roots`.
+        """
+        objects = list(roots)
+        for obj in gc.get_objects():
+            if id(obj) not in self.known:
+                objects.append(obj)
+        seen = set(self.known)
+        seen.add(id(objects))
+        seen.add(id(sys._getframe()))
+        sizes = []
+        for obj in objects:
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            sizes.append((get_object_module(obj), sys.getsizeof(obj)))
+            for referent in _get_referents(obj):
+                if id(referent) not in seen and \
+                   not gc.is_tracked(referent):
+                    objects.append(referent)
+        return _sum_by_module(sizes)
+
+    def peak(self):
+        return None
+
+    def forget(self, obj):
+        """Excludes an object created by the measuring code."""
+        self.known.add(id(obj))
+
+    def stop(self):
+        del self.before, self.known
+
+
+def _make_tracker():
+    if tracemalloc is not None:
+        return _TraceMallocTracker()
+    return _GCTracker()
+
+
+def measure_loading(load):
+    """Calls `load` which has to return the loaded templates (or any
+    object that keeps them alive, such as a code object) and returns the
+    memory they retain.
+    """
+    tracker = _make_tracker()
+    tracker.start()
+    try:
+        templates = load()
+        peak = tracker.peak()
+        gc.collect()
+        retained = tracker.live(templates)
+    finally:
+        tracker.stop()
+    rv = {'method': get_method(), 'retained_bytes': sum(retained.values()),
+          'retained_by_module': retained, 'peak_bytes': peak}
+    del templates
+    return rv
+
+
+def measure_render(template, context):
+    """Renders the template once and returns the size of the output, the
+    memory alive when rendering finished (the event buffer, the output
+    and everything the render keeps around), the peak and the memory the
+    render retains after the output was discarded.
+    """
+    tracker = _make_tracker()
+    tracker.start()
+    try:
+        events = list(template.execute(context))
+        output = u''.join(events)
+        allocated = tracker.live(output)
+        tracker.forget(allocated)
+        peak = tracker.peak()
+        if peak is None:
+            peak = sum(allocated.values())
+        output_bytes = sys.getsizeof(output)
+        del events, output
+        gc.collect()
+        retained = tracker.live()
+    finally:
+        tracker.stop()
+    return {
+        'method':               get_method(),
+        'output_bytes':         output_bytes,
+        'allocated_bytes':      sum(allocated.values()),
+        'allocated_by_module':  allocated,
+        'peak_bytes':           peak,
+        'retained_bytes':       sum(retained.values()),
+        'retained_by_module':   retained
+    }
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.benchmarks.regression
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the benchmarks against a stored baseline and exits with a
+    non-zero status if the throughput or the memory regressed::
+
+        python -m templatetk.benchmarks.regression --update
+        python -m templatetk.benchmarks.regression
+
+    Each benchmark runs a number of times and the median and the
+    interquartile range of every metric are kept.  A metric regressed if
+    its median is worse than the baseline by more than the threshold and
+    the interquartile ranges of the baseline and the current run do not
+    overlap, so a noisy run alone does not fail the check.  Benchmarks
+    that fail and metrics of the baseline that are not measured any more
+    fail the check as well.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import json
+from optparse import OptionParser
+
+from .runner import backends, run_benchmarks
+from .memory import get_method
+
+
+#: the metrics that are compared and if higher values are better
+metrics = {
+    'throughput':       True,
+    'load_bytes':       False,
+    'render_peak_bytes': False
+}
+
+
+def quantile(values, q):
+    """Returns the `q` quantile of sorted values, interpolating between
+    the closest ranks.
+    """
+    pos = (len(values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def summarize(values):
+    """Returns the median, the quartiles and the interquartile range."""
+    values = sorted(values)
+    q1 = quantile(values, 0.25)
+    q3 = quantile(values, 0.75)
+    return {'median': quantile(values, 0.5), 'q1': q1, 'q3': q3,
+            'iqr': q3 - q1, 'samples': len(values)}
+
+
+def collect(names=None, backends=backends, repeats=5, iterations=50,
+            warmup=5, memory=True):
+    """Runs the benchmarks `repeats` times and returns a ``(summaries,
+    errors)`` tuple.  `summaries` are the summaries of the metrics by
+    ``benchmark/backend`` key, `errors` is a dictionary with the error
+    of every benchmark that failed in any run by key.  Metrics a backend
+    does not report are left out.
+    """
+    samples = {}
+    errors = {}
+    for x in xrange(repeats):
+        report = run_benchmarks(names, backends, iterations, warmup, memory)
+        for result in report['results']:
+            key = '%s/%s' % (result['benchmark'], result['backend'])
+            if result['error'] is not None:
+                errors[key] = result['error']
+                continue
+            values = {'throughput': result['throughput']}
+            if memory:
+                values['load_bytes'] = \
+                    result['memory']['load']['retained_bytes']
+                render = result['memory'].get('render')
+                if render is not None:
+                    values['render_peak_bytes'] = render['peak_bytes']
+            for metric, value in values.iteritems():
+                if value is not None:
+                    samples.setdefault(key, {}) \
+                        .setdefault(metric, []).append(value)
+    summaries = dict((key, dict((metric, summarize(values))
+                                for metric, values in by_metric.iteritems()))
+                     for key, by_metric in samples.iteritems())
+    return summaries, errors
+
+
+def select_baseline(baseline, names=None, backends=backends, memory=True):
+    """Returns the part of the baseline summaries that a run with the
+    given benchmark names, backends and memory setting measures.
+    """
+    rv = {}
+    for key, by_metric in baseline.iteritems():
+        name, backend = key.rsplit('/', 1)
+        if (names and name not in names) or backend not in backends:
+            continue
+        rv[key] = dict((metric, summary) for metric, summary
+                       in by_metric.iteritems()
+                       if memory or metric == 'throughput')
+    return rv
+
+
+def compare(baseline, current, threshold=0.1, memory_threshold=0.1,
+            errors=None):
+    """Compares the summaries of :func:`collect` and returns a list of
+    ``(key, metric, change, regressed)`` tuples.  `change` is the
+    relative change of the median, positive values are improvements.
+    Benchmarks in `errors` are reported with the ``'error'`` metric and
+    metrics of the baseline missing from the current summaries with a
+    `change` of `None`, both count as regressed.
+    """
+    if errors is None:
+        errors = {}
+    rv = []
+    for key in sorted(errors):
+        rv.append((key, 'error', None, True))
+    for key in sorted(baseline):
+        if key in errors:
+            continue
+        for metric in sorted(baseline[key]):
+            if metric not in current.get(key, ()):
+                rv.append((key, metric, None, True))
+    for key in sorted(current):
+        for metric, summary in sorted(current[key].iteritems()):
+            base = baseline.get(key, {}).get(metric)
+            if base is None or not base['median']:
+                continue
+            if metrics[metric]:
+                change = summary['median'] - base['median']
+                overlap = summary['q3'] >= base['q1']
+            else:
+                change = base['median'] - summary['median']
+                overlap = summary['q1'] <= base['q3']
+            change /= float(base['median'])
+            if metric == 'throughput':
+                limit = threshold
+            else:
+                limit = memory_threshold
+            rv.append((key, metric, change, change < -limit and not overlap))
+    return rv
+
+
+def load_baseline(filename):
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def write_baseline(filename, summaries, memory_method):
+    f = open(filename, 'w')
+    try:
+        json.dump({'memory_method': memory_method, 'benchmarks': summaries},
+                  f, indent=2, sort_keys=True)
+        f.write('\n')
+    finally:
+        f.close()
+
+
+def format_comparison(comparison):
+    lines = []
+    for key, metric, change, regressed in comparison:
+        if change is None:
+            lines.append('%-40s %-18s %9s' % (key, metric, metric == 'error'
+                         and 'ERROR' or 'MISSING'))
+            continue
+        lines.append('%-40s %-18s %+8.1f%%%s' % (key, metric, change * 100,
+                     regressed and '  REGRESSION' or ''))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options] [benchmarks]')
+    parser.add_option('-f', '--baseline', default='benchmark-baseline.json',
+                      help='the baseline file')
+    parser.add_option('-u', '--update', action='store_true',
+                      help='write the results as new baseline')
+    parser.add_option('-r', '--repeats', type='int', default=5,
+                      help='runs of every benchmark')
+    parser.add_option('-n', '--iterations', type='int', default=50,
+                      help='renders per run')
+    parser.add_option('-w', '--warmup', type='int', default=5,
+                      help='renders before measuring')
+    parser.add_option('-b', '--backend', action='append', dest='backends',
+                      choices=backends, help='backend to run (repeatable)')
+    parser.add_option('-t', '--threshold', type='float', default=0.1,
+                      help='allowed throughput loss (0.1 is 10%)')
+    parser.add_option('--memory-threshold', type='float', default=0.1,
+                      help='allowed memory growth (0.1 is 10%)')
+    parser.add_option('--no-memory', dest='memory', action='store_false',
+                      default=True, help='only compare the throughput')
+    options, names = parser.parse_args(args)
+
+    baseline = None
+    if not options.update:
+        try:
+            baseline = load_baseline(options.baseline)
+        except IOError:
+            parser.error('no baseline at %s, create one with --update' %
+                         options.baseline)
+        if options.memory and \
+           baseline.get('memory_method') not in (None, get_method()):
+            parser.error('the baseline was measured with %s, not %s' %
+                         (baseline['memory_method'], get_method()))
+
+    selected_backends = options.backends or backends
+    summaries, errors = collect(names, selected_backends, options.repeats,
+                                options.iterations, options.warmup,
+                                options.memory)
+    for key, error in sorted(errors.iteritems()):
+        print '%s failed: %s' % (key, error)
+    if options.update:
+        if errors:
+            print 'not writing a baseline with failing benchmarks'
+            sys.exit(1)
+        write_baseline(options.baseline, summaries,
+                       options.memory and get_method() or None)
+        print 'wrote baseline to %s' % options.baseline
+        return
+
+    expected = select_baseline(baseline['benchmarks'], names,
+                               selected_backends, options.memory)
+    comparison = compare(expected, summaries, options.threshold,
+                         options.memory_threshold, errors)
+    print format_comparison(comparison)
+    regressions = [x for x in comparison if x[3]]
+    if regressions:
+        print '%d regression(s) or failure(s)' % len(regressions)
+        sys.exit(1)
+    print 'no regressions'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.benchmarks.runner
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Renders the benchmark corpus with every backend and reports compile
+    time, render throughput and latency percentiles as JSON.  The
+    JavaScript backend only generates code so only its compile time is
+    reported.  Templates a backend cannot handle are reported with an
+    `error` instead of timings.  With ``--memory`` the memory retained by
+    the loaded templates and allocated by a render is reported too (see
+    :mod:`templatetk.benchmarks.memory`).
+
+    Usage: python -m templatetk.benchmarks.runner [options] [benchmarks]
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import json
+import platform
+from optparse import OptionParser
+from timeit import default_timer
+
+from ..config import Config
+from ..exceptions import TemplateNotFound
+from ..frontend import CompiledTemplate, InterpretedTemplate
+from ..bcinterp import RuntimeState
+from ..interpreter import Interpreter
+from ..jscompiler import to_javascript
+from .corpus import get_benchmarks
+from .memory import get_method, measure_loading, measure_render
+
+
+backends = ('interpreter', 'bytecode', 'javascript')
+
+
+class BenchmarkConfig(Config):
+    """Serves the templates of one benchmark compiled for one backend."""
+
+    def __init__(self, filters):
+        Config.__init__(self)
+        self.filters = filters
+        self.templates = {}
+
+    def get_filters(self):
+        return self.filters
+
+    def get_template(self, template_name):
+        try:
+            return self.templates[template_name]
+        except KeyError:
+            raise TemplateNotFound(template_name)
+
+    def yield_from_template(self, template, info, vars=None):
+        if isinstance(template, CompiledTemplate):
+            rtstate = RuntimeState(vars, self, template.name, info)
+            template.setup_func(rtstate)
+            return template.root_func(rtstate)
+        state = template.interpreter_state_class(self, template.name, info,
+                                                 vars)
+        return Interpreter(self).execute(template.node, state)
+
+
+def compile_templates(benchmark, backend):
+    """Compiles all templates of the benchmark and returns the config
+    that serves them and the time it took.
+    """
+    config = BenchmarkConfig(benchmark.filters)
+    nodes = benchmark.make_templates()
+    start = default_timer()
+    for name, node in nodes.iteritems():
+        node.set_config(config)
+        if backend == 'interpreter':
+            config.templates[name] = InterpretedTemplate(name, config, node)
+        elif backend == 'bytecode':
+            config.templates[name] = CompiledTemplate(name, config, node)
+        elif backend == 'javascript':
+            to_javascript(node)
+        else:
+            raise ValueError('unknown backend %r' % backend)
+    return config, default_timer() - start
+
+
+def percentile(timings, percent):
+    """Returns the percentile of sorted timings (nearest rank)."""
+    index = int(round(percent / 100.0 * (len(timings) - 1)))
+    return timings[index]
+
+
+def summarize_timings(timings):
+    """Returns the latency statistics of a list of render times."""
+    timings = sorted(timings)
+    return {
+        'min':      timings[0],
+        'p50':      percentile(timings, 50),
+        'p90':      percentile(timings, 90),
+        'p99':      percentile(timings, 99),
+        'max':      timings[-1],
+        'mean':     sum(timings) / len(timings)
+    }
+
+
+def run_benchmark(benchmark, backend, iterations=100, warmup=10,
+                  memory=False):
+    """Runs one benchmark with one backend and returns the results as
+    dictionary.  With `memory` the results have a `memory` dictionary
+    with the measurements of loading (`load`) and of one render
+    (`render`).
+    """
+    rv = {'benchmark': benchmark.name, 'backend': backend,
+          'compile_seconds': None, 'renders': 0, 'throughput': None,
+          'latency': None, 'error': None}
+    try:
+        config, rv['compile_seconds'] = compile_templates(benchmark, backend)
+    except Exception, e:
+        rv['error'] = '%s: %s' % (e.__class__.__name__, e)
+        return rv
+    if memory:
+        rv['memory'] = {'load': measure_loading(
+            lambda: compile_templates(benchmark, backend)[0])}
+    if backend == 'javascript':
+        return rv
+
+    template = config.get_template(benchmark.entry)
+    context = benchmark.context
+    try:
+        for x in xrange(warmup):
+            template.render(context)
+        if memory:
+            rv['memory']['render'] = measure_render(template, context)
+        timings = []
+        for x in xrange(iterations):
+            start = default_timer()
+            template.render(context)
+            timings.append(default_timer() - start)
+    except Exception, e:
+        rv['error'] = '%s: %s' % (e.__class__.__name__, e)
+        return rv
+    rv['renders'] = iterations
+    if timings:
+        total = sum(timings)
+        rv['throughput'] = total and iterations / total or None
+        rv['latency'] = summarize_timings(timings)
+    return rv
+
+
+def run_benchmarks(names=None, backends=backends, iterations=100,
+                   warmup=10, memory=False):
+    """Runs the benchmarks with the given names (all by default) and
+    returns the report.
+    """
+    results = []
+    for benchmark in get_benchmarks():
+        if names and benchmark.name not in names:
+            continue
+        for backend in backends:
+            results.append(run_benchmark(benchmark, backend, iterations,
+                                         warmup, memory))
+    return {
+        'memory_method': memory and get_method() or None,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'iterations': iterations,
+        'warmup': warmup,
+        'results': results
+    }
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options] [benchmarks]')
+    parser.add_option('-n', '--iterations', type='int', default=100,
+                      help='renders per benchmark and backend')
+    parser.add_option('-w', '--warmup', type='int', default=10,
+                      help='renders before measuring')
+    parser.add_option('-b', '--backend', action='append', dest='backends',
+                      choices=backends, help='backend to run (repeatable)')
+    parser.add_option('-m', '--memory', action='store_true',
+                      help='measure memory too')
+    parser.add_option('-o', '--output', help='write the report to a file')
+    options, names = parser.parse_args(args)
+    report = run_benchmarks(names, options.backends or backends,
+                            options.iterations, options.warmup,
+                            options.memory)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            f.write(output + '\n')
+        finally:
+            f.close()
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
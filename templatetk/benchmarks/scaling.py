@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.benchmarks.scaling
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Generates synthetic templates of growing size and charts how the time
+    and the memory of :func:`~templatetk.asttransform.to_ast`,
+    :func:`compile` and :func:`~templatetk.jscompiler.to_javascript` grow
+    with them::
+
+        python -m templatetk.benchmarks.scaling -s 100,200,400,800 -i 20
+
+    Every chart shows the growth exponent, the slope of the measurements
+    on a log-log scale.  Linear compilation is close to 1, an exponent
+    that grows between runs is a complexity regression.  The JavaScript
+    compiler skips includes.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import json
+import math
+import random
+from optparse import OptionParser
+from timeit import default_timer
+
+from .. import nodes as n
+from ..config import Config
+from ..asttransform import to_ast
+from ..bcinterp import compile_ast
+from ..jscompiler import to_javascript
+from .memory import get_method, measure_loading
+
+
+stages = ('to_ast', 'compile', 'to_javascript')
+
+default_sizes = (100, 200, 400, 800, 1600)
+
+
+class _Generator(object):
+
+    def __init__(self, depth, variables, seed):
+        self.depth = depth
+        self.variables = variables
+        self.random = random.Random(seed)
+
+    def make_var(self, ctx):
+        return n.Name('var%d' % self.random.randrange(self.variables), ctx)
+
+    def make_simple(self, level):
+        if self.random.random() < 0.3:
+            return n.Assign(self.make_var('store'),
+                            n.Const(self.random.randrange(1000)))
+        items = [n.Const('<p>'), self.make_var('load')]
+        if level > 0:
+            items.append(n.Name('item%d' % (level - 1), 'load'))
+        items.append(n.Const('</p>\n'))
+        return n.Output(items)
+
+    def make_body(self, statements, level):
+        """Returns exactly `statements` statements (nested ones
+        included).
+        """
+        rv = []
+        while statements > 0:
+            if level < self.depth and statements >= 3 and \
+               self.random.random() < 0.3:
+                inner = min(statements - 1, self.random.randint(2, 10))
+                body = self.make_body(inner, level + 1)
+                if self.random.random() < 0.5:
+                    rv.append(n.For(n.Name('item%d' % level, 'store'),
+                                    n.Name('items', 'load'), body, []))
+                else:
+                    rv.append(n.If(self.make_var('load'), body, []))
+                statements -= inner + 1
+            else:
+                rv.append(self.make_simple(level))
+                statements -= 1
+        return rv
+
+
+def generate_template(statements, depth=3, variables=20, includes=0,
+                      blocks=0, seed=0):
+    """Returns a template node with the given number of statements.
+    Loops and conditions are nested up to `depth` levels, `variables`
+    distinct names are assigned and printed and `includes` includes and
+    `blocks` blocks are spread over the toplevel.  Blocks and includes
+    count as statements, the contents of a block as well.  The same
+    arguments always give the same template.
+    """
+    gen = _Generator(depth, variables, seed)
+    extra = includes + blocks * 3
+    body = gen.make_body(max(statements - extra, 0), 0)
+    inserts = [n.Include(n.Const('include%d.html' % x), True)
+               for x in xrange(includes)]
+    inserts += [n.Block('block%d' % x, gen.make_body(2, 1))
+                for x in xrange(blocks)]
+    gen.random.shuffle(inserts)
+    for idx, node in enumerate(inserts):
+        body.insert(len(body) * (idx + 1) // (len(inserts) + 1), node)
+    return n.Template(body).set_config(Config())
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(child) for child in node.iter_child_nodes())
+
+
+def _time(func, repeats):
+    best = None
+    for x in xrange(repeats):
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def measure_stages(node, repeats=3, memory=True):
+    """Measures the stages for one template.  The time is the best of
+    `repeats` runs and the memory is the size of the result (and the peak
+    if tracemalloc is available).
+    """
+    python_ast = to_ast(node)
+    calls = {
+        'to_ast':           lambda: to_ast(node),
+        'compile':          lambda: compile_ast(python_ast, '<scaling>'),
+        'to_javascript':    lambda: to_javascript(node)
+    }
+    rv = {}
+    for stage in stages:
+        result = {'seconds': None, 'bytes': None, 'peak_bytes': None,
+                  'error': None}
+        try:
+            result['seconds'] = _time(calls[stage], repeats)
+            if memory:
+                usage = measure_loading(calls[stage])
+                result['bytes'] = usage['retained_bytes']
+                result['peak_bytes'] = usage['peak_bytes']
+        except Exception, e:
+            result['error'] = '%s: %s' % (e.__class__.__name__, e)
+        rv[stage] = result
+    return rv
+
+
+def growth_exponent(points, stage, metric):
+    """Returns the least squares slope of the metric over the number of
+    statements on a log-log scale or `None` if there are not enough
+    measurements.
+    """
+    pairs = [(math.log(point['statements']),
+              math.log(point['stages'][stage][metric]))
+             for point in points if point['stages'][stage][metric]]
+    if len(pairs) < 2:
+        return None
+    mean_x = sum(x for x, y in pairs) / len(pairs)
+    mean_y = sum(y for x, y in pairs) / len(pairs)
+    variance = sum((x - mean_x) ** 2 for x, y in pairs)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in pairs) / variance
+
+
+def run_scaling(sizes=default_sizes, depth=3, variables=20, includes=0,
+                blocks=0, repeats=3, memory=True):
+    """Measures templates with each number of statements in `sizes` and
+    returns the report.
+    """
+    points = []
+    for size in sizes:
+        node = generate_template(size, depth, variables, includes, blocks)
+        points.append({'statements': size, 'nodes': count_nodes(node),
+                       'stages': measure_stages(node, repeats, memory)})
+    growth = {}
+    for stage in stages:
+        growth[stage] = dict((metric, growth_exponent(points, stage, metric))
+                             for metric in ('seconds', 'bytes'))
+    return {
+        'parameters': {'depth': depth, 'variables': variables,
+                       'includes': includes, 'blocks': blocks,
+                       'repeats': repeats},
+        'memory_method': memory and get_method() or None,
+        'points': points,
+        'growth': growth
+    }
+
+
+def format_chart(report, stage, metric, width=50):
+    """Returns an ASCII bar chart of one metric of one stage."""
+    points = report['points']
+    values = [point['stages'][stage][metric] for point in points]
+    exponent = report['growth'][stage][metric]
+    title = '%s %s' % (stage, metric)
+    if exponent is not None:
+        title += ' (growth exponent %.2f)' % exponent
+    lines = [title]
+    top = max([v for v in values if v] or [0])
+    for point, value in zip(points, values):
+        if value is None:
+            bar = point['stages'][stage]['error'] or 'n/a'
+        else:
+            bar = '#' * int(round(top and value * width / float(top)))
+            if isinstance(value, float):
+                value = '%.6g' % value
+            bar = '%-*s %s' % (width, bar, value)
+        lines.append('%8d | %s' % (point['statements'], bar))
+    return '\n'.join(lines)
+
+
+def format_charts(report):
+    charts = []
+    for stage in stages:
+        for metric in 'seconds', 'bytes':
+            if any(point['stages'][stage][metric] is not None
+                   for point in report['points']):
+                charts.append(format_chart(report, stage, metric))
+    return '\n\n'.join(charts)
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes',
+                      default=','.join(map(str, default_sizes)),
+                      help='comma separated numbers of statements')
+    parser.add_option('-d', '--depth', type='int', default=3,
+                      help='maximum nesting of loops and conditions')
+    parser.add_option('-v', '--variables', type='int', default=20,
+                      help='number of distinct variables')
+    parser.add_option('-i', '--includes', type='int', default=0,
+                      help='number of includes')
+    parser.add_option('-b', '--blocks', type='int', default=0,
+                      help='number of blocks')
+    parser.add_option('-r', '--repeats', type='int', default=3,
+                      help='runs per measurement, the best is kept')
+    parser.add_option('--no-memory', dest='memory', action='store_false',
+                      default=True, help='only measure the time')
+    parser.add_option('-o', '--output', help='write the report as JSON')
+    options, args = parser.parse_args(args)
+    try:
+        sizes = [int(x) for x in options.sizes.split(',')]
+    except ValueError:
+        parser.error('sizes must be comma separated integers')
+    report = run_scaling(sizes, options.depth, options.variables,
+                         options.includes, options.blocks, options.repeats,
+                         options.memory)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        finally:
+            f.close()
+    sys.stdout.write(format_charts(report) + '\n')
+
+
+if __name__ == '__main__':
+    main()
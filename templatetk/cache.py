@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.cache
+    ~~~~~~~~~~~~~~~~
+
+    Caches that can be plugged into the runtime.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import sys
+import threading
+from time import time
+from collections import OrderedDict
+
+from . import metrics
+from .analysis import get_fragment_signature
+from .runtime import resolve_fragments
+from .exceptions import TemplateNotFound
+from .utils import missing
+
+
+class LRUCache(object):
+    """A thread-safe mapping that holds at most `capacity` items and
+    discards the least recently used one when full.  If `ttl` is given
+    items also expire after that many seconds.  Evictions are counted in
+    `evictions` and in the `eviction_counter` metric if given.
+    """
+
+    def __init__(self, capacity=100, ttl=None, eviction_counter=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.evictions = 0
+        self.eviction_counter = eviction_counter
+        self._mapping = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._mapping.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time():
+                self._evicted()
+                return default
+            self._mapping[key] = value, expires
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = time() + self.ttl
+        with self._lock:
+            self._mapping.pop(key, None)
+            self._mapping[key] = value, expires
+            while len(self._mapping) > self.capacity:
+                self._mapping.popitem(last=False)
+                self._evicted()
+
+    def _evicted(self):
+        self.evictions += 1
+        if self.eviction_counter is not None:
+            self.eviction_counter.inc()
+
+    def delete(self, key):
+        with self._lock:
+            self._mapping.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._mapping.clear()
+
+    def __contains__(self, key):
+        return self.get(key, missing) is not missing
+
+    def __len__(self):
+        return len(self._mapping)
+
+
+class FragmentCache(object):
+    """Caches the rendered output of blocks and included templates.  The
+    key of a fragment is derived from its signature (see
+    :func:`templatetk.analysis.get_fragment_signature`), the autoescape
+    setting and the values of the variables the fragment reads.  These
+    values have to be hashable, fragments rendered with unhashable values
+    are not cached.  Neither are fragments that read a callable because
+    calling it could give a different result each time.  Filters and
+    callables reached through attributes are not checked, their results
+    are cached.
+
+    The `storage` is an :class:`LRUCache` by default but can be any object
+    with a compatible `get` and `set` method.  If multiple threads miss
+    the same fragment at once only the first one renders it, the others
+    wait for its result.
+    """
+
+    def __init__(self, storage=None):
+        if storage is None:
+            storage = LRUCache(
+                eviction_counter=metrics.fragment_cache_evictions)
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self._signatures = {}
+        self._rendering = {}
+        self._lock = threading.Lock()
+
+    def get_node_signature(self, node, config):
+        """Returns the fragment signature of a node and remembers it for
+        the lifetime of the cache.
+        """
+        try:
+            return self._signatures[id(node)][1]
+        except KeyError:
+            rv = get_fragment_signature(node, config)
+            self._signatures[id(node)] = node, rv
+            return rv
+
+    def make_key(self, signature, vars, autoescape):
+        """Returns the cache key of a fragment or `None` if the fragment
+        reads a callable and cannot be cached.
+        """
+        digest, names = signature
+        values = []
+        for name in names:
+            try:
+                value = vars[name]
+            except KeyError:
+                value = missing
+            if callable(value):
+                return None
+            values.append(value)
+        return digest, autoescape, tuple(values)
+
+    def render_fragment(self, signature, vars, autoescape, render_func):
+        """Returns the events for a fragment.  `render_func` is called
+        without arguments and has to return the events if the fragment
+        is not cached yet.
+        """
+        key = self.make_key(signature, vars, autoescape)
+        if key is not None:
+            try:
+                rv = self.storage.get(key)
+            except TypeError:
+                key = None
+        if key is None:
+            with self._lock:
+                self.uncacheable += 1
+            return render_func()
+        if rv is not None:
+            return self._hit(rv)
+
+        with self._lock:
+            finished = self._rendering.get(key)
+            if finished is None:
+                self._rendering[key] = threading.Event()
+                self.misses += 1
+        if finished is not None:
+            finished.wait()
+            rv = self.storage.get(key)
+            if rv is not None:
+                return self._hit(rv)
+            return render_func()
+
+        metrics.fragment_cache_misses.inc()
+        try:
+            rv = u''.join(resolve_fragments(render_func()))
+            self.storage.set(key, rv)
+        finally:
+            with self._lock:
+                self._rendering.pop(key).set()
+        return [rv]
+
+    def _hit(self, rv):
+        with self._lock:
+            self.hits += 1
+        metrics.fragment_cache_hits.inc()
+        return [rv]
+
+
+class LoaderCache(object):
+    """A process-wide cache for loaded templates that is shared by all
+    renders of a config (see :attr:`Config.loader_cache`).  It holds at
+    most `capacity` templates.  Names that could not be found are
+    remembered for `negative_ttl` seconds so that looking them up again
+    does not hit the loader.
+
+    If multiple threads miss the same template at once only the first
+    one loads it, the others wait for its result.
+    """
+
+    def __init__(self, capacity=400, negative_ttl=5):
+        self.templates = LRUCache(capacity,
+            eviction_counter=metrics.loader_cache_evictions)
+        self.not_found = LRUCache(capacity, ttl=negative_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, template_name, load):
+        """Returns the template with the given name or `missing` if it
+        does not exist.  `load` is called with the name if the template
+        is not cached and has to return it or raise
+        :exc:`~templatetk.exceptions.TemplateNotFound`.
+        """
+        rv = self.templates.get(template_name, missing)
+        if rv is not missing:
+            with self._lock:
+                self.hits += 1
+            metrics.loader_cache_hits.inc()
+            return rv
+        if template_name in self.not_found:
+            with self._lock:
+                self.negative_hits += 1
+            metrics.loader_cache_hits.inc()
+            return missing
+
+        with self._lock:
+            loading = self._loading.get(template_name)
+            if loading is None:
+                self._loading[template_name] = _Loading()
+                self.misses += 1
+        if loading is not None:
+            loading.finished.wait()
+            if loading.exc_info is not None:
+                raise loading.exc_info[0], loading.exc_info[1], \
+                      loading.exc_info[2]
+            return loading.result
+
+        metrics.loader_cache_misses.inc()
+        loading = self._loading[template_name]
+        try:
+            try:
+                rv = load(template_name)
+            except TemplateNotFound, e:
+                if e.template_name != template_name:
+                    raise
+                self.not_found.set(template_name, True)
+                rv = missing
+            else:
+                self.templates.set(template_name, rv)
+            loading.result = rv
+        except:
+            loading.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(template_name)
+            loading.finished.set()
+        return rv
+
+    def invalidate(self, template_name=None):
+        """Forgets a template or all templates if no name is given."""
+        if template_name is None:
+            self.templates.clear()
+            self.not_found.clear()
+        else:
+            self.templates.delete(template_name)
+            self.not_found.delete(template_name)
+
+
+class _Loading(object):
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = missing
+        self.exc_info = None
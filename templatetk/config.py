@@ -9,16 +9,23 @@
     :copyright: (c) Copyright 2011 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
+from __future__ import with_statement
+
+import os
+import threading
 from types import MethodType, FunctionType
 from itertools import imap
 
-from .runtime import LoopContext, Function
+from .runtime import LoopContext, Function, FragmentDispatcher
 from .utils import Markup
 
 
 #: the types we support for context functions
 _context_function_types = (FunctionType, MethodType)
 
+#: guards the creation of the fragment dispatchers of configs
+_dispatcher_lock = threading.Lock()
+
 
 class Undefined(object):
     # better object by default
@@ -34,7 +41,17 @@ class Config(object):
         self.forloop_parent_access = True
         self.strict_tuple_unpacking = False
         self.allow_noniter_unpacking = False
+        self.parallel_fragments = 0
+        self.fragment_cache = None
+        self.loader_cache = None
+        self.observers = []
         self.markup_type = Markup
+        self._fragment_dispatcher = None
+
+    def __getstate__(self):
+        rv = self.__dict__.copy()
+        rv['_fragment_dispatcher'] = None
+        return rv
 
     def get_autoescape_default(self, template_name):
         return False
@@ -97,6 +114,25 @@ class Config(object):
     def get_template(self, template_name):
         raise NotImplementedError('Default config cannot load templates')
 
+    def get_fragment_dispatcher(self):
+        """Returns the :class:`~templatetk.runtime.FragmentDispatcher`
+        that renders the fragments of all renders with this config if
+        `parallel_fragments` is set.  Forked processes get their own.
+        """
+        with _dispatcher_lock:
+            rv = self._fragment_dispatcher
+            if rv is None or rv.pid != os.getpid() or \
+               rv.max_workers != self.parallel_fragments:
+                rv = self._fragment_dispatcher = \
+                    FragmentDispatcher(self.parallel_fragments)
+            return rv
+
+    def get_fragment_signature(self, template):
+        return getattr(template, 'fragment_signature', None)
+
+    def get_template_dependencies(self, template):
+        return getattr(template, 'dependencies', None)
+
     def yield_from_template(self, template, info, view=None):
         raise NotImplementedError('Cannot yield from template objects')
 
@@ -9,44 +9,322 @@
     :copyright: (c) Copyright 2011 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
+import marshal
+from collections import deque
+from itertools import islice
 
-from .bcinterp import run_bytecode, RuntimeState
+from .bcinterp import to_bytecode, run_bytecode, RuntimeState, \
+     template_filenames
 from .interpreter import Interpreter, BasicInterpreterState
+from .runtime import resolve_fragments, get_runtime_info_class
+from .analysis import Dependencies, FreeVariables, analyze_template, \
+     resolve_free_variables
+from .exceptions import TemplateNotFound
+from .nodes import Node
+from .nodeutils import get_node_digest
+from .optimizer import flatten_inheritance, partial_evaluate
 
 
 class Template(object):
+    #: the :class:`~templatetk.analysis.Dependencies` of the template and
+    #: a dictionary with the dependencies of each block.  Subclasses set
+    #: these if they know them.
+    dependencies = None
+    block_dependencies = {}
 
     def __init__(self, name, config):
         self.name = name
         self.config = config
+        self._free_variables = None
+        self._block_free_variables = {}
+
+    @property
+    def free_variables(self):
+        """The names of the context variables the template reads, including
+        the ones read by templates that are included, imported or extended
+        with a constant name.  This is a
+        :class:`~templatetk.analysis.FreeVariables` set which is not
+        `complete` if some templates could not be followed.
+        """
+        if self._free_variables is None:
+            self._free_variables = self.resolve_free_variables(
+                self.dependencies)
+        return self._free_variables
+
+    def get_block_free_variables(self, name):
+        """Like :attr:`free_variables` but for a single block."""
+        rv = self._block_free_variables.get(name)
+        if rv is None:
+            rv = self.resolve_free_variables(self.block_dependencies[name])
+            self._block_free_variables[name] = rv
+        return rv
+
+    def resolve_free_variables(self, dependencies):
+        if dependencies is None:
+            return FreeVariables(unknown=[('template', self.name)])
+        def load(template_name):
+            template_name = self.config.join_path(self.name, template_name)
+            template = self.config.get_template(template_name)
+            return self.config.get_template_dependencies(template)
+        return resolve_free_variables(dependencies, load)
 
     def render(self, context):
         return u''.join(self.execute(context))
 
+    def render_many(self, contexts):
+        """Renders the template once for each of the contexts and yields
+        the results.  Subclasses perform the per-template setup only once
+        for all of the contexts.
+        """
+        for context in contexts:
+            yield self.render(context)
+
+    def resolve_events(self, events):
+        """Replaces the fragments that are rendered in parallel in the
+        events of a render with their output.
+        """
+        if self.config.parallel_fragments:
+            events = resolve_fragments(events)
+        return events
+
+    def concat_events(self, events):
+        return u''.join(self.resolve_events(events))
+
     def execute(self, context):
+        """Renders the template and yields the output as strings.
+        Subclasses have to resolve the fragments of parallel rendering
+        with :meth:`resolve_events`.
+        """
         raise NotImplementedError()
 
 
 class CompiledTemplate(Template):
+    """A template compiled to Python bytecode.  The keyword arguments are
+    passed to the :class:`~templatetk.asttransform.ASTTransformer` if the
+    template is compiled from a node.  With `lazy_blocks` the blocks are
+    compiled the first time they are rendered which requires a node.
+    With `eliminate_dead_code` the number of removed statements by kind
+    is available as `dead_code_report`.
+    """
 
-    def __init__(self, name, config, code_or_node):
+    def __init__(self, name, config, code_or_node, **options):
         Template.__init__(self, name, config)
-        namespace = run_bytecode(code_or_node)
+        self.compile_options = options
+        self.node = None
+        if options.get('lazy_blocks'):
+            if not isinstance(code_or_node, Node):
+                raise TypeError('lazy blocks can only be compiled from '
+                                'template nodes')
+            self.node = code_or_node
+        self.dead_code_report = {}
+        self.code = to_bytecode(code_or_node, name,
+                                report=self.dead_code_report, **options)
+        template_filenames.add(self.code.co_filename)
+        self.namespace = namespace = run_bytecode(self.code)
         self.root_func = namespace['root']
+        self.setup_func = namespace['setup']
+        self.fragment_signature = namespace.get('template_signature')
+        self.dependencies = Dependencies.from_const(namespace['dependencies'])
+        self.block_dependencies = dict((name, Dependencies.from_const(deps))
+            for name, deps in namespace['block_dependencies'].iteritems())
+        self._compiled_blocks = {}
+        for block_name in namespace.get('lazy_blocks', ()):
+            if self.node is None:
+                raise TypeError('the code has lazy blocks but no template '
+                                'node was given to compile them')
+            func = self._make_lazy_block(block_name)
+            namespace['blocks'][block_name] = func
+            namespace['block_' + block_name] = func
+
+    def _make_lazy_block(self, block_name):
+        def render_block(rtstate):
+            return self.compile_block(block_name)(rtstate)
+        return render_block
+
+    def compile_block(self, block_name):
+        """Returns the function of a lazy block and compiles it into the
+        namespace of the template if that did not happen yet.
+        """
+        rv = self._compiled_blocks.get(block_name)
+        if rv is None:
+            code = to_bytecode(self.node, self.name, block=block_name,
+                               report=self.dead_code_report,
+                               **self.compile_options)
+            exec code in self.namespace
+            rv = self._compiled_blocks[block_name] = \
+                self.namespace['block_' + block_name]
+        return rv
+
+    def get_line_stats(self):
+        """Returns the ``(lineno, hits, seconds)`` tuples of a template
+        compiled with `instrument` or `instrument_timing` (see
+        :meth:`~templatetk.bcinterp.LineCounter.get_stats`).
+        """
+        counter = self.namespace.get('line_counter')
+        if counter is None:
+            raise TypeError('the template was compiled without '
+                            'instrumentation')
+        return counter.get_stats()
+
+    def get_eager_code(self):
+        """Returns code with all blocks compiled in."""
+        if self.node is None:
+            return self.code
+        options = dict(self.compile_options, lazy_blocks=False)
+        return to_bytecode(self.node, self.name, **options)
 
     def execute(self, context):
         rtstate = RuntimeState(context, self.config, self.name)
-        return self.root_func(rtstate)
+        self.setup_func(rtstate)
+        return self.resolve_events(rtstate.info.observe_render(
+            self.root_func(rtstate)))
+
+    def render_many(self, contexts):
+        rtstate = RuntimeState(None, self.config, self.name)
+        self.setup_func(rtstate)
+        info = rtstate.info
+        for context in contexts:
+            rtstate = RuntimeState(context, self.config, self.name,
+                                   info.copy())
+            yield self.concat_events(rtstate.info.observe_render(
+                self.root_func(rtstate)))
+
+    def render_batch(self, contexts, processes=None, chunksize=64,
+                     max_pending=None):
+        """Renders the template for each context in a pool of worker
+        processes.  See :func:`render_batch`.
+        """
+        return render_batch(self, contexts, processes, chunksize,
+                            max_pending)
+
+
+class FlattenedTemplate(CompiledTemplate):
+    """A compiled template with its static inheritance chain merged in
+    at compile time.  Blocks are called directly and no parent templates
+    are loaded at runtime.  `load` is called with template names and has
+    to return the nodes of the parent templates.  Flattened templates
+    must only be rendered directly and never be extended themselves.
+    """
+
+    def __init__(self, name, config, node, load, lazy_blocks=False):
+        flattened, self.chain = flatten_inheritance(node, load, name)
+        flattened.set_config(config)
+        CompiledTemplate.__init__(self, name, config, flattened,
+                                  static_blocks=True, lazy_blocks=lazy_blocks)
+
+    def is_up_to_date(self, load):
+        """Checks if any template in the chain changed.  `load` is called
+        with each template name and has to return the current node.
+        """
+        for template_name, digest in self.chain:
+            try:
+                node = load(template_name)
+            except TemplateNotFound:
+                return False
+            if get_node_digest(node) != digest:
+                return False
+        return True
 
 
 class InterpretedTemplate(Template):
+    """A template that is evaluated by the interpreter.  With
+    `partial_evaluation` the parts of the node that do not depend on the
+    context are evaluated once up front.
+    """
     interpreter_state_class = BasicInterpreterState
 
-    def __init__(self, name, config, node):
+    def __init__(self, name, config, node, partial_evaluation=False):
         Template.__init__(self, name, config)
+        if partial_evaluation:
+            node = partial_evaluate(node)
         self.node = node
+        self.dependencies, self.block_dependencies = \
+            analyze_template(node, config)
+
+    @property
+    def fragment_signature(self):
+        cache = self.config.fragment_cache
+        if cache is not None:
+            return cache.get_node_signature(self.node, self.config)
 
     def execute(self, context):
-        state = self.interpreter_state_class(self.config, context)
+        state = self.interpreter_state_class(self.config, self.name,
+                                             vars=context)
         interpreter = Interpreter(self.config)
-        return interpreter.execute(self.node, state)
+        return self.resolve_events(state.info.observe_render(
+            interpreter.execute(self.node, state)))
+
+    def render_many(self, contexts):
+        interpreter = Interpreter(self.config)
+        info = get_runtime_info_class(self.config)(self.config, self.name)
+        interpreter.register_blocks(self.node, info,
+                                    self.interpreter_state_class)
+        for context in contexts:
+            state = self.interpreter_state_class(self.config, self.name,
+                                                 info.copy(), context)
+            yield self.concat_events(state.info.observe_render(
+                interpreter.execute(self.node, state,
+                                    register_blocks=False)))
+
+
+#: the template of a batch worker process and the exception raised while
+#: setting it up
+_batch_template = None
+_batch_error = None
+
+
+def _init_batch_worker(name, config, code):
+    global _batch_template, _batch_error
+    # an exception here would make the pool start new workers forever,
+    # it's raised from the first chunk instead.
+    try:
+        _batch_template = CompiledTemplate(name, config, marshal.loads(code))
+    except Exception, e:
+        _batch_error = e
+
+
+def _render_batch_chunk(contexts):
+    if _batch_error is not None:
+        raise _batch_error
+    return [_batch_template.render(context) for context in contexts]
+
+
+def render_batch(template, contexts, processes=None, chunksize=64,
+                 max_pending=None):
+    """Renders a compiled template for every context from an iterable
+    in a :mod:`multiprocessing` pool and yields the results in order.
+    The bytecode and config are sent to each worker once when it starts
+    and loaded as :class:`CompiledTemplate`, afterwards only the contexts
+    and the results travel between the processes, so both the config and
+    the contexts have to be picklable.  If a worker fails to load the
+    template the error is raised from the iterator.
+
+    Contexts are sent in chunks of `chunksize`.  At most `max_pending`
+    chunks (two per process by default) are in flight at the same time
+    which keeps memory bounded no matter how many contexts there are.
+    """
+    from multiprocessing import Pool, cpu_count
+    if processes is None:
+        processes = cpu_count()
+    if max_pending is None:
+        max_pending = processes * 2
+    code = marshal.dumps(template.get_eager_code())
+    pool = Pool(processes, _init_batch_worker,
+                (template.name, template.config, code))
+    try:
+        contexts = iter(contexts)
+        pending = deque()
+        while 1:
+            chunk = list(islice(contexts, chunksize))
+            if chunk:
+                pending.append(pool.apply_async(_render_batch_chunk,
+                                                (chunk,)))
+            if pending and (not chunk or len(pending) >= max_pending):
+                for result in pending.popleft().get():
+                    yield result
+            elif not chunk:
+                break
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
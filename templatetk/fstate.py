@@ -64,6 +64,17 @@ class FrameState(object):
             self.inner_frames.append(rv)
         return rv
 
+    def is_buffered(self):
+        """Checks if this frame or one of its outer frames collects the
+        output in a buffer.
+        """
+        fstate = self
+        while fstate is not None:
+            if fstate.buffer is not None:
+                return True
+            fstate = fstate.parent
+        return False
+
     def analyze_identfiers(self, nodes, preassign=False):
         tracker = IdentTracker(self, preassign)
         for node in nodes:
@@ -79,15 +90,19 @@ class FrameState(object):
 
     def iter_vars(self, reference_node=None):
         found = set()
-        for idmap in self.ident_manager.iter_identifier_maps(self):
-            for name, local_id in idmap.iteritems():
+        frame = self
+        while frame is not None:
+            for name, local_id in frame.local_identifiers.iteritems():
                 if name in found:
                     continue
                 found.add(name)
                 if reference_node is not None and \
-                   self.var_unassigned(name, reference_node):
+                   frame.var_unassigned(name, reference_node):
                     continue
                 yield name, local_id
+            if frame.scope == 'hard':
+                break
+            frame = frame.parent
 
     def var_unassigned(self, name, reference_node):
         if reference_node is None:
@@ -145,5 +160,11 @@ class FrameState(object):
     def iter_required_lookups(self):
         """Return a dictionary with all required lookups."""
         rv = dict(self.requires_lookup)
-        rv.update(self.iter_inner_referenced_vars())
+        for local_id, name in self.iter_inner_referenced_vars():
+            # identifiers assigned on frame entry such as loop targets
+            # must not be replaced by a lookup.
+            if self.local_identifiers.get(name) == local_id and \
+               self.unassigned_until.get(name, False) is None:
+                continue
+            rv[local_id] = name
         return rv.iteritems()
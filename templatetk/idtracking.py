@@ -48,7 +48,8 @@ class IdentTracker(NodeVisitor):
 
         if node.ctx != 'load' or not reused_local_id:
             self.frame.local_identifiers[node.name] = local_id
-            unassigned_until = node.ctx != 'param' and node or None
+            unassigned_until = node.ctx != 'param' and \
+                not self.preassign and node or None
             self.frame.unassigned_until[node.name] = unassigned_until
         if node.ctx == 'load' and not reused_local_id:
             self.frame.requires_lookup[local_id] = node.name
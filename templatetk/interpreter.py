@@ -14,7 +14,7 @@ from itertools import izip, chain
 from contextlib import contextmanager
 
 from .nodeutils import NodeVisitor
-from .runtime import RuntimeInfo
+from .runtime import RuntimeInfo, resolve_fragments, get_runtime_info_class
 from .exceptions import TemplateNotFound
 from . import nodes
 
@@ -79,7 +79,9 @@ class InterpreterState(object):
         self.info = info
 
     def make_runtime_info(self, template_name):
-        return self.runtime_info_class(self.config, template_name)
+        info_class = get_runtime_info_class(self.config,
+                                            self.runtime_info_class)
+        return info_class(self.config, template_name)
 
     def evaluate_block(self, node, level=1):
         return self.info.evaluate_block(node.name, level, self)
@@ -111,6 +113,13 @@ class InterpreterState(object):
     def __iter__(self):
         raise NotImplementedError()
 
+    def snapshot(self):
+        """Returns a dictionary with the currently visible variables.  This
+        is used to hand the state to code that is executed independently
+        of the current template, like parallel fragments.
+        """
+        return dict((key, self[key]) for key in self)
+
     def resolve_var(self, key):
         try:
             return self.__getitem__(key)
@@ -196,9 +205,18 @@ class Interpreter(NodeVisitor):
         assert state.config is self.config, 'config mismatch'
         return self.visit(node, state)
 
-    def execute(self, node, state):
+    def execute(self, node, state, register_blocks=True):
+        """Executes a node and yields the events.  If `register_blocks`
+        is disabled the blocks of a template node are expected to be
+        registered on the info already (see :meth:`register_blocks`).
+        """
         try:
-            for event in self.evaluate(node, state):
+            if register_blocks:
+                events = self.evaluate(node, state)
+            else:
+                assert state.config is self.config, 'config mismatch'
+                events = self.visit_block(node.body, state)
+            for event in events:
                 yield event
         except StopExecutionException:
             pass
@@ -212,6 +230,10 @@ class Interpreter(NodeVisitor):
             state = state_class(info.config, info.template_name, info, vars)
             for event in self.visit_block(node.body, state):
                 yield event
+        cache = self.config.fragment_cache
+        if cache is not None:
+            executor.fragment_signature = cache.get_node_signature(
+                node, self.config)
         return executor
 
     def visit_block(self, nodes, state):
@@ -226,9 +248,13 @@ class Interpreter(NodeVisitor):
         for block in node.find_all(nodes.Block):
             yield block.name, self.make_block_executor(block, state_class)
 
+    def register_blocks(self, node, info, state_class):
+        """Registers the blocks of a template node on a runtime info."""
+        for block, executor in self.iter_blocks(node, state_class):
+            info.register_block(block, executor)
+
     def visit_Template(self, node, state):
-        for block, executor in self.iter_blocks(node, type(state)):
-            state.info.register_block(block, executor)
+        self.register_blocks(node, state.info, type(state))
         for event in self.visit_block(node.body, state):
             yield event
 
@@ -416,7 +442,8 @@ class Interpreter(NodeVisitor):
             state.push_frame()
             for target, value in izip(node.args, args):
                 assign_to_state(target, value, state)
-            rv = u''.join(self.visit_block(node.body, state))
+            rv = u''.join(resolve_fragments(self.visit_block(node.body,
+                                                              state)))
             state.pop_frame()
             return self.config.markup_type(rv)
         name = self.visit(node.name, state)
@@ -434,6 +461,10 @@ class Interpreter(NodeVisitor):
         return empty_iter
 
     def visit_Block(self, node, state):
+        if self.config.parallel_fragments:
+            yield state.info.dispatch_fragment(state.info.evaluate_block,
+                                               node.name, 1, state.snapshot())
+            return
         with state.frame():
             for event in state.evaluate_block(node):
                 yield event
@@ -442,14 +473,14 @@ class Interpreter(NodeVisitor):
         template_name = self.visit(node.template, state)
         template = state.get_template(template_name)
         info = state.info.make_info(template, template_name, 'extends')
-        for event in state.config.yield_from_template(template, info,
-                                                      state):
+        for event in info.yield_from_template(template, state):
             yield event
         raise StopExecutionException()
 
     def visit_FilterBlock(self, node, state):
         with state.frame():
-            value = ''.join(self.visit_block(node.body, state))
+            value = ''.join(resolve_fragments(self.visit_block(node.body,
+                                                               state)))
             args, kwargs = self.resolve_call_args(node, state)
             yield state.info.call_filter(node.name, value, args, kwargs)
 
@@ -462,16 +493,18 @@ class Interpreter(NodeVisitor):
                 raise
             return
         info = state.info.make_info(template, template_name, 'include')
-        for event in state.config.yield_from_template(template, info,
-                                                      state):
+        if self.config.parallel_fragments:
+            yield state.info.dispatch_fragment(info.include_template,
+                                               template, state.snapshot())
+            return
+        for event in info.include_template(template, state):
             yield event
 
     def resolve_import(self, node, state):
         template_name = self.visit(node.template, state)
         template = state.get_template(template_name)
         info = state.info.make_info(template, template_name, 'import')
-        gen = state.config.yield_from_template(template, info,
-                                               state)
+        gen = info.yield_from_template(template, state)
         return info.make_module(gen)
 
     def visit_Import(self, node, state):
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.loaders
+    ~~~~~~~~~~~~~~~~~~
+
+    Loaders find the ATST of templates by name and turn them into
+    template objects, optionally going through a bytecode cache.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import threading
+import traceback
+
+from . import metrics
+from .frontend import CompiledTemplate
+from .exceptions import TemplateNotFound
+from .nodeutils import get_node_digest
+from .precompile import build_dependency_graph
+
+
+def get_cache_variant(options):
+    """Returns the bytecode cache variant for the given compile options."""
+    return ','.join('%s=%r' % item for item in sorted(options.items())
+                    if item[1])
+
+
+class BaseLoader(object):
+    """Base class for loaders.  Subclasses have to implement
+    :meth:`get_node` and should implement :meth:`list_templates` and
+    a cheaper :meth:`get_checksum` if they can.
+    """
+
+    def get_node(self, name):
+        """Returns the template node for a name or raises
+        :exc:`~templatetk.exceptions.TemplateNotFound`.
+        """
+        raise TemplateNotFound(name)
+
+    def get_checksum(self, name):
+        """Returns a string that changes whenever the template changes."""
+        return get_node_digest(self.get_node(name))
+
+    def list_templates(self):
+        """Returns a sorted list of all template names."""
+        raise TypeError('this loader cannot iterate over all templates')
+
+    def load(self, name, config, bytecode_cache=None, **options):
+        """Loads a :class:`~templatetk.frontend.CompiledTemplate`.  If a
+        bytecode cache is given the template is only compiled if the
+        cache has no code for the current checksum.  The keyword
+        arguments are compile options for the template, code compiled with
+        different options is cached separately.  Lazy blocks need the
+        template node and cannot be combined with a bytecode cache.
+        """
+        if bytecode_cache is not None and options.get('lazy_blocks'):
+            raise TypeError('lazy blocks cannot be loaded from a bytecode '
+                            'cache')
+        metrics.templates_loaded.inc()
+        code = key = None
+        if bytecode_cache is not None:
+            key = bytecode_cache.get_cache_key(name, self.get_checksum(name),
+                                               get_cache_variant(options))
+            code = bytecode_cache.load_bytecode(key)
+        if code is not None:
+            return CompiledTemplate(name, config, code)
+        node = self.get_node(name).set_config(config)
+        rv = CompiledTemplate(name, config, node, **options)
+        if bytecode_cache is not None:
+            bytecode_cache.dump_bytecode(key, rv.code)
+        return rv
+
+
+class DictLoader(BaseLoader):
+    """Loads template nodes from a dictionary."""
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def get_node(self, name):
+        try:
+            return self.mapping[name]
+        except KeyError:
+            raise TemplateNotFound(name)
+
+    def list_templates(self):
+        return sorted(self.mapping)
+
+
+class AutoReloader(object):
+    """Loads templates from a loader and reloads them when they change.
+    :meth:`get_template` is meant to be called from
+    :meth:`Config.get_template`.  :meth:`check` compares the checksums of
+    all loaded templates with the loader (loaders for files can return
+    modification times as checksums) and reloads the changed templates
+    and the templates that include, import or extend them.  It can be
+    called manually or every `interval` seconds by a background thread
+    started with :meth:`start`.
+
+    Reloaded templates replace the old ones for new lookups only,
+    renders that already hold the old template finish with it.  If a
+    template fails to reload the old one is kept, the exception is
+    stored in :attr:`errors` by name and the template is retried on the
+    next check.
+    """
+
+    def __init__(self, loader, config, bytecode_cache=None, interval=1.0):
+        self.loader = loader
+        self.config = config
+        self.bytecode_cache = bytecode_cache
+        self.interval = interval
+        self.templates = {}
+        self.checksums = {}
+        self.references = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def load_template(self, name):
+        """Loads a template.  Can be overridden to use a different
+        template class.
+        """
+        return self.loader.load(name, self.config, self.bytecode_cache)
+
+    def get_template(self, name):
+        rv = self.templates.get(name)
+        if rv is None:
+            entry = self._load(name)
+            with self._lock:
+                if name not in self.templates:
+                    self._store(name, entry)
+                rv = self.templates[name]
+        return rv
+
+    def _load(self, name):
+        checksum = self.loader.get_checksum(name)
+        references = build_dependency_graph(self.loader, self.config,
+                                            [name])[name]
+        return self.load_template(name), checksum, references
+
+    def _store(self, name, entry):
+        self.templates[name], self.checksums[name], \
+            self.references[name] = entry
+
+    def get_dependents(self, names):
+        """Returns the loaded templates that depend on one of the names
+        either directly or indirectly, including the names themselves.
+        """
+        rv = set(names)
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            for other, references in self.references.items():
+                if name in references and other not in rv:
+                    rv.add(other)
+                    todo.append(other)
+        return rv
+
+    def check(self):
+        """Reloads changed templates and their dependents and returns the
+        set of names that were invalidated.  The templates are compiled
+        before they replace the old ones, lookups in the meantime still
+        get the old templates.  Templates that fail to reload are not
+        part of the returned set.
+        """
+        changed = set(name for name in self.errors if name in self.checksums)
+        for name, checksum in self.checksums.items():
+            try:
+                if self.loader.get_checksum(name) != checksum:
+                    changed.add(name)
+            except TemplateNotFound:
+                changed.add(name)
+            except Exception, e:
+                self.errors[name] = e
+        invalidated = self.get_dependents(changed)
+        reloaded = {}
+        failed = set()
+        for name in invalidated:
+            try:
+                reloaded[name] = self._load(name)
+            except TemplateNotFound:
+                pass
+            except Exception, e:
+                self.errors[name] = e
+                failed.add(name)
+        invalidated -= failed
+
+        with self._lock:
+            for name in invalidated:
+                if name in reloaded:
+                    self._store(name, reloaded[name])
+                else:
+                    self.templates.pop(name, None)
+                    self.checksums.pop(name, None)
+                    self.references.pop(name, None)
+                self.errors.pop(name, None)
+                if self.config.loader_cache is not None:
+                    self.config.loader_cache.invalidate(name)
+        return invalidated
+
+    def start(self):
+        """Starts a daemon thread that calls :meth:`check` every
+        `interval` seconds.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            # check records the errors of single templates, anything else
+            # must not end the thread either
+            try:
+                self.check()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.metrics
+    ~~~~~~~~~~~~~~~~~~
+
+    Counters and histograms for compilation and caching.  The compiler,
+    the loaders and the caches record into the process-wide `registry`
+    which can be polled with :meth:`MetricsRegistry.collect` or exported
+    in the Prometheus text format with :meth:`MetricsRegistry.format_text`.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import threading
+from bisect import bisect_left
+
+
+#: default buckets for durations in seconds
+time_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+#: default buckets for sizes in bytes
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Counter(object):
+    """A value that only goes up."""
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def collect(self):
+        return self.value
+
+
+class Histogram(object):
+    """Counts observed values in buckets with the given upper bounds and
+    keeps their count and sum.
+    """
+
+    def __init__(self, name, description='', buckets=time_buckets):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0
+
+    def collect(self):
+        """Returns a dictionary with the `count`, the `sum` and the
+        cumulative counts per upper bound in `buckets` (the last bound
+        is ``float('inf')``).
+        """
+        with self._lock:
+            counts = self.counts[:]
+            rv = {'count': self.count, 'sum': self.sum}
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        rv['buckets'] = buckets
+        return rv
+
+
+class MetricsRegistry(object):
+    """Holds metrics by name.  :meth:`counter` and :meth:`histogram`
+    return the existing metric if one with the name was registered
+    before.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, *args):
+        with self._lock:
+            rv = self.metrics.get(name)
+            if rv is None:
+                rv = self.metrics[name] = metric_class(name, *args)
+            elif not isinstance(rv, metric_class):
+                raise TypeError('%r is registered as %s' % (
+                    name, rv.__class__.__name__.lower()))
+            return rv
+
+    def counter(self, name, description=''):
+        return self._get_or_create(Counter, name, description)
+
+    def histogram(self, name, description='', buckets=time_buckets):
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def collect(self):
+        """Returns a dictionary with the current values of all metrics."""
+        with self._lock:
+            metrics = self.metrics.items()
+        return dict((name, metric.collect()) for name, metric in metrics)
+
+    def reset(self):
+        with self._lock:
+            metrics = self.metrics.values()
+        for metric in metrics:
+            metric.reset()
+
+    def format_text(self):
+        """Exports all metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            if metric.description:
+                lines.append('# HELP %s %s' % (name, metric.description))
+            if isinstance(metric, Counter):
+                lines.append('# TYPE %s counter' % name)
+                lines.append('%s %s' % (name, metric.collect()))
+                continue
+            lines.append('# TYPE %s histogram' % name)
+            values = metric.collect()
+            for bound, count in values['buckets']:
+                if bound == float('inf'):
+                    bound = '+Inf'
+                lines.append('%s_bucket{le="%s"} %d' % (name, bound, count))
+            lines.append('%s_sum %r' % (name, values['sum']))
+            lines.append('%s_count %d' % (name, values['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def get_code_size(code):
+    """Returns the size of the bytecode of a code object including the
+    code objects it defines.
+    """
+    rv = len(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            rv += get_code_size(const)
+    return rv
+
+
+#: the registry the library records into
+registry = MetricsRegistry()
+
+to_ast_time = registry.histogram('templatetk_to_ast_seconds',
+    'Time spent converting template nodes to Python ASTs.')
+compile_time = registry.histogram('templatetk_compile_seconds',
+    'Time spent compiling Python ASTs to bytecode.')
+code_size = registry.histogram('templatetk_code_size_bytes',
+    'Size of the bytecode of compiled templates.', size_buckets)
+templates_loaded = registry.counter('templatetk_templates_loaded',
+    'Templates loaded by loaders.')
+bytecode_cache_hits = registry.counter('templatetk_bytecode_cache_hits',
+    'Templates found in a bytecode cache.')
+bytecode_cache_misses = registry.counter('templatetk_bytecode_cache_misses',
+    'Templates not found in a bytecode cache.')
+loader_cache_hits = registry.counter('templatetk_loader_cache_hits',
+    'Templates found in a loader cache, including cached misses.')
+loader_cache_misses = registry.counter('templatetk_loader_cache_misses',
+    'Templates a loader cache had to load.')
+loader_cache_evictions = registry.counter(
+    'templatetk_loader_cache_evictions',
+    'Templates discarded from loader caches.')
+fragment_cache_hits = registry.counter('templatetk_fragment_cache_hits',
+    'Fragments found in a fragment cache.')
+fragment_cache_misses = registry.counter('templatetk_fragment_cache_misses',
+    'Fragments a fragment cache had to render.')
+fragment_cache_evictions = registry.counter(
+    'templatetk_fragment_cache_evictions',
+    'Fragments discarded from fragment caches.')
@@ -8,6 +8,8 @@
     :copyright: (c) Copyright 2011 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
+from hashlib import sha1
+
 from .nodes import Node
 
 
@@ -92,3 +94,10 @@ class NodeTransformer(NodeVisitor):
         if not isinstance(rv, list):
             rv = [rv]
         return rv
+
+
+def get_node_digest(node):
+    """Returns a hex digest that identifies the node and everything below
+    it.  Two nodes with the same digest compile to the same code.
+    """
+    return sha1(repr(node)).hexdigest()
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.optimizer
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Transformations on the ATST that are performed at compile time to
+    make the generated code faster.  All of them return new nodes and
+    leave the nodes passed in untouched.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from . import nodes
+from .nodeutils import get_node_digest
+
+
+def copy_node(node, replace=None):
+    """Returns a deep copy of a node.  If a `replace` function is given
+    it's called with each node before it's copied and can return a
+    different node to copy instead.
+    """
+    if replace is not None:
+        node = replace(node)
+    rv = object.__new__(node.__class__)
+    for attr in node.attributes:
+        setattr(rv, attr, getattr(node, attr))
+    for field, value in node.iter_fields():
+        if isinstance(value, nodes.Node):
+            value = copy_node(value, replace)
+        elif isinstance(value, list):
+            value = [isinstance(x, nodes.Node) and copy_node(x, replace)
+                     or x for x in value]
+        setattr(rv, field, value)
+    return rv
+
+
+def find_static_extends(node):
+    """Returns the index of the extends tag in the body of a template or
+    `None` if the template does not extend another one.  If the template
+    extends a template with a name that is not known at compile time
+    :exc:`~templatetk.nodes.Impossible` is raised.
+    """
+    for idx, child in enumerate(node.body):
+        if isinstance(child, nodes.Extends):
+            if not isinstance(child.template, nodes.Const) or \
+               not isinstance(child.template.value, basestring):
+                raise nodes.Impossible('extends with dynamic template name')
+            return idx
+        if child.find(nodes.Extends) is not None:
+            raise nodes.Impossible('conditional extends')
+
+
+def flatten_inheritance(node, load, template_name=None):
+    """Merges a template with all the templates it extends into a single
+    template.  `load` is called with the name of each parent template and
+    has to return its node.  The statements in front of the extends tags
+    are executed first, then the body of the outermost layout with every
+    block replaced by its most derived override.
+
+    Returns a ``(node, chain)`` tuple where `chain` is a list of
+    ``(template_name, digest)`` tuples for all templates that went into
+    the result.  The flattened node must be compiled with static blocks
+    and must not be extended by other templates.
+    """
+    chain = [(template_name, get_node_digest(node))]
+    blocks = {}
+    body = []
+    current = node
+    while 1:
+        for block in current.find_all(nodes.Block):
+            blocks.setdefault(block.name, block)
+        idx = find_static_extends(current)
+        if idx is None:
+            body.extend(current.body)
+            break
+        body.extend(current.body[:idx])
+        parent_name = current.body[idx].template.value
+        if parent_name in [name for name, digest in chain]:
+            raise nodes.Impossible('circular inheritance')
+        current = load(parent_name)
+        chain.append((parent_name, get_node_digest(current)))
+
+    def replace(node):
+        if isinstance(node, nodes.Block):
+            return blocks[node.name]
+        return node
+
+    rv = nodes.Template([copy_node(x, replace) for x in body], lineno=1)
+    return rv, chain
+
+
+def _find_outer_blocks(node):
+    for child in node.iter_child_nodes():
+        if isinstance(child, nodes.Block):
+            yield child
+        else:
+            for block in _find_outer_blocks(child):
+                yield block
+
+
+def eliminate_dead_code(node):
+    """Removes the statements that follow an extends, break or continue
+    tag in the same body as they can never run.  Blocks in the removed
+    code are kept as they still define the blocks of the template.
+
+    Returns a ``(node, removed)`` tuple where `removed` is the number of
+    statements that were removed.
+    """
+    removed = [0]
+
+    def trim(body):
+        for idx, child in enumerate(body):
+            if isinstance(child, (nodes.Extends, nodes.Break,
+                                  nodes.Continue)):
+                break
+        else:
+            return body
+        rv = body[:idx + 1]
+        for child in body[idx + 1:]:
+            if isinstance(child, nodes.Block):
+                rv.append(child)
+            else:
+                rv.extend(_find_outer_blocks(child))
+                removed[0] += 1
+        return rv
+
+    def replace(node):
+        rv = object.__new__(node.__class__)
+        for attr in node.attributes:
+            setattr(rv, attr, getattr(node, attr))
+        for field, value in node.iter_fields():
+            if isinstance(value, list):
+                value = trim(value)
+            setattr(rv, field, value)
+        return rv
+
+    return copy_node(node, replace), removed[0]
+
+
+class PartialEvaluator(object):
+    """Evaluates the parts of a template that do not depend on the
+    context at compile time.  If tags with a constant test are replaced
+    by the branch that runs, loops over short constant sequences are
+    unrolled and constant output is rendered to template data.
+
+    Output is only rendered ahead of time if finalizing it gives the same
+    string with and without autoescaping, so templates that switch
+    autoescaping at runtime still render the same.
+    """
+
+    #: loops are not unrolled if their body contains one of these.  Nodes
+    #: that hand the locals to other templates need the `loop` accessor
+    #: and the loop variable as the loop would have them.
+    unroll_barriers = (nodes.For, nodes.Block, nodes.Break, nodes.Continue,
+                       nodes.Extends, nodes.Include, nodes.Import,
+                       nodes.FromImport, nodes.CallOut)
+
+    def __init__(self, config, max_unroll=8):
+        self.config = config
+        self.max_unroll = max_unroll
+
+    def as_const(self, node):
+        """Returns the value of a constant expression or raises
+        :exc:`~templatetk.nodes.Impossible`.
+        """
+        if isinstance(node, nodes.Const):
+            return node.value
+        elif isinstance(node, nodes.Tuple) and node.ctx == 'load':
+            return tuple(self.as_const(x) for x in node.items)
+        elif isinstance(node, nodes.List):
+            return [self.as_const(x) for x in node.items]
+        elif isinstance(node, nodes.Dict):
+            return dict((self.as_const(x.key), self.as_const(x.value))
+                        for x in node.items)
+        elif isinstance(node, nodes.And):
+            return self.as_const(node.left) and self.as_const(node.right)
+        elif isinstance(node, nodes.Or):
+            return self.as_const(node.left) or self.as_const(node.right)
+        elif isinstance(node, nodes.CondExpr):
+            if self.as_const(node.test):
+                return self.as_const(node.true)
+            return self.as_const(node.false)
+        elif isinstance(node, nodes.Compare):
+            left = self.as_const(node.expr)
+            for op in node.ops:
+                right = self.as_const(op.expr)
+                if not self.apply(nodes.cmpop_to_func[op.op], left, right):
+                    return False
+                left = right
+            return True
+        elif isinstance(node, nodes.BinExpr) and \
+             node.operator in nodes.binop_to_func and \
+             node.operator not in self.config.intercepted_binops:
+            return self.apply(nodes.binop_to_func[node.operator],
+                              self.as_const(node.left),
+                              self.as_const(node.right))
+        elif isinstance(node, nodes.UnaryExpr) and \
+             node.operator not in self.config.intercepted_unops:
+            return self.apply(nodes.uaop_to_func[node.operator],
+                              self.as_const(node.node))
+        raise nodes.Impossible()
+
+    def apply(self, func, *args):
+        try:
+            return func(*args)
+        except Exception:
+            raise nodes.Impossible()
+
+    def render_const(self, node):
+        """Returns the string a constant expression in an output tag
+        renders to or raises :exc:`~templatetk.nodes.Impossible`.
+        """
+        if isinstance(node, nodes.TemplateData):
+            return node.data
+        value = self.as_const(node)
+        try:
+            rv = self.config.finalize(value, True)
+            if rv != self.config.finalize(value, False):
+                raise nodes.Impossible()
+        except nodes.Impossible:
+            raise
+        except Exception:
+            raise nodes.Impossible()
+        return unicode(rv)
+
+    def visit(self, node):
+        """Returns a list of nodes to replace a node with."""
+        if isinstance(node, nodes.If):
+            return self.visit_If(node)
+        elif isinstance(node, nodes.For):
+            return self.visit_For(node)
+        elif isinstance(node, nodes.Output):
+            return self.visit_Output(node)
+        return [self.copy(node)]
+
+    def copy(self, node):
+        rv = object.__new__(node.__class__)
+        for attr in node.attributes:
+            setattr(rv, attr, getattr(node, attr))
+        for field, value in node.iter_fields():
+            if isinstance(value, nodes.Node):
+                value = self.copy(value)
+            elif isinstance(value, list):
+                if value and isinstance(value[0], nodes.Stmt):
+                    value = self.visit_body(value)
+                else:
+                    value = [isinstance(x, nodes.Node) and self.copy(x) or x
+                             for x in value]
+            setattr(rv, field, value)
+        return rv
+
+    def visit_body(self, body):
+        rv = []
+        for node in body:
+            for new_node in self.visit(node):
+                if isinstance(new_node, nodes.Output) and rv and \
+                   isinstance(rv[-1], nodes.Output):
+                    rv[-1] = self.merge_output(rv[-1].nodes + new_node.nodes,
+                                               rv[-1].lineno)
+                elif not isinstance(new_node, nodes.Output) or \
+                     new_node.nodes:
+                    rv.append(new_node)
+        return rv
+
+    def make_scope(self, body, lineno):
+        """Wraps the body of a pruned if or an unrolled loop into a scope
+        unless it only consists of output.
+        """
+        body = self.visit_body(body)
+        for node in body:
+            if not isinstance(node, nodes.Output):
+                return [nodes.Scope(body, lineno=lineno,
+                                    config=self.config)]
+        return body
+
+    def visit_If(self, node):
+        try:
+            test = self.as_const(node.test)
+        except nodes.Impossible:
+            return [self.copy(node)]
+        body, dead = node.body, node.else_ or []
+        if not test:
+            body, dead = dead, body
+        # blocks are registered even if they are never rendered, that
+        # does not work if they disappear.
+        for child in dead:
+            if isinstance(child, nodes.Block) or \
+               child.find(nodes.Block) is not None:
+                return [self.copy(node)]
+        return self.make_scope(body, node.lineno)
+
+    def visit_For(self, node):
+        try:
+            if not isinstance(node.target, nodes.Name):
+                raise nodes.Impossible()
+            values = self.as_const(node.iter)
+            if not isinstance(values, (tuple, list)) or \
+               len(values) > self.max_unroll:
+                raise nodes.Impossible()
+            for child in node.body + (node.else_ or []):
+                if isinstance(child, self.unroll_barriers) or \
+                   child.find(self.unroll_barriers) is not None:
+                    raise nodes.Impossible()
+                for name in child.find_all(nodes.Name):
+                    if name.name == self.config.forloop_accessor:
+                        raise nodes.Impossible()
+        except nodes.Impossible:
+            return [self.copy(node)]
+        if not values:
+            return self.make_scope(node.else_ or [], node.lineno)
+        body = []
+        for value in values:
+            target = nodes.Name(node.target.name, 'store',
+                                lineno=node.lineno, config=self.config)
+            body.append(nodes.Assign(target, nodes.Const(value,
+                lineno=node.lineno, config=self.config),
+                lineno=node.lineno, config=self.config))
+            body.extend(node.body)
+        return self.make_scope(body, node.lineno)
+
+    def visit_Output(self, node):
+        return [self.merge_output(node.nodes, node.lineno)]
+
+    def merge_output(self, children, lineno):
+        rv = []
+        for child in children:
+            try:
+                data = self.render_const(child)
+            except nodes.Impossible:
+                rv.append(self.copy(child))
+                continue
+            if not data:
+                continue
+            if rv and isinstance(rv[-1], nodes.TemplateData):
+                data = rv[-1].data + data
+                rv.pop()
+            rv.append(nodes.TemplateData(data, lineno=lineno,
+                                         config=self.config))
+        return nodes.Output(rv, lineno=lineno, config=self.config)
+
+
+def partial_evaluate(node, max_unroll=8):
+    """Returns a copy of a template node with the parts evaluated that
+    do not depend on the context (see :class:`PartialEvaluator`).
+    """
+    return PartialEvaluator(node.config, max_unroll).copy(node)
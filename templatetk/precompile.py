@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.precompile
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Compiles a whole set of templates into a bytecode cache ahead of time
+    so that the first render of a template after a deployment does not
+    have to pay for the compilation.  Can be used from the command line::
+
+        python -m templatetk.precompile -d /tmp/cache myapp.templates:setup
+
+    where ``setup`` is a callable returning a ``(loader, config)`` tuple.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+from time import time
+
+from .bcinterp import to_bytecode
+from .bccache import dump_bytecode
+from .analysis import analyze_template
+
+
+def build_dependency_graph(loader, config, names=None):
+    """Returns a dictionary that maps each template name to the set of
+    templates it includes, imports or extends with a constant name.
+    """
+    if names is None:
+        names = loader.list_templates()
+    graph = {}
+    for name in names:
+        node = loader.get_node(name).set_config(config)
+        dependencies = analyze_template(node, config)[0]
+        references = set()
+        for behavior, template_names in dependencies.references:
+            for template_name in template_names or ():
+                references.add(config.join_path(name, template_name))
+        graph[name] = references
+    return graph
+
+
+def iter_dependency_levels(graph):
+    """Yields sorted lists of template names from a dependency graph so
+    that templates only depend on templates of earlier lists.  References
+    to templates outside of the graph are ignored and templates that
+    depend on each other are yielded together.
+    """
+    def reachable(name):
+        seen = set()
+        todo = [name]
+        while todo:
+            for dependency in graph[todo.pop()] & remaining:
+                if dependency not in seen:
+                    seen.add(dependency)
+                    todo.append(dependency)
+        return seen
+
+    remaining = set(graph)
+    while remaining:
+        level = [name for name in remaining
+                 if not (graph[name] & remaining) - set([name])]
+        if not level:
+            # only cycles are left, take the ones nothing else is
+            # waiting for.
+            level = [name for name in remaining
+                     if all(name in reachable(dependency)
+                            for dependency in graph[name] & remaining)]
+        level = sorted(level)
+        remaining.difference_update(level)
+        yield level
+
+
+def compile_template(loader, config, name):
+    """Compiles a single template and returns a ``(checksum, data,
+    seconds)`` tuple where `data` is the dumped bytecode.
+    """
+    start = time()
+    checksum = loader.get_checksum(name)
+    node = loader.get_node(name).set_config(config)
+    data = dump_bytecode(to_bytecode(node, name))
+    return checksum, data, time() - start
+
+
+#: the loader and config of a worker process
+_worker_state = None
+
+
+def _init_worker(loader, config):
+    global _worker_state
+    _worker_state = loader, config
+
+
+def _compile_in_worker(name):
+    loader, config = _worker_state
+    return (name,) + compile_template(loader, config, name)
+
+
+def precompile(loader, config, bytecode_cache, names=None, processes=None,
+               force=False):
+    """Compiles the templates with the given names (all templates of the
+    loader by default) into the bytecode cache.  Templates are compiled
+    in dependency order, each level of the graph in a
+    :mod:`multiprocessing` pool of `processes` worker processes.  If
+    `processes` is 1 no pool is used.  The loader and config are sent to
+    the workers once and have to be picklable.
+
+    Unless `force` is enabled templates that are already in the cache
+    are skipped.  Returns a list of ``(name, seconds)`` tuples in
+    compilation order where `seconds` is `None` for skipped templates.
+    """
+    graph = build_dependency_graph(loader, config, names)
+    pool = None
+    if processes != 1:
+        from multiprocessing import Pool
+        pool = Pool(processes, _init_worker, (loader, config))
+    rv = []
+    try:
+        for level in iter_dependency_levels(graph):
+            todo = []
+            for name in level:
+                key = bytecode_cache.get_cache_key(
+                    name, loader.get_checksum(name))
+                if force or bytecode_cache.load_bytecode(key) is None:
+                    todo.append(name)
+                else:
+                    rv.append((name, None))
+            if pool is not None:
+                results = pool.map(_compile_in_worker, todo)
+            else:
+                results = [(name,) + compile_template(loader, config, name)
+                           for name in todo]
+            for name, checksum, data, seconds in results:
+                key = bytecode_cache.get_cache_key(name, checksum)
+                bytecode_cache.dump_bytes(key, data)
+                rv.append((name, seconds))
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return rv
+
+
+def import_string(import_name):
+    """Imports an object from a ``module:name`` string."""
+    module, obj = import_name.split(':', 1)
+    __import__(module)
+    rv = sys.modules[module]
+    for part in obj.split('.'):
+        rv = getattr(rv, part)
+    return rv
+
+
+def format_report(results):
+    """Formats the results of :func:`precompile` as text."""
+    compiled = [x for x in results if x[1] is not None]
+    width = max([len(name) for name, seconds in results] + [8])
+    lines = []
+    for name, seconds in sorted(compiled, key=lambda x: -x[1]):
+        lines.append('%-*s %9.2fms' % (width, name, seconds * 1000))
+    lines.append('%d compiled, %d up to date, %.2fms total' % (
+        len(compiled), len(results) - len(compiled),
+        sum(x[1] for x in compiled) * 1000))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    from optparse import OptionParser
+    from .bccache import FileSystemBytecodeCache
+    parser = OptionParser(usage='%prog [options] module:setup',
+                          description='Compiles all templates of a loader '
+                          'into a bytecode cache.  The setup callable has '
+                          'to return a (loader, config) tuple.')
+    parser.add_option('-d', '--cache-dir', dest='cache_dir',
+                      help='the directory of the bytecode cache')
+    parser.add_option('-j', '--jobs', dest='processes', type='int',
+                      help='number of worker processes (default: '
+                      'number of CPUs)')
+    parser.add_option('-f', '--force', dest='force', action='store_true',
+                      help='recompile templates that are up to date')
+    parser.add_option('-q', '--quiet', dest='quiet', action='store_true',
+                      help='do not print compile times')
+    options, args = parser.parse_args(args)
+    if len(args) != 1 or not options.cache_dir:
+        parser.error('a setup callable and a cache directory are required')
+    loader, config = import_string(args[0])()
+    results = precompile(loader, config,
+                         FileSystemBytecodeCache(options.cache_dir),
+                         processes=options.processes, force=options.force)
+    if not options.quiet:
+        print format_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.profiling
+    ~~~~~~~~~~~~~~~~~~~~
+
+    A deterministic profiler for the interpreter.  It records the number
+    of evaluations and the self and cumulative time of every node and of
+    every template line.  The regular :class:`~templatetk.interpreter.Interpreter`
+    is not touched, profiling only costs something if a
+    :class:`ProfilingInterpreter` is used.
+
+    The results can be loaded into :mod:`pstats`::
+
+        profiler = profile_template(template, context)[1]
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats()
+
+    For production there is the :class:`SamplingProfiler` which looks at
+    the stacks of compiled templates from a background thread.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import sys
+import threading
+from timeit import default_timer
+from types import GeneratorType
+
+from .interpreter import Interpreter
+from .bcinterp import template_filenames
+
+
+class _Entry(object):
+    __slots__ = ('calls', 'self_time', 'cumulative_time', 'callers')
+
+    def __init__(self):
+        self.calls = 0
+        self.self_time = 0.0
+        self.cumulative_time = 0.0
+        self.callers = {}
+
+
+class Profiler(object):
+    """Collects the timings of a :class:`ProfilingInterpreter`.  Nodes
+    are identified by ``(template_name, lineno, node_type)`` tuples and
+    lines by ``(template_name, lineno)`` tuples.  Statements are
+    generators, the time spent in them is the time spent producing their
+    events.  Time spent in recursive evaluation of the same node or line
+    only counts once for the cumulative time.
+    """
+
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.nodes = {}
+        self.lines = {}
+        self._stack = []
+        self._active = {}
+
+    def _enter(self, key, count):
+        line = key[:2]
+        node_entry = self.nodes.get(key)
+        if node_entry is None:
+            node_entry = self.nodes[key] = _Entry()
+        line_entry = self.lines.get(line)
+        if line_entry is None:
+            line_entry = self.lines[line] = _Entry()
+        if count:
+            node_entry.calls += 1
+            line_entry.calls += 1
+            if self._stack:
+                caller = self._stack[-1][0]
+                node_entry.callers[caller] = \
+                    node_entry.callers.get(caller, 0) + 1
+        for k in key, line:
+            self._active[k] = self._active.get(k, 0) + 1
+        self._stack.append([key, node_entry, line_entry, 0.0,
+                            self.timer()])
+
+    def _leave(self):
+        key, node_entry, line_entry, child_time, start = self._stack.pop()
+        elapsed = self.timer() - start
+        line = key[:2]
+        node_entry.self_time += elapsed - child_time
+        line_entry.self_time += elapsed - child_time
+        for k, entry in (key, node_entry), (line, line_entry):
+            self._active[k] -= 1
+            if not self._active[k]:
+                entry.cumulative_time += elapsed
+        if self._stack:
+            self._stack[-1][3] += elapsed
+
+    def call(self, key, func, *args):
+        """Calls `func` and records the time for `key`."""
+        self._enter(key, True)
+        try:
+            return func(*args)
+        finally:
+            self._leave()
+
+    def iter_generator(self, key, gen):
+        """Iterates over a generator returned by the visitor of a
+        statement and records the time spent in it for `key` without
+        counting another evaluation.
+        """
+        while 1:
+            self._enter(key, False)
+            try:
+                try:
+                    event = gen.next()
+                except StopIteration:
+                    return
+            finally:
+                self._leave()
+            yield event
+
+    def clear(self):
+        self.nodes.clear()
+        self.lines.clear()
+
+    def create_stats(self):
+        """Converts the node timings into the format of :mod:`pstats`.
+        Templates are the files, nodes types the functions.
+        """
+        self.stats = {}
+        for key, entry in self.nodes.iteritems():
+            callers = dict((self._pstats_key(caller), count)
+                           for caller, count in entry.callers.iteritems())
+            self.stats[self._pstats_key(key)] = (entry.calls, entry.calls,
+                entry.self_time, entry.cumulative_time, callers)
+
+    def _pstats_key(self, key):
+        template_name, lineno, node_type = key
+        if isinstance(template_name, unicode):
+            template_name = template_name.encode('utf-8')
+        return template_name or '<template>', lineno or 0, node_type
+
+    def iter_results(self, by='nodes', sort='cumulative'):
+        """Yields ``(key, calls, self_time, cumulative_time)`` tuples for
+        the nodes or lines, sorted by `sort` which is ``'cumulative'``,
+        ``'self'`` or ``'calls'`` (all descending).
+        """
+        index = {'calls': 1, 'self': 2, 'cumulative': 3}[sort]
+        results = [(key, entry.calls, entry.self_time, entry.cumulative_time)
+                   for key, entry in getattr(self, by).iteritems()]
+        results.sort(key=lambda x: (-x[index], x[0]))
+        return iter(results)
+
+    def format_report(self, by='nodes', sort='cumulative', limit=None):
+        """Returns the results as text table, see :meth:`iter_results`."""
+        lines = ['%8s %10s %10s  %s' % ('calls', 'self ms', 'cum ms',
+                                        'location')]
+        for idx, (key, calls, self_time, cumulative_time) in \
+                enumerate(self.iter_results(by, sort)):
+            if limit is not None and idx >= limit:
+                break
+            location = '%s:%s' % (key[0] or '<template>', key[1] or '?')
+            if len(key) > 2:
+                location += ' (%s)' % key[2]
+            lines.append('%8d %10.3f %10.3f  %s' % (
+                calls, self_time * 1000, cumulative_time * 1000, location))
+        return '\n'.join(lines)
+
+
+class ProfilingInterpreter(Interpreter):
+    """An interpreter that records the time spent in every node in a
+    :class:`Profiler`.
+    """
+
+    def __init__(self, config, profiler=None):
+        Interpreter.__init__(self, config)
+        if profiler is None:
+            profiler = Profiler()
+        self.profiler = profiler
+
+    def visit(self, node, state):
+        key = (state.info.template_name, node.lineno,
+               node.__class__.__name__)
+        rv = self.profiler.call(key, Interpreter.visit, self, node, state)
+        if isinstance(rv, GeneratorType):
+            rv = self.profiler.iter_generator(key, rv)
+        return rv
+
+
+def profile_template(template, context, profiler=None):
+    """Renders an :class:`~templatetk.frontend.InterpretedTemplate` with a
+    profiling interpreter and returns the rendered string and the
+    profiler.  Blocks of the template are profiled too, templates it
+    includes, imports or extends are rendered the way the config
+    renders them.
+    """
+    interpreter = ProfilingInterpreter(template.config, profiler)
+    state = template.interpreter_state_class(template.config, template.name,
+                                             vars=context)
+    rv = template.concat_events(interpreter.execute(template.node, state))
+    return rv, interpreter.profiler
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of all threads every `interval` seconds in a
+    background thread.  Only the frames of compiled templates are kept,
+    they are found by the filenames the templates were compiled with and
+    their line numbers are the template lines.  Templates that include or
+    extend each other show up as one stack.  The stacks are counted in
+    `stacks` in the collapsed format of flamegraph tools: the frames from
+    the outermost to the innermost as ``template:function:line`` joined
+    by semicolons.  Interpreted templates are not visible to the sampler.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get_stack(self, frame):
+        """Returns the collapsed template stack of a frame or `None` if
+        no template is on it.
+        """
+        rv = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename in template_filenames:
+                rv.append('%s:%s:%d' % (code.co_filename, code.co_name,
+                                        frame.f_lineno))
+            frame = frame.f_back
+        if rv:
+            rv.reverse()
+            return ';'.join(rv)
+
+    def sample(self):
+        """Takes one sample of all threads except the calling one."""
+        current = threading.current_thread().ident
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != current:
+                stack = self.get_stack(frame)
+                if stack is not None:
+                    stacks.append(stack)
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        """Starts sampling in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def clear(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def format_collapsed(self):
+        """Returns the stacks in the collapsed format that flamegraph
+        tools read, one ``stack count`` line per stack.
+        """
+        with self._lock:
+            items = sorted(self.stacks.items())
+        return ''.join('%s %d\n' % item for item in items)
@@ -8,8 +8,19 @@
     :copyright: (c) Copyright 2011 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
+from __future__ import with_statement
+
+import os
+import sys
+import atexit
+import weakref
+import threading
+from Queue import Queue
+from timeit import default_timer
+
 from .exceptions import BlockNotFoundException, BlockLevelOverflowException, \
      TemplateNotFound, TemplatesNotFound
+from .utils import missing
 
 
 class RuntimeInfo(object):
@@ -26,28 +37,66 @@ class RuntimeInfo(object):
         self.volatile = False
         self.filters = config.get_filters()
         self.block_executers = {}
+        self.shared_blocks = False
         self.template_cache = {}
+        self.autoescape_cache = {template_name: self.autoescape}
         self.exports = {}
+        self.behavior = 'template'
+        self.fragment_dispatcher = None
+        if config.parallel_fragments:
+            self.fragment_dispatcher = config.get_fragment_dispatcher()
+
+    def copy(self):
+        """Returns a copy of the info that can be used to render the same
+        template again.  Registered blocks and the template cache are
+        kept, the exports start out empty.
+        """
+        rv = object.__new__(self.__class__)
+        rv.__dict__.update(self.__dict__)
+        rv.block_executers = dict((name, executors[:]) for name, executors
+                                  in self.block_executers.iteritems())
+        rv.shared_blocks = False
+        rv.exports = {}
+        return rv
 
     def get_template(self, template_name):
         """Gets a template from cache or if it's not there, it will newly
         load it and cache it.
         """
+        rv = self.find_template(template_name)
+        if rv is missing:
+            raise TemplateNotFound(self.config.join_path(self.template_name,
+                                                         template_name))
+        return rv
+
+    def find_template(self, template_name):
+        """Like :meth:`get_template` but returns `missing` instead of
+        raising an exception if the loader cache knows that the template
+        does not exist.
+        """
         template_name = self.config.join_path(self.template_name,
                                               template_name)
 
         if template_name in self.template_cache:
             return self.template_cache[template_name]
-        rv = self.config.get_template(template_name)
+        loader_cache = self.config.loader_cache
+        if loader_cache is not None:
+            rv = loader_cache.lookup(template_name, self.config.get_template)
+            if rv is missing:
+                return rv
+        else:
+            rv = self.config.get_template(template_name)
         self.template_cache[template_name] = rv
         return rv
 
     def select_template(self, template_names):
         for name in template_names:
             try:
-                return self.get_template(name)
+                rv = self.find_template(name)
             except TemplateNotFound:
-                pass
+                continue
+            if rv is not missing:
+                return rv
         raise TemplatesNotFound(template_names)
 
     def get_or_select_template(self, template_name_or_list):
@@ -84,6 +133,9 @@ class RuntimeInfo(object):
         return obj(*args, **kwargs)
 
     def register_block(self, name, executor):
+        if self.shared_blocks:
+            self.block_executers = dict(self.block_executers)
+            self.shared_blocks = False
         self.block_executers.setdefault(name, []).append(executor)
 
     def evaluate_block(self, name, level=1, vars=None):
@@ -93,22 +145,77 @@ class RuntimeInfo(object):
             raise BlockNotFoundException(name)
         except IndexError:
             raise BlockLevelOverflowException(name, level)
+        cache = self.config.fragment_cache
+        if cache is not None:
+            signature = getattr(func, 'fragment_signature', None)
+            if signature is not None:
+                return cache.render_fragment(signature, vars, self.autoescape,
+                                             lambda: func(self, vars))
         return func(self, vars)
 
+    def include_template(self, template, vars):
+        """Renders an included template with this info."""
+        cache = self.config.fragment_cache
+        if cache is not None:
+            signature = self.config.get_fragment_signature(template)
+            if signature is not None:
+                return cache.render_fragment(signature, vars, self.autoescape,
+                    lambda: self.yield_from_template(template, vars))
+        return self.yield_from_template(template, vars)
+
+    def yield_from_template(self, template, vars):
+        """Renders a template that was extended, included or imported with
+        this info.
+        """
+        return self.config.yield_from_template(template, self, vars)
+
+    def observe_render(self, events):
+        """Called by the frontends with the events of a template render.
+        Returns them unchanged unless the info is traced.
+        """
+        return events
+
     def make_info(self, template, template_name, behavior='extends'):
+        """Creates the info for a template that is extended, included or
+        imported from this one.  The filters, the template cache and the
+        fragment dispatcher are shared with this info, the autoescape
+        default is only looked up once per template name.  For extends the
+        registered blocks are shared until the new info registers its own.
+        """
         assert behavior in ('extends', 'include', 'import')
-        rv = self.__class__(self.config, template_name)
-        rv.template_cache = self.template_cache
+        rv = object.__new__(self.__class__)
+        rv.__dict__.update(self.__dict__)
+        rv.template_name = template_name
+        try:
+            rv.autoescape = self.autoescape_cache[template_name]
+        except KeyError:
+            rv.autoescape = self.autoescape_cache[template_name] = \
+                self.config.get_autoescape_default(template_name)
+        rv.volatile = False
+        rv.exports = {}
+        rv.behavior = behavior
         if behavior == 'extends':
-            rv.block_executers.update(self.block_executers)
+            rv.shared_blocks = True
+        else:
+            rv.block_executers = {}
+            rv.shared_blocks = False
         return rv
 
     def make_module(self, gen):
         """Make this info and evaluated template generator into a module."""
-        body = list(gen)
+        body = list(resolve_fragments(gen))
         return self.config.make_module(self.template_name, self.exports,
                                        body)
 
+    def dispatch_fragment(self, func, *args):
+        """Schedules `func` to be called with the given arguments in
+        parallel to the rest of the template.  The return value has to be
+        an iterable of events.  This returns a :class:`Fragment` that has
+        to be emitted instead of the events and is resolved later by
+        :func:`resolve_fragments`.
+        """
+        return self.fragment_dispatcher.dispatch(func, args)
+
     def make_callout_context(self, lookup):
         return self.config.make_callout_context(self, lookup)
 
@@ -116,6 +223,240 @@ class RuntimeInfo(object):
         return self.config.finalize(value, self.autoescape)
 
 
+class Observer(object):
+    """Base class for objects that observe renders.  Observers are
+    registered in the `observers` list of the config, as long as the list
+    is empty the runtime does not call any hooks.  `kind` is one of
+    ``'template'``, ``'include'``, ``'import'``, ``'extends'``,
+    ``'block'``, ``'filter'`` and ``'call'``, `name` the name of the
+    template, block or filter or the called object.  With parallel
+    fragments the hooks are called from worker threads too.
+    """
+
+    def start(self, kind, name, info):
+        pass
+
+    def end(self, kind, name, info, seconds):
+        pass
+
+
+class TraceRecorder(Observer):
+    """An observer that records ``(kind, name, seconds, depth)`` tuples
+    in `trace` in the order the operations finish.  `depth` is the
+    nesting level of the operation in its thread.
+    """
+
+    def __init__(self):
+        self.trace = []
+        self._local = threading.local()
+
+    def start(self, kind, name, info):
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+
+    def end(self, kind, name, info, seconds):
+        self._local.depth -= 1
+        self.trace.append((kind, name, seconds, self._local.depth))
+
+
+class TracingRuntimeInfoMixin(object):
+    """Reports the renders of templates and blocks and calls of filters
+    and functions to the observers of the config.  The time of a render
+    is the time spent producing its events.
+    """
+
+    def _notify_start(self, kind, name):
+        for observer in self.config.observers:
+            observer.start(kind, name, self)
+
+    def _notify_end(self, kind, name, seconds):
+        for observer in self.config.observers:
+            observer.end(kind, name, self, seconds)
+
+    def _observe_call(self, kind, name, func, *args):
+        self._notify_start(kind, name)
+        start = default_timer()
+        try:
+            return func(*args)
+        finally:
+            self._notify_end(kind, name, default_timer() - start)
+
+    def _observe_events(self, kind, name, events):
+        seconds = 0.0
+        self._notify_start(kind, name)
+        try:
+            iterator = iter(events)
+            while 1:
+                start = default_timer()
+                try:
+                    event = iterator.next()
+                except StopIteration:
+                    return
+                finally:
+                    seconds += default_timer() - start
+                yield event
+        finally:
+            self._notify_end(kind, name, seconds)
+
+    def observe_render(self, events):
+        return self._observe_events('template', self.template_name, events)
+
+    def yield_from_template(self, template, vars):
+        return self._observe_events(self.behavior, self.template_name,
+            super(TracingRuntimeInfoMixin, self).yield_from_template(
+                template, vars))
+
+    def evaluate_block(self, name, level=1, vars=None):
+        return self._observe_events('block', name,
+            super(TracingRuntimeInfoMixin, self).evaluate_block(
+                name, level, vars))
+
+    def call_filter(self, name, obj, args, kwargs):
+        return self._observe_call('filter', name,
+            super(TracingRuntimeInfoMixin, self).call_filter,
+            name, obj, args, kwargs)
+
+    def call(self, obj, args, kwargs):
+        return self._observe_call('call', getattr(obj, '__name__', obj),
+            super(TracingRuntimeInfoMixin, self).call, obj, args, kwargs)
+
+
+_tracing_classes = {}
+
+
+def get_runtime_info_class(config, info_class=RuntimeInfo):
+    """Returns the runtime info class to use for the config.  If the
+    config has observers this is a tracing subclass of `info_class`.
+    """
+    if not config.observers:
+        return info_class
+    rv = _tracing_classes.get(info_class)
+    if rv is None:
+        rv = _tracing_classes[info_class] = type('Tracing' +
+            info_class.__name__, (TracingRuntimeInfoMixin, info_class), {})
+    return rv
+
+
+class Fragment(object):
+    """A placeholder in the event stream for output that is rendered
+    independently of the template that emitted it.  If the fragment was
+    not picked up by a worker thread it is rendered on demand by the
+    thread that resolves it.
+    """
+
+    def __init__(self, func, args):
+        self._func = func
+        self._args = args
+        self._finished = None
+        self._result = None
+        self._exc_info = None
+
+    def render(self):
+        try:
+            events = self._func(*self._args)
+            self._result = u''.join(resolve_fragments(events))
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._func = self._args = None
+
+    def get_result(self):
+        """Waits for the fragment to finish rendering and returns the
+        output.  Exceptions from the rendering are reraised here.
+        """
+        if self._finished is not None:
+            self._finished.wait()
+        elif self._func is not None:
+            self.render()
+        if self._exc_info is not None:
+            exc_type, exc_value, tb = self._exc_info
+            raise exc_type, exc_value, tb
+        return self._result
+
+
+class FragmentDispatcher(object):
+    """A pool of at most `max_workers` worker threads that render
+    fragments.  The threads are started on demand and kept around for the
+    following fragments.  Fragments dispatched while all workers are busy
+    are rendered lazily when the output is resolved.  Because of that
+    nested fragments can never deadlock waiting for a worker.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._threads = []
+        self._idle = 0
+        self._shutdown = False
+        _dispatchers.add(self)
+
+    def dispatch(self, func, args):
+        fragment = Fragment(func, args)
+        with self._lock:
+            if self._shutdown:
+                return fragment
+            elif self._idle:
+                self._idle -= 1
+            elif len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work,
+                    name='fragment-worker-%d' % (len(self._threads) + 1))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            else:
+                return fragment
+        # every queued fragment has a worker that is waiting for it
+        fragment._finished = threading.Event()
+        self._queue.put(fragment)
+        return fragment
+
+    def shutdown(self):
+        """Stops the worker threads once they finished their fragments.
+        Fragments dispatched afterwards are rendered lazily.
+        """
+        with self._lock:
+            self._shutdown = True
+            threads = self._threads[:]
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _work(self):
+        while 1:
+            fragment = self._queue.get()
+            if fragment is None:
+                return
+            try:
+                fragment.render()
+            finally:
+                fragment._finished.set()
+            with self._lock:
+                self._idle += 1
+
+
+#: the dispatchers that are shut down when the interpreter exits, blocked
+#: daemon threads would fail while the modules are torn down otherwise
+_dispatchers = weakref.WeakSet()
+
+
+@atexit.register
+def _shutdown_dispatchers():
+    for dispatcher in list(_dispatchers):
+        if dispatcher.pid == os.getpid():
+            dispatcher.shutdown()
+
+
+def resolve_fragments(events):
+    """Replaces :class:`Fragment` objects in an iterable of events with
+    their rendered output, preserving the document order.
+    """
+    for event in events:
+        if event.__class__ is Fragment:
+            event = event.get_result()
+        yield event
+
+
 class Function(object):
     """Wraps a function.  Currently pretty much a noop but can be used
     to further customize the calling behavior.
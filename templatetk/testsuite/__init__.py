@@ -55,8 +55,17 @@ class TemplateTestCase(unittest.TestCase):
 
 
 def suite():
-    from . import interpreter, bcinterp
+    from . import interpreter, bcinterp, frontend, cache, analysis, \
+         optimizer, precompile, profiling, metrics, benchmarks
     suite = unittest.TestSuite()
     suite.addTest(interpreter.suite())
     suite.addTest(bcinterp.suite())
+    suite.addTest(frontend.suite())
+    suite.addTest(cache.suite())
+    suite.addTest(analysis.suite())
+    suite.addTest(optimizer.suite())
+    suite.addTest(precompile.suite())
+    suite.addTest(profiling.suite())
+    suite.addTest(metrics.suite())
+    suite.addTest(benchmarks.suite())
     return suite
@@ -11,8 +11,12 @@
 """
 from . import TemplateTestCase
 from .. import nodes
+from ..analysis import get_fragment_signature
+from ..cache import FragmentCache
 from ..config import Config
 from ..exceptions import TemplateNotFound
+from ..runtime import RuntimeInfo, TraceRecorder, resolve_fragments, \
+     get_runtime_info_class
 
 
 class _SimpleTemplate(object):
@@ -76,6 +80,8 @@ class BasicExecTestCase(TemplateTestCase):
                                                   config=self, info=info)
             def iter_template_blocks(self, template):
                 return test_case.iter_template_blocks(template, self)
+            def get_fragment_signature(self, template):
+                return get_fragment_signature(template.node, self)
             def make_module(self, template_name, exports, body):
                 return Module(template_name, exports, ''.join(body))
             def make_callout_context(self, info, lookup):
@@ -185,6 +191,20 @@ class ForLoopTestCase(object):
             iterable=[1, 2, 3, 4]
         ), '1234')
 
+    def test_loop_target_in_nested_frame(self):
+        n = nodes
+        template = n.Template([
+            n.For(n.Name('item', 'store'), n.Name('iterable', 'load'), [
+                n.If(n.Name('item', 'load'), [
+                    n.Output([n.Name('item', 'load')])
+                ], [])
+            ], None)
+        ])
+
+        self.assert_result_matches(template, dict(
+            iterable=[1, 0, 2]
+        ), '12')
+
     def test_loop_with_counter(self):
         n = nodes
         template = n.Template([
@@ -328,6 +348,26 @@ class ForLoopTestCase(object):
         self.assert_result_matches(template, dict(iterable=[(1,)]),
             '1;<whoop>', config=config)
 
+    def test_mixed_loop_unpacking(self):
+        config = Config()
+        config.undefined_variable = lambda x: '<%s>' % x
+
+        n = nodes
+        template = n.Template([
+            n.For(n.Tuple([n.Name('key', 'store'), n.Name('value', 'store')],
+                          'store'), n.Name('iterable', 'load'), [
+                n.Output([n.Name('key', 'load'), n.Const('='),
+                          n.Name('value', 'load'), n.Const(';')])
+            ], None)
+        ])
+
+        self.assert_result_matches(template, dict(
+            iterable=[(1, 2), [3, 4], 'ab', (5, 6, 7), (8, 9)]
+        ), '1=2;3=4;a=b;5=6;8=9;', config=config)
+        self.assert_result_matches(template, dict(
+            iterable=sorted(dict(a=1, b=2).items())
+        ), 'a=1;b=2;', config=config)
+
     def test_loop_controls(self):
         n = nodes
         template = n.Template([
@@ -668,6 +708,64 @@ class IncludeTestCase(object):
         self.assert_result_matches(index_template, dict(),
             '1\n\n2', config=config)
 
+    def test_include_shares_runtime_info(self):
+        n = nodes
+
+        index_template = n.Template([
+            n.Extends(n.Const('layout.html')),
+            n.Block('body', [
+                n.For(n.Name('item', 'store'), n.Name('items', 'load'), [
+                    n.Include(n.Const('item.html'), False)
+                ], [])
+            ])
+        ])
+        config = self.make_inheritance_config({
+            'layout.html':  n.Template([
+                n.Output([n.Const('<')]),
+                n.Block('body', []),
+                n.Output([n.Const('>')])
+            ]),
+            'item.html':    n.Template([
+                n.Output([n.Filter(n.Name('item', 'load'), 'upper',
+                                   [], [], None, None)])
+            ])
+        })
+        calls = []
+        def get_filters():
+            calls.append('filters')
+            return {'upper': lambda x: x.upper()}
+        def get_autoescape_default(template_name):
+            calls.append(template_name)
+            return False
+        config.get_filters = get_filters
+        config.get_autoescape_default = get_autoescape_default
+
+        self.assert_result_matches(index_template, dict(items='abc'),
+            '<ABC>', config=config)
+        self.assert_equal(calls.count('filters'), 1)
+        self.assert_equal(calls.count('item.html'), 1)
+        self.assert_equal(calls.count('layout.html'), 1)
+
+    def test_include_in_constant_loop(self):
+        n = nodes
+
+        index_template = n.Template([
+            n.For(n.Name('x', 'store'), n.Const(['a', 'b']), [
+                n.Include(n.Const('include.html'), False)
+            ], [])
+        ])
+        include_template = n.Template([
+            n.Output([n.Getattr(n.Name('loop', 'load'), n.Const('index')),
+                      n.Name('x', 'load'), n.Const(';')])
+        ])
+        config = self.make_inheritance_config({
+            'index.html':       index_template,
+            'include.html':     include_template
+        })
+
+        self.assert_result_matches(index_template, dict(),
+            '1a;2b;', config=config)
+
 
 class ImportTestCase(object):
 
@@ -796,6 +894,264 @@ class CallOutTestCase(object):
                                    '23|42', config=config)
 
 
+class ParallelFragmentTestCase(object):
+
+    def make_parallel_config(self, templates, workers=4):
+        config = self.make_inheritance_config(templates)
+        config.parallel_fragments = workers
+        return config
+
+    def render_parallel(self, node, ctx, config):
+        node.set_config(config)
+        return u''.join(resolve_fragments(self.execute(node, ctx, config)))
+
+    def test_parallel_includes(self):
+        import threading
+        n = nodes
+
+        def thread_name():
+            return threading.current_thread().name
+
+        index_template = n.Template([
+            n.Output([n.Const('1;')]),
+            n.Include(n.Const('a.html'), False),
+            n.Include(n.Const('b.html'), False),
+            n.Output([n.Const('2')])
+        ])
+        config = self.make_parallel_config({
+            'a.html':   n.Template([n.Output([n.Const('A'), n.Call(
+                n.Name('thread_name', 'load'), [], [], None, None),
+                n.Const(';')])]),
+            'b.html':   n.Template([n.Output([n.Const('B'), n.Name('x', 'load'),
+                                              n.Const(';')])])
+        })
+
+        rv = self.render_parallel(index_template, dict(
+            thread_name=thread_name, x=42), config)
+        self.assert_equal(rv[:3], '1;A')
+        self.assert_equal(rv[-6:], ';B42;2')
+        self.assert_not_equal(rv[3:-6], threading.current_thread().name)
+
+    def test_parallel_worker_pool(self):
+        import threading
+        n = nodes
+        names = set()
+
+        def thread_name():
+            names.add(threading.current_thread().name)
+            return u''
+
+        index_template = n.Template([
+            n.Include(n.Const('%d.html' % x), False) for x in xrange(4)
+        ])
+        config = self.make_parallel_config(dict(
+            ('%d.html' % x, n.Template([n.Output([n.Const(str(x)), n.Call(
+                n.Name('thread_name', 'load'), [], [], None, None)])]))
+            for x in xrange(4)), workers=2)
+        index_template.set_config(config)
+        results = []
+
+        def render():
+            for x in xrange(5):
+                results.append(self.render_parallel(index_template, dict(
+                    thread_name=thread_name), config))
+        threads = [threading.Thread(target=render) for x in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assert_equal(results, ['0123'] * 20)
+        workers = [x for x in names if x.startswith('fragment-worker-')]
+        assert 0 < len(workers) <= 2, names
+        self.assert_equal(len(config.get_fragment_dispatcher()._threads),
+                          len(workers))
+
+    def test_parallel_fragments_over_limit(self):
+        n = nodes
+
+        index_template = n.Template([
+            n.Include(n.Const('%d.html' % x), False) for x in xrange(5)
+        ])
+        config = self.make_parallel_config(dict(
+            ('%d.html' % x, n.Template([n.Output([n.Const(str(x))])]))
+            for x in xrange(5)), workers=1)
+
+        rv = self.render_parallel(index_template, dict(), config)
+        self.assert_equal(rv, '01234')
+
+    def test_parallel_blocks(self):
+        n = nodes
+
+        index_template = n.Template([
+            n.Assign(n.Name('foo', 'store'), n.Const(42)),
+            n.Block('the_block', [n.Output([n.Name('foo', 'load')])]),
+            n.Output([n.Const(';')]),
+            n.Block('other_block', [n.Output([n.Const('other')])])
+        ])
+        config = self.make_parallel_config({})
+
+        rv = self.render_parallel(index_template, dict(), config)
+        self.assert_equal(rv, '42;other')
+
+    def test_parallel_errors(self):
+        n = nodes
+
+        def fail():
+            raise ZeroDivisionError()
+
+        index_template = n.Template([
+            n.Include(n.Const('fail.html'), False)
+        ])
+        config = self.make_parallel_config({
+            'fail.html':    n.Template([n.Output([n.Call(n.Name('fail', 'load'),
+                                                         [], [], None, None)])])
+        })
+
+        with self.assert_raises(ZeroDivisionError):
+            self.render_parallel(index_template, dict(fail=fail), config)
+
+
+class FragmentCacheTestCase(object):
+
+    def make_counter(self):
+        calls = []
+        def counter(value=None):
+            calls.append(1)
+            return len(calls)
+        return counter, calls
+
+    def make_count(self):
+        return nodes.Filter(nodes.Const(None), 'count', [], [], None, None)
+
+    def test_cached_blocks(self):
+        n = nodes
+        counter, calls = self.make_counter()
+        config = Config()
+        config.get_filters = lambda: {'count': counter}
+        config.fragment_cache = FragmentCache()
+
+        template = n.Template([
+            n.Block('the_block', [
+                n.Output([n.Name('title', 'load'), n.Const(':'),
+                          self.make_count()])
+            ])
+        ])
+
+        ctx = dict(title='foo')
+        self.assert_result_matches(template, ctx, 'foo:1', config=config)
+        self.assert_result_matches(template, ctx, 'foo:1', config=config)
+        ctx['title'] = 'bar'
+        self.assert_result_matches(template, ctx, 'bar:2', config=config)
+        self.assert_equal(len(calls), 2)
+        self.assert_equal(config.fragment_cache.hits, 1)
+        self.assert_equal(config.fragment_cache.misses, 2)
+
+    def test_cached_includes(self):
+        n = nodes
+        counter, calls = self.make_counter()
+
+        index_template = n.Template([
+            n.Include(n.Const('widget.html'), False),
+            n.Output([n.Const(';')]),
+            n.Include(n.Const('widget.html'), False)
+        ])
+        config = self.make_inheritance_config({
+            'widget.html':  n.Template([n.Output([self.make_count()])])
+        })
+        config.get_filters = lambda: {'count': counter}
+        config.fragment_cache = FragmentCache()
+
+        self.assert_result_matches(index_template, dict(), '1;1',
+                                   config=config)
+        self.assert_equal(len(calls), 1)
+
+    def test_callables_not_cached(self):
+        n = nodes
+        counter, calls = self.make_counter()
+        config = Config()
+        config.fragment_cache = FragmentCache()
+
+        template = n.Template([
+            n.Block('the_block', [
+                n.Output([n.Call(n.Name('counter', 'load'), [], [],
+                                 None, None)])
+            ])
+        ])
+
+        ctx = dict(counter=counter)
+        self.assert_result_matches(template, ctx, '1', config=config)
+        self.assert_result_matches(template, ctx, '2', config=config)
+        self.assert_equal(config.fragment_cache.hits, 0)
+        self.assert_equal(config.fragment_cache.uncacheable, 2)
+
+    def test_dynamic_fragments_not_cached(self):
+        n = nodes
+        counter, calls = self.make_counter()
+
+        index_template = n.Template([
+            n.Block('the_block', [
+                n.Include(n.Const('widget.html'), False)
+            ])
+        ])
+        config = self.make_inheritance_config({
+            'widget.html':  n.Template([n.Output([self.make_count()])])
+        })
+        config.get_filters = lambda: {'count': counter}
+        config.fragment_cache = FragmentCache()
+        config.get_fragment_signature = lambda template: None
+
+        self.assert_result_matches(index_template, dict(), '1',
+                                   config=config)
+        self.assert_result_matches(index_template, dict(), '2',
+                                   config=config)
+
+
+class ObserverTestCase(object):
+
+    def test_trace(self):
+        n = nodes
+        index_template = n.Template([
+            n.Extends(n.Const('layout.html')),
+            n.Block('body', [
+                n.For(n.Name('item', 'store'), n.Name('items', 'load'), [
+                    n.Include(n.Const('item.html'), False)
+                ], [])
+            ])
+        ])
+        config = self.make_inheritance_config({
+            'layout.html':  n.Template([
+                n.Output([n.Call(n.Name('title', 'load'), [], [],
+                                 None, None)]),
+                n.Block('body', [])
+            ]),
+            'item.html':    n.Template([
+                n.Output([n.Filter(n.Name('item', 'load'), 'upper',
+                                   [], [], None, None)])
+            ])
+        })
+        config.get_filters = lambda: {'upper': lambda x: x.upper()}
+        assert get_runtime_info_class(config) is RuntimeInfo
+        recorder = TraceRecorder()
+        config.observers.append(recorder)
+
+        def title():
+            return 'T:'
+        self.assert_result_matches(index_template, dict(items='ab',
+            title=title), 'T:AB', config=config)
+        self.assert_equal([x[:2] + x[3:] for x in recorder.trace], [
+            ('call', 'title', 1),
+            ('filter', 'upper', 3),
+            ('include', 'item.html', 2),
+            ('filter', 'upper', 3),
+            ('include', 'item.html', 2),
+            ('block', 'body', 1),
+            ('extends', 'layout.html', 0)
+        ])
+        for kind, name, seconds, depth in recorder.trace:
+            assert seconds >= 0
+
+
 def make_suite(test_class, module):
     import unittest
 
@@ -812,6 +1168,9 @@ def make_suite(test_class, module):
     suite.addTest(unittest.makeSuite(mixin(InheritanceTestCase)))
     suite.addTest(unittest.makeSuite(mixin(IncludeTestCase)))
     suite.addTest(unittest.makeSuite(mixin(ImportTestCase)))
+    suite.addTest(unittest.makeSuite(mixin(ObserverTestCase)))
     suite.addTest(unittest.makeSuite(mixin(FunctionTestCase)))
     suite.addTest(unittest.makeSuite(mixin(CallOutTestCase)))
+    suite.addTest(unittest.makeSuite(mixin(ParallelFragmentTestCase)))
+    suite.addTest(unittest.makeSuite(mixin(FragmentCacheTestCase)))
     return suite
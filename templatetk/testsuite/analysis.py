@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.analysis
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the static analysis.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+from . import TemplateTestCase
+from .. import nodes
+from ..analysis import analyze_template, resolve_free_variables
+from ..config import Config
+from ..exceptions import TemplateNotFound
+from ..frontend import CompiledTemplate, InterpretedTemplate
+
+
+class DependencyAnalysisTestCase(TemplateTestCase):
+
+    def test_scoping(self):
+        n = nodes
+        template = n.Template([
+            n.Assign(n.Name('a', 'store'), n.Name('b', 'load')),
+            n.Output([n.Name('a', 'load')]),
+            n.For(n.Name('item', 'store'), n.Name('items', 'load'), [
+                n.Output([n.Name('item', 'load'), n.Name('c', 'load')]),
+                n.Assign(n.Name('d', 'store'), n.Const(1))
+            ], None),
+            n.Output([n.Name('d', 'load')]),
+            n.Assign(n.Name('f', 'store'), n.Function(n.Const('f'),
+                [n.Name('x', 'param')], [], [
+                n.Output([n.Name('x', 'load'), n.Name('y', 'load')])
+            ]))
+        ])
+        deps, blocks = analyze_template(template, Config())
+        self.assert_equal(sorted(deps.names),
+                          ['b', 'c', 'd', 'items', 'loop', 'y'])
+        self.assert_equal(deps.references, ())
+        self.assert_equal(deps.dynamic, False)
+
+    def test_blocks_and_references(self):
+        n = nodes
+        template = n.Template([
+            n.Extends(n.Const('layout.html')),
+            n.Block('title', [n.Output([n.Name('title', 'load')])]),
+            n.Block('body', [
+                n.Include(n.Name('widget', 'load'), False),
+                n.Import(n.Const('helpers.html'), n.Name('helpers', 'store')),
+                n.Output([n.Name('helpers', 'load')])
+            ])
+        ])
+        deps, blocks = analyze_template(template, Config())
+        self.assert_equal(sorted(deps.names), ['title', 'widget'])
+        self.assert_equal(deps.references, (('extends', ('layout.html',)),
+                                            ('include', None),
+                                            ('import', ('helpers.html',))))
+        self.assert_equal(sorted(blocks), ['body', 'title'])
+        self.assert_equal(sorted(blocks['title'].names), ['title'])
+
+    def test_resolve(self):
+        n = nodes
+        templates = {
+            'index.html':   n.Template([
+                n.Include(n.Const('a.html'), False),
+                n.Include(n.Const(['missing.html', 'b.html']), True),
+                n.Output([n.Name('x', 'load')])
+            ]),
+            'a.html':       n.Template([
+                n.Include(n.Const('index.html'), False),
+                n.Output([n.Name('y', 'load')])
+            ]),
+            'b.html':       n.Template([n.Output([n.Name('z', 'load')])])
+        }
+        config = Config()
+
+        def load(name):
+            try:
+                return analyze_template(templates[name], config)[0]
+            except KeyError:
+                raise TemplateNotFound(name)
+
+        rv = resolve_free_variables(load('index.html'), load)
+        self.assert_equal(sorted(rv), ['x', 'y', 'z'])
+        self.assert_equal(rv.unknown, (('include', 'missing.html'),))
+        self.assert_equal(rv.complete, False)
+
+
+class TemplateFreeVariablesTestCase(TemplateTestCase):
+
+    def assert_free_variables(self, template_class):
+        n = nodes
+        templates = {}
+
+        class MyConfig(Config):
+            def get_template(self, name):
+                try:
+                    return templates[name]
+                except KeyError:
+                    raise TemplateNotFound(name)
+
+        config = MyConfig()
+        for name, node in {
+            'index.html':   n.Template([
+                n.Extends(n.Const('layout.html')),
+                n.Block('body', [n.Output([n.Name('body', 'load')])])
+            ]),
+            'layout.html':  n.Template([
+                n.Output([n.Name('title', 'load')]),
+                n.Block('body', [n.Include(n.Const('footer.html'), False)])
+            ]),
+            'footer.html':  n.Template([n.Output([n.Name('year', 'load')])])
+        }.iteritems():
+            node.set_config(config)
+            templates[name] = template_class(name, config, node)
+
+        index = templates['index.html']
+        self.assert_equal(sorted(index.free_variables),
+                          ['body', 'title', 'year'])
+        self.assert_equal(index.free_variables.complete, True)
+        self.assert_equal(sorted(index.get_block_free_variables('body')),
+                          ['body'])
+        layout = templates['layout.html']
+        self.assert_equal(sorted(layout.get_block_free_variables('body')),
+                          ['year'])
+
+    def assert_nested_block_free_variables(self, template_class):
+        n = nodes
+        node = n.Template([
+            n.Block('outer', [
+                n.Output([n.Name('a', 'load')]),
+                n.Block('inner', [n.Output([n.Name('b', 'load')])])
+            ])
+        ]).set_config(Config())
+        t = template_class('index.html', node.config, node)
+        outer = t.get_block_free_variables('outer')
+        self.assert_equal(sorted(outer), ['a', 'b'])
+        self.assert_equal(outer.complete, True)
+        self.assert_equal(sorted(t.get_block_free_variables('inner')), ['b'])
+
+    def test_compiled_free_variables(self):
+        self.assert_free_variables(CompiledTemplate)
+
+    def test_compiled_nested_block_free_variables(self):
+        self.assert_nested_block_free_variables(CompiledTemplate)
+
+    def test_interpreted_nested_block_free_variables(self):
+        self.assert_nested_block_free_variables(InterpretedTemplate)
+
+    def test_interpreted_free_variables(self):
+        self.assert_free_variables(InterpretedTemplate)
+
+
+def suite():
+    import unittest
+
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DependencyAnalysisTestCase))
+    suite.addTest(unittest.makeSuite(TemplateFreeVariablesTestCase))
+    return suite
@@ -10,17 +10,20 @@
 """
 from __future__ import with_statement
 
-from . import _basicexec
+from . import _basicexec, TemplateTestCase
 
 from .. import nodes
-from ..bcinterp import run_bytecode, RuntimeState
+from ..bcinterp import to_bytecode, run_bytecode, RuntimeState, \
+     OverlayContext
 
 
 class BCInterpTestCase(_basicexec.BasicExecTestCase):
+    compile_options = {}
 
     def get_exec_namespace(self, node, ctx, config, info=None):
         rtstate = RuntimeState(ctx, config, 'dummy', info)
-        return run_bytecode(node, '<dummy>'), rtstate
+        code = to_bytecode(node, '<dummy>', **self.compile_options)
+        return run_bytecode(code), rtstate
 
     def _execute(self, node, ctx, config, info):
         ns, rtstate = self.get_exec_namespace(node, ctx, config, info)
@@ -39,5 +42,50 @@ class BCInterpTestCase(_basicexec.BasicExecTestCase):
         return rtstate.info.exports['__result__']
 
 
+class OptimizedBCInterpTestCase(BCInterpTestCase):
+    compile_options = {'eliminate_dead_code': True,
+                       'partial_evaluation': True}
+
+
+class OverlayContextTestCase(TemplateTestCase):
+
+    def test_lookups(self):
+        root = {'a': 1, 'b': 2}
+        ctx = OverlayContext(root, ('b', 'c'), (3, 4))
+        self.assert_equal(ctx['a'], 1)
+        self.assert_equal(ctx['b'], 3)
+        self.assert_equal(ctx['c'], 4)
+        with self.assert_raises(KeyError):
+            ctx['d']
+        assert 'a' in ctx and 'c' in ctx
+        assert 'd' not in ctx
+        self.assert_equal(sorted(ctx), ['a', 'b', 'c'])
+
+    def test_nesting(self):
+        root = {'a': 1}
+        ctx = root
+        for x in xrange(100):
+            ctx = OverlayContext(ctx, ('x', 'x%d' % x), (x, x))
+        self.assert_equal(ctx['x'], 99)
+        self.assert_equal(ctx['x0'], 0)
+        self.assert_equal(ctx['a'], 1)
+        self.assert_equal(len(list(ctx)), 102)
+        locals, parent = ctx._resolve()
+        assert parent is root
+
+    def test_lazy_capture(self):
+        inner = OverlayContext({}, ('a',), (1,))
+        outer = OverlayContext(inner, ('b',), (2,))
+        assert inner._resolved is None
+        self.assert_equal(outer['a'], 1)
+        assert inner._resolved is not None
+
+
 def suite():
-    return _basicexec.make_suite(BCInterpTestCase, __name__)
+    import unittest
+
+    suite = unittest.TestSuite()
+    suite.addTest(_basicexec.make_suite(BCInterpTestCase, __name__))
+    suite.addTest(_basicexec.make_suite(OptimizedBCInterpTestCase, __name__))
+    suite.addTest(unittest.makeSuite(OverlayContextTestCase))
+    return suite
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.benchmarks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests that the benchmark corpus renders and the runner reports.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from . import TemplateTestCase
+from ..benchmarks.corpus import get_benchmarks
+from ..benchmarks.runner import compile_templates, run_benchmarks, \
+     percentile
+from ..benchmarks.memory import measure_loading, measure_render
+from ..benchmarks.regression import summarize, compare, select_baseline
+from ..benchmarks.scaling import generate_template, run_scaling, \
+     growth_exponent, format_charts
+from ..nodes import Stmt, Include, Block
+
+
+class BenchmarkTestCase(TemplateTestCase):
+
+    def test_backends_agree(self):
+        for benchmark in get_benchmarks():
+            results = []
+            for backend in 'interpreter', 'bytecode':
+                config = compile_templates(benchmark, backend)[0]
+                template = config.get_template(benchmark.entry)
+                results.append(template.render(benchmark.context))
+            assert results[0], benchmark.name
+            self.assert_equal(results[0], results[1])
+
+    def test_report(self):
+        report = run_benchmarks(['large_table', 'deep_inheritance'],
+                                iterations=3, warmup=0)
+        self.assert_equal(len(report['results']), 6)
+        for result in report['results']:
+            self.assert_equal(result['error'], None)
+            assert result['compile_seconds'] >= 0
+            if result['backend'] == 'javascript':
+                self.assert_equal(result['latency'], None)
+                continue
+            self.assert_equal(result['renders'], 3)
+            latency = result['latency']
+            assert latency['min'] <= latency['p50'] <= latency['max']
+
+    def test_memory_report(self):
+        report = run_benchmarks(['include_heavy'], ['bytecode'],
+                                iterations=1, warmup=1, memory=True)
+        memory = report['results'][0]['memory']
+        assert memory['load']['retained_bytes'] > 0
+        assert memory['render']['peak_bytes'] > 0
+
+    def test_measure_loading(self):
+        benchmark = get_benchmarks()[0]
+        rv = measure_loading(lambda: compile_templates(benchmark,
+                                                       'interpreter')[0])
+        self.assert_equal(sum(rv['retained_by_module'].values()),
+                          rv['retained_bytes'])
+        assert rv['retained_bytes'] > 0
+
+    def test_measure_render(self):
+        benchmark = get_benchmarks()[0]
+        config = compile_templates(benchmark, 'bytecode')[0]
+        template = config.get_template(benchmark.entry)
+        template.render(benchmark.context)
+        rv = measure_render(template, benchmark.context)
+        assert rv['allocated_bytes'] >= rv['output_bytes'] > 0
+        assert rv['peak_bytes'] >= rv['output_bytes']
+        assert rv['retained_bytes'] < rv['output_bytes']
+
+    def test_percentile(self):
+        timings = range(101)
+        self.assert_equal(percentile(timings, 50), 50)
+        self.assert_equal(percentile(timings, 99), 99)
+        self.assert_equal(percentile([1], 90), 1)
+
+
+class RegressionTestCase(TemplateTestCase):
+
+    def test_summarize(self):
+        rv = summarize([5, 1, 4, 2, 3])
+        self.assert_equal(rv['median'], 3)
+        self.assert_equal(rv['q1'], 2)
+        self.assert_equal(rv['q3'], 4)
+        self.assert_equal(rv['iqr'], 2)
+        self.assert_equal(summarize([1, 2])['median'], 1.5)
+
+    def test_compare(self):
+        baseline = {'a/bytecode': {
+            'throughput': summarize([98, 100, 102]),
+            'load_bytes': summarize([1000, 1000, 1000])
+        }}
+        def check(throughput, load_bytes):
+            current = {'a/bytecode': {
+                'throughput': summarize(throughput),
+                'load_bytes': summarize(load_bytes)
+            }}
+            return dict((metric, (round(change, 2), regressed))
+                        for key, metric, change, regressed
+                        in compare(baseline, current))
+        self.assert_equal(check([95, 97, 99], [1050, 1050, 1050]), {
+            'throughput': (-0.03, False),
+            'load_bytes': (-0.05, False)
+        })
+        self.assert_equal(check([70, 80, 90], [1200, 1200, 1200]), {
+            'throughput': (-0.2, True),
+            'load_bytes': (-0.2, True)
+        })
+        self.assert_equal(check([120, 130, 140], [900, 900, 900]), {
+            'throughput': (0.3, False),
+            'load_bytes': (0.1, False)
+        })
+
+    def test_compare_failures(self):
+        baseline = {
+            'a/bytecode': {'throughput': summarize([100]),
+                           'load_bytes': summarize([1000])},
+            'b/bytecode': {'throughput': summarize([100])}
+        }
+        current = {'a/bytecode': {'throughput': summarize([100])}}
+        self.assert_equal(compare(baseline, current, errors={
+            'b/bytecode': 'ZeroDivisionError: integer division by zero'
+        }), [
+            ('b/bytecode', 'error', None, True),
+            ('a/bytecode', 'load_bytes', None, True),
+            ('a/bytecode', 'throughput', 0.0, False)
+        ])
+
+    def test_select_baseline(self):
+        baseline = {
+            'a/bytecode': {'throughput': 1, 'load_bytes': 2},
+            'a/interpreter': {'throughput': 3},
+            'b/bytecode': {'throughput': 4}
+        }
+        self.assert_equal(select_baseline(baseline, ['a'], ['bytecode']),
+                          {'a/bytecode': {'throughput': 1, 'load_bytes': 2}})
+        self.assert_equal(select_baseline(baseline, memory=False), {
+            'a/bytecode': {'throughput': 1},
+            'a/interpreter': {'throughput': 3},
+            'b/bytecode': {'throughput': 4}
+        })
+
+    def test_compare_noise(self):
+        baseline = {'a/bytecode': {'throughput': summarize([60, 100, 140])}}
+        current = {'a/bytecode': {'throughput': summarize([50, 80, 110])}}
+        key, metric, change, regressed = compare(baseline, current)[0]
+        assert change < -0.1
+        assert not regressed
+
+
+class ScalingTestCase(TemplateTestCase):
+
+    def count_statements(self, node, node_type=Stmt):
+        rv = isinstance(node, node_type) and 1 or 0
+        for child in node.iter_child_nodes():
+            rv += self.count_statements(child, node_type)
+        return rv
+
+    def test_generate_template(self):
+        for statements in 10, 57, 200:
+            node = generate_template(statements, includes=3, blocks=2)
+            self.assert_equal(self.count_statements(node), statements)
+            self.assert_equal(self.count_statements(node, Include), 3)
+            self.assert_equal(self.count_statements(node, Block), 2)
+        self.assert_equal(generate_template(50, seed=1),
+                          generate_template(50, seed=1))
+        self.assert_not_equal(generate_template(50, seed=1),
+                              generate_template(50, seed=2))
+
+    def test_growth_exponent(self):
+        def make_points(func):
+            return [{'statements': x, 'stages': {'to_ast': {
+                'seconds': func(x)}}} for x in (10, 20, 40, 80)]
+        linear = growth_exponent(make_points(lambda x: x * 0.01),
+                                 'to_ast', 'seconds')
+        quadratic = growth_exponent(make_points(lambda x: x * x * 0.01),
+                                    'to_ast', 'seconds')
+        self.assert_equal(round(linear, 6), 1)
+        self.assert_equal(round(quadratic, 6), 2)
+        self.assert_equal(growth_exponent(make_points(lambda x: None),
+                                          'to_ast', 'seconds'), None)
+
+    def test_report(self):
+        report = run_scaling([20, 40], includes=2, blocks=1, repeats=1)
+        self.assert_equal([x['statements'] for x in report['points']],
+                          [20, 40])
+        for point in report['points']:
+            for stage, result in point['stages'].iteritems():
+                self.assert_equal(result['error'], None)
+                assert result['seconds'] > 0
+                assert result['bytes'] > 0
+        charts = format_charts(report)
+        assert 'to_ast seconds' in charts
+        assert 'to_javascript bytes' in charts
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BenchmarkTestCase))
+    suite.addTest(unittest.makeSuite(RegressionTestCase))
+    suite.addTest(unittest.makeSuite(ScalingTestCase))
+    return suite
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the caches.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import sys
+import time
+import threading
+
+from . import TemplateTestCase
+from ..cache import LRUCache, FragmentCache, LoaderCache
+from ..config import Config
+from ..runtime import RuntimeInfo
+from ..exceptions import TemplateNotFound, TemplatesNotFound
+
+
+class LRUCacheTestCase(TemplateTestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assert_equal(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assert_equal(cache.get('b'), None)
+        self.assert_equal(cache.get('a'), 1)
+        self.assert_equal(cache.get('c'), 3)
+        self.assert_equal(cache.evictions, 1)
+        self.assert_equal(len(cache), 2)
+
+    def test_ttl(self):
+        cache = LRUCache(2, ttl=0.01)
+        cache.set('a', 1)
+        self.assert_equal('a' in cache, True)
+        time.sleep(0.02)
+        self.assert_equal('a' in cache, False)
+
+
+class FragmentCacheTestCase(TemplateTestCase):
+
+    def test_single_flight(self):
+        cache = FragmentCache()
+        signature = ('digest', ('x',))
+        started = threading.Event()
+        calls = []
+        results = []
+
+        def render():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return [u'rendered']
+
+        def worker():
+            results.append(cache.render_fragment(signature, {'x': 1}, False,
+                                                 render))
+
+        threads = [threading.Thread(target=worker) for x in xrange(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assert_equal(len(calls), 1)
+        self.assert_equal(results, [[u'rendered']] * 4)
+        self.assert_equal(cache.hits, 3)
+
+    def test_concurrent_counters(self):
+        cache = FragmentCache()
+        signature = ('digest', ('x',))
+        cache.render_fragment(signature, {'x': 1}, False, lambda: [u'a'])
+
+        def worker():
+            for x in xrange(2000):
+                cache.render_fragment(signature, {'x': 1}, False, None)
+                cache.render_fragment(signature, {'x': []}, False,
+                                      lambda: [])
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=worker) for x in xrange(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assert_equal(cache.misses, 1)
+        self.assert_equal(cache.hits, 8000)
+        self.assert_equal(cache.uncacheable, 8000)
+
+    def test_unhashable_values(self):
+        cache = FragmentCache()
+        rv = cache.render_fragment(('digest', ('x',)), {'x': []}, False,
+                                   lambda: [u'a', u'b'])
+        self.assert_equal(list(rv), [u'a', u'b'])
+        self.assert_equal(cache.uncacheable, 1)
+
+
+class LoaderCacheTestCase(TemplateTestCase):
+
+    def make_config(self, templates):
+        loaded = []
+
+        class CustomConfig(Config):
+            def get_template(self, name):
+                loaded.append(name)
+                try:
+                    return templates[name]
+                except KeyError:
+                    raise TemplateNotFound(name)
+
+        config = CustomConfig()
+        config.loader_cache = LoaderCache()
+        return config, loaded
+
+    def test_shared_between_renders(self):
+        config, loaded = self.make_config({'a.html': 'A'})
+        for x in xrange(3):
+            info = RuntimeInfo(config, 'index.html')
+            self.assert_equal(info.get_template('a.html'), 'A')
+        self.assert_equal(loaded, ['a.html'])
+        self.assert_equal(config.loader_cache.hits, 2)
+
+    def test_negative_caching(self):
+        config, loaded = self.make_config({'b.html': 'B'})
+        config.loader_cache = LoaderCache(negative_ttl=0.05)
+        for x in xrange(3):
+            info = RuntimeInfo(config, 'index.html')
+            rv = info.select_template(['missing.html', 'b.html'])
+            self.assert_equal(rv, 'B')
+        self.assert_equal(loaded, ['missing.html', 'b.html'])
+        self.assert_equal(config.loader_cache.negative_hits, 2)
+        with self.assert_raises(TemplateNotFound):
+            info.get_template('missing.html')
+        with self.assert_raises(TemplatesNotFound):
+            info.select_template(['missing.html'])
+        time.sleep(0.06)
+        RuntimeInfo(config).select_template(['missing.html', 'b.html'])
+        self.assert_equal(loaded, ['missing.html', 'b.html', 'missing.html'])
+
+    def test_capacity_and_invalidation(self):
+        cache = LoaderCache(capacity=2)
+        loaded = []
+        def load(name):
+            loaded.append(name)
+            return name.upper()
+        for name in 'a', 'b', 'c', 'a':
+            self.assert_equal(cache.lookup(name, load), name.upper())
+        self.assert_equal(loaded, ['a', 'b', 'c', 'a'])
+        cache.invalidate('a')
+        cache.lookup('a', load)
+        self.assert_equal(loaded[-1], 'a')
+        self.assert_equal(len(cache.templates), 2)
+
+    def test_single_flight(self):
+        cache = LoaderCache()
+        loaded = []
+        results = []
+        def load(name):
+            loaded.append(name)
+            time.sleep(0.05)
+            if name == 'broken':
+                raise ZeroDivisionError()
+            return name
+        def lookup(name):
+            try:
+                results.append(cache.lookup(name, load))
+            except ZeroDivisionError:
+                results.append('error')
+        threads = [threading.Thread(target=lookup, args=(name,))
+                   for name in ['a'] * 5 + ['broken'] * 3]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assert_equal(sorted(loaded), ['a', 'broken'])
+        self.assert_equal(sorted(results), ['a'] * 5 + ['error'] * 3)
+
+
+def suite():
+    import unittest
+
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LRUCacheTestCase))
+    suite.addTest(unittest.makeSuite(FragmentCacheTestCase))
+    suite.addTest(unittest.makeSuite(LoaderCacheTestCase))
+    return suite
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.frontend
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the template frontend.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import os
+import sys
+import subprocess
+
+from . import TemplateTestCase
+from .. import nodes
+from ..config import Config
+from ..frontend import CompiledTemplate, InterpretedTemplate, \
+     FlattenedTemplate
+from ..runtime import RuntimeInfo, TraceRecorder, FragmentDispatcher
+
+
+class _Unprintable(object):
+
+    def __unicode__(self):
+        raise ZeroDivisionError()
+
+
+class BatchRenderingTestCase(TemplateTestCase):
+
+    def make_template(self):
+        n = nodes
+        node = n.Template([
+            n.Output([n.Const('Hello '), n.Name('name', 'load'),
+                      n.Const('!')])
+        ]).set_config(Config())
+        return CompiledTemplate('hello.html', node.config, node)
+
+    def test_render_batch(self):
+        t = self.make_template()
+        contexts = (dict(name=str(x)) for x in xrange(50))
+        rv = list(t.render_batch(contexts, processes=2, chunksize=7))
+        self.assert_equal(rv, ['Hello %d!' % x for x in xrange(50)])
+
+    def test_render_batch_empty(self):
+        t = self.make_template()
+        self.assert_equal(list(t.render_batch([], processes=1)), [])
+
+    def test_render_batch_errors(self):
+        t = self.make_template()
+        with self.assert_raises(ZeroDivisionError):
+            list(t.render_batch([dict(name=x) for x in [1, _Unprintable()]],
+                                processes=1, chunksize=1))
+
+    def test_render_batch_flattened(self):
+        n = nodes
+        templates = {
+            'index.html':   n.Template([
+                n.Extends(n.Const('layout.html')),
+                n.Block('body', [n.Output([n.Name('name', 'load')])])
+            ]),
+            'layout.html':  n.Template([
+                n.Output([n.Const('<')]),
+                n.Block('body', []),
+                n.Output([n.Const('>')])
+            ])
+        }
+        t = FlattenedTemplate('index.html', Config(), templates['index.html'],
+                              templates.__getitem__, lazy_blocks=True)
+        rv = list(t.render_batch([dict(name=str(x)) for x in xrange(5)],
+                                 processes=1, chunksize=2))
+        self.assert_equal(rv, ['<%d>' % x for x in xrange(5)])
+
+    def test_render_batch_worker_setup_error(self):
+        class BrokenTemplate(CompiledTemplate):
+            def get_eager_code(self):
+                return compile('1 // 0', '<broken>', 'exec')
+        t = self.make_template()
+        t.__class__ = BrokenTemplate
+        with self.assert_raises(ZeroDivisionError):
+            list(t.render_batch([dict(name='x')], processes=1))
+
+
+class RenderManyTestCase(TemplateTestCase):
+
+    def make_template(self, template_class):
+        n = nodes
+        filter_lookups = []
+
+        class CountingConfig(Config):
+            def get_filters(self):
+                filter_lookups.append(1)
+                return {'upper': lambda x: x.upper()}
+
+        node = n.Template([
+            n.Assign(n.Name('greeting', 'store'), n.Const('Hello')),
+            n.Block('body', [
+                n.Output([n.Filter(n.Name('name', 'load'), 'upper',
+                                   [], [], None, None)])
+            ]),
+            n.Output([n.Const('!')])
+        ]).set_config(CountingConfig())
+        return template_class('hello.html', node.config, node), filter_lookups
+
+    def assert_renders_many(self, template_class):
+        t, filter_lookups = self.make_template(template_class)
+        contexts = [dict(name=x) for x in 'foo', 'bar', 'baz']
+        registered = []
+        register_block = RuntimeInfo.register_block
+        def counting_register_block(self, name, executor):
+            registered.append(name)
+            return register_block(self, name, executor)
+        RuntimeInfo.register_block = counting_register_block
+        try:
+            self.assert_equal(list(t.render_many(contexts)),
+                              ['FOO!', 'BAR!', 'BAZ!'])
+        finally:
+            RuntimeInfo.register_block = register_block
+        self.assert_equal(len(filter_lookups), 1)
+        self.assert_equal(registered, ['body'])
+        self.assert_equal([t.render(x) for x in contexts],
+                          ['FOO!', 'BAR!', 'BAZ!'])
+
+    def test_compiled_render_many(self):
+        self.assert_renders_many(CompiledTemplate)
+
+    def test_interpreted_render_many(self):
+        self.assert_renders_many(InterpretedTemplate)
+
+
+class ParallelFragmentsTestCase(TemplateTestCase):
+
+    def assert_execute_resolves(self, template_class):
+        n = nodes
+        config = Config()
+        config.parallel_fragments = 2
+        node = n.Template([
+            n.Output([n.Const('<')]),
+            n.Block('body', [n.Output([n.Name('name', 'load')])]),
+            n.Output([n.Const('>')])
+        ]).set_config(config)
+        t = template_class('index.html', config, node)
+        events = list(t.execute(dict(name=u'foo')))
+        self.assert_equal(u''.join(events), u'<foo>')
+        for event in events:
+            assert isinstance(event, basestring), event
+        self.assert_equal(t.render(dict(name=u'bar')), u'<bar>')
+
+    def test_compiled_execute(self):
+        self.assert_execute_resolves(CompiledTemplate)
+
+    def test_interpreted_execute(self):
+        self.assert_execute_resolves(InterpretedTemplate)
+
+    def test_dispatcher_shutdown(self):
+        dispatcher = FragmentDispatcher(2)
+        fragment = dispatcher.dispatch(lambda x: [x, u'!'], (u'foo',))
+        self.assert_equal(fragment.get_result(), u'foo!')
+        dispatcher.shutdown()
+        for thread in dispatcher._threads:
+            assert not thread.is_alive()
+        fragment = dispatcher.dispatch(lambda x: [x], (u'bar',))
+        assert fragment._finished is None
+        self.assert_equal(fragment.get_result(), u'bar')
+
+
+class LazyBlocksTestCase(TemplateTestCase):
+
+    def make_node(self):
+        n = nodes
+        return n.Template([
+            n.Output([n.Const('<')]),
+            n.Block('head', [n.Output([n.Const('head '),
+                                       n.Name('title', 'load')])]),
+            n.If(n.Name('show_body', 'load'), [
+                n.Block('body', [n.Output([n.Const('|body')])])
+            ], []),
+            n.Output([n.Const('>')])
+        ]).set_config(Config())
+
+    def test_lazy_blocks(self):
+        t = CompiledTemplate('layout.html', Config(), self.make_node(),
+                             lazy_blocks=True)
+        self.assert_equal(t.namespace['lazy_blocks'], ('head', 'body'))
+        self.assert_equal(t._compiled_blocks, {})
+        self.assert_equal(t.render(dict(title='x', show_body=False)),
+                          '<head x>')
+        self.assert_equal(sorted(t._compiled_blocks), ['head'])
+        self.assert_equal(t.render(dict(title='y', show_body=True)),
+                          '<head y|body>')
+        self.assert_equal(sorted(t._compiled_blocks), ['body', 'head'])
+
+    def test_lazy_blocks_need_node(self):
+        t = CompiledTemplate('layout.html', Config(), self.make_node(),
+                             lazy_blocks=True)
+        with self.assert_raises(TypeError):
+            CompiledTemplate('layout.html', Config(), t.code)
+        eager = CompiledTemplate('layout.html', Config(), t.get_eager_code())
+        self.assert_equal(eager.render(dict(title='x', show_body=True)),
+                          '<head x|body>')
+
+    def test_lazy_static_blocks(self):
+        n = nodes
+        templates = {
+            'index.html':   n.Template([
+                n.Extends(n.Const('layout.html')),
+                n.Block('head', [n.Output([n.Const('index')])])
+            ]),
+            'layout.html':  self.make_node()
+        }
+        t = FlattenedTemplate('index.html', Config(), templates['index.html'],
+                              templates.__getitem__, lazy_blocks=True)
+        self.assert_equal(t.render(dict(show_body=True)), '<index|body>')
+        self.assert_equal(t.render(dict(show_body=False)), '<index>')
+
+
+class InstrumentationTestCase(TemplateTestCase):
+
+    def make_node(self):
+        n = nodes
+        return n.Template([
+            n.Output([n.Const('<')], lineno=1),
+            n.For(n.Name('item', 'store'), n.Name('items', 'load'), [
+                n.Output([n.Name('item', 'load')], lineno=3),
+                n.Output([n.Const(',')], lineno=3)
+            ], [], lineno=2),
+            n.Block('footer', [
+                n.Output([n.Const('>')], lineno=5)
+            ], lineno=4)
+        ], lineno=1).set_config(Config())
+
+    def test_line_counts(self):
+        node = self.make_node()
+        for options in {}, {'lazy_blocks': True}:
+            t = CompiledTemplate('index.html', node.config, node,
+                                 instrument=True, **options)
+            self.assert_equal(t.render(dict(items='ab')), '<a,b,>')
+            self.assert_equal(t.render(dict(items='c')), '<c,>')
+            self.assert_equal(t.get_line_stats(), [
+                (1, 2, None), (2, 2, None), (3, 3, None), (4, 2, None),
+                (5, 2, None)
+            ])
+
+    def test_line_timing(self):
+        node = self.make_node()
+        t = CompiledTemplate('index.html', node.config, node,
+                             instrument_timing=True)
+        counter = t.namespace['line_counter']
+        ticks = iter(xrange(1000))
+        counter.timer = lambda: ticks.next()
+        self.assert_equal(t.render(dict(items='ab')), '<a,b,>')
+        stats = t.get_line_stats()
+        self.assert_equal([x[:2] for x in stats], [(1, 1), (2, 1), (3, 2),
+                                                   (4, 1), (5, 1)])
+        for lineno, hits, seconds in stats:
+            assert seconds > 0
+
+    def test_uninstrumented(self):
+        node = self.make_node()
+        t = CompiledTemplate('index.html', node.config, node)
+        assert 'line_counter' not in t.namespace
+        with self.assert_raises(TypeError):
+            t.get_line_stats()
+
+
+class ObserverTestCase(TemplateTestCase):
+
+    def test_template_render(self):
+        n = nodes
+        node = n.Template([
+            n.Output([n.Filter(n.Name('name', 'load'), 'upper',
+                               [], [], None, None)])
+        ])
+        config = Config()
+        config.get_filters = lambda: {'upper': lambda x: x.upper()}
+        recorder = TraceRecorder()
+        config.observers.append(recorder)
+        node.set_config(config)
+        for template_class in CompiledTemplate, InterpretedTemplate:
+            del recorder.trace[:]
+            t = template_class('hello.html', config, node)
+            self.assert_equal(t.render(dict(name='foo')), 'FOO')
+            self.assert_equal(list(t.render_many([dict(name='bar')])),
+                              ['BAR'])
+            self.assert_equal([x[:2] for x in recorder.trace], [
+                ('filter', 'upper'), ('template', 'hello.html')
+            ] * 2)
+
+
+class ImportTestCase(TemplateTestCase):
+
+    def test_compiler_imported_lazily(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        output = subprocess.Popen([sys.executable, '-c', '''if 1:
+            import sys
+            from templatetk import nodes
+            from templatetk.config import Config
+            from templatetk.frontend import CompiledTemplate, \\
+                 InterpretedTemplate
+            from templatetk.loaders import DictLoader
+            from templatetk.bccache import MemoryBytecodeCache
+            node = nodes.Template([nodes.Output([nodes.Const('x')])])
+            node.set_config(Config())
+            InterpretedTemplate('x', node.config, node).render({})
+            print 'templatetk.asttransform' in sys.modules
+            CompiledTemplate('x', node.config, node).render({})
+            print 'templatetk.asttransform' in sys.modules
+        '''], cwd=root, stdout=subprocess.PIPE).communicate()[0]
+        self.assert_equal(output.split(), ['False', 'True'])
+
+
+def suite():
+    import unittest
+
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BatchRenderingTestCase))
+    suite.addTest(unittest.makeSuite(RenderManyTestCase))
+    suite.addTest(unittest.makeSuite(ParallelFragmentsTestCase))
+    suite.addTest(unittest.makeSuite(LazyBlocksTestCase))
+    suite.addTest(unittest.makeSuite(InstrumentationTestCase))
+    suite.addTest(unittest.makeSuite(ObserverTestCase))
+    suite.addTest(unittest.makeSuite(ImportTestCase))
+    return suite
@@ -13,6 +13,7 @@ from __future__ import with_statement
 from . import _basicexec
 
 from ..interpreter import Interpreter, BasicInterpreterState
+from ..optimizer import partial_evaluate
 
 
 class InterpreterTestCase(_basicexec.BasicExecTestCase):
@@ -45,5 +46,18 @@ class InterpreterTestCase(_basicexec.BasicExecTestCase):
                                    self.interpreter_state_class)
 
 
+class PartiallyEvaluatedInterpreterTestCase(InterpreterTestCase):
+
+    def _execute(self, node, ctx, config, info):
+        return InterpreterTestCase._execute(self, partial_evaluate(node),
+                                            ctx, config, info)
+
+
 def suite():
-    return _basicexec.make_suite(InterpreterTestCase, __name__)
+    import unittest
+
+    suite = unittest.TestSuite()
+    suite.addTest(_basicexec.make_suite(InterpreterTestCase, __name__))
+    suite.addTest(_basicexec.make_suite(PartiallyEvaluatedInterpreterTestCase,
+                                        __name__))
+    return suite
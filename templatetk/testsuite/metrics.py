@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.metrics
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the metrics registry and the metrics of the library.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import unittest
+
+from . import TemplateTestCase
+from .. import nodes, metrics
+from ..cache import LoaderCache, FragmentCache
+from ..config import Config
+from ..bccache import MemoryBytecodeCache
+from ..frontend import CompiledTemplate
+from ..loaders import DictLoader
+from ..metrics import MetricsRegistry
+
+
+class MetricsRegistryTestCase(TemplateTestCase):
+
+    def test_counter(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('requests', 'Number of requests.')
+        assert registry.counter('requests') is counter
+        counter.inc()
+        counter.inc(2)
+        self.assert_equal(registry.collect(), {'requests': 3})
+        with self.assert_raises(TypeError):
+            registry.histogram('requests')
+        registry.reset()
+        self.assert_equal(counter.value, 0)
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('size', buckets=(10, 100))
+        for value in 5, 10, 50, 500:
+            histogram.observe(value)
+        self.assert_equal(registry.collect()['size'], {
+            'count': 4,
+            'sum': 565,
+            'buckets': [(10, 2), (100, 3), (float('inf'), 4)]
+        })
+
+    def test_format_text(self):
+        registry = MetricsRegistry()
+        registry.counter('hits', 'Cache hits.').inc()
+        registry.histogram('size', buckets=(10,)).observe(3)
+        self.assert_equal(registry.format_text().splitlines(), [
+            '# HELP hits Cache hits.',
+            '# TYPE hits counter',
+            'hits 1',
+            '# TYPE size histogram',
+            'size_bucket{le="10"} 1',
+            'size_bucket{le="+Inf"} 1',
+            'size_sum 3',
+            'size_count 1'
+        ])
+
+
+class LibraryMetricsTestCase(TemplateTestCase):
+
+    def get_changes(self, func):
+        before = metrics.registry.collect()
+        func()
+        after = metrics.registry.collect()
+        rv = {}
+        for name, value in after.iteritems():
+            if isinstance(value, dict):
+                value = value['count']
+                before[name] = before[name]['count']
+            if value != before[name]:
+                rv[name] = value - before[name]
+        return rv
+
+    def test_compile(self):
+        node = nodes.Template([nodes.Output([nodes.Const('x')])])
+        node.set_config(Config())
+        changes = self.get_changes(lambda: CompiledTemplate('x', node.config,
+                                                            node))
+        self.assert_equal(changes, {
+            'templatetk_to_ast_seconds':    1,
+            'templatetk_compile_seconds':   1,
+            'templatetk_code_size_bytes':   1
+        })
+
+    def test_caches(self):
+        loader = DictLoader({'x': nodes.Template([
+            nodes.Output([nodes.Name('x', 'load')])])})
+        config = Config()
+        bytecode_cache = MemoryBytecodeCache()
+        loader_cache = LoaderCache(capacity=1)
+        def load(name):
+            return loader.load(name, config, bytecode_cache)
+        def run():
+            loader_cache.lookup('x', load)
+            loader_cache.lookup('x', load)
+            loader_cache.invalidate()
+            loader_cache.lookup('x', load)
+            loader_cache.templates.set('y', None)
+        changes = self.get_changes(run)
+        self.assert_equal(changes, {
+            'templatetk_to_ast_seconds':            1,
+            'templatetk_compile_seconds':           1,
+            'templatetk_code_size_bytes':           1,
+            'templatetk_templates_loaded':          2,
+            'templatetk_bytecode_cache_misses':     1,
+            'templatetk_bytecode_cache_hits':       1,
+            'templatetk_loader_cache_hits':         1,
+            'templatetk_loader_cache_misses':       2,
+            'templatetk_loader_cache_evictions':    1
+        })
+
+    def test_fragment_cache(self):
+        cache = FragmentCache()
+        cache.storage.capacity = 1
+        signature = ('digest', ('x',))
+        def run():
+            for x in 1, 1, 2:
+                cache.render_fragment(signature, {'x': x}, False,
+                                      lambda: [u'foo'])
+        self.assert_equal(self.get_changes(run), {
+            'templatetk_fragment_cache_hits':       1,
+            'templatetk_fragment_cache_misses':     2,
+            'templatetk_fragment_cache_evictions':  1
+        })
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MetricsRegistryTestCase))
+    suite.addTest(unittest.makeSuite(LibraryMetricsTestCase))
+    return suite
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.optimizer
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the ATST optimizations.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+from . import TemplateTestCase
+from .. import nodes
+from ..config import Config
+from ..frontend import CompiledTemplate, FlattenedTemplate, \
+     InterpretedTemplate
+from ..optimizer import flatten_inheritance, eliminate_dead_code, \
+     partial_evaluate
+
+
+class InheritanceFlatteningTestCase(TemplateTestCase):
+
+    def make_templates(self):
+        n = nodes
+        return {
+            'index.html':   n.Template([
+                n.Assign(n.Name('title', 'store'), n.Const('Index')),
+                n.Extends(n.Const('page.html')),
+                n.Block('body', [n.Output([n.Const('index body:'),
+                                           n.Name('title', 'load')])])
+            ]),
+            'page.html':    n.Template([
+                n.Extends(n.Const('layout.html')),
+                n.Block('head', [n.Output([n.Const('page head')])]),
+                n.Block('body', [n.Output([n.Const('page body')])])
+            ]),
+            'layout.html':  n.Template([
+                n.Output([n.Const('<')]),
+                n.Block('head', [n.Output([n.Const('layout head')])]),
+                n.Output([n.Const('|')]),
+                n.Block('body', []),
+                n.Output([n.Const('>')])
+            ])
+        }
+
+    def test_flatten(self):
+        n = nodes
+        templates = self.make_templates()
+        node, chain = flatten_inheritance(templates['index.html'],
+                                          templates.__getitem__,
+                                          'index.html')
+        self.assert_equal([x[0] for x in chain],
+                          ['index.html', 'page.html', 'layout.html'])
+        self.assert_equal(node.find(n.Extends), None)
+        self.assert_equal([x.body for x in node.find_all(n.Block)], [
+            [n.Output([n.Const('page head')])],
+            [n.Output([n.Const('index body:'), n.Name('title', 'load')])]
+        ])
+        self.assert_equal(templates['layout.html'].body[3].body, [])
+
+    def test_render_flattened(self):
+        templates = self.make_templates()
+        t = FlattenedTemplate('index.html', Config(),
+                              templates['index.html'], templates.__getitem__)
+        self.assert_equal(t.render({}), '<page head|index body:Index>')
+        self.assert_equal(t.is_up_to_date(templates.__getitem__), True)
+        templates['layout.html'].body.pop()
+        self.assert_equal(t.is_up_to_date(templates.__getitem__), False)
+
+    def test_dynamic_extends(self):
+        n = nodes
+        template = n.Template([n.Extends(n.Name('layout', 'load'))])
+        with self.assert_raises(n.Impossible):
+            flatten_inheritance(template, None)
+
+
+class DeadCodeEliminationTestCase(TemplateTestCase):
+
+    def test_code_after_extends(self):
+        n = nodes
+        template = n.Template([
+            n.Extends(n.Const('layout.html')),
+            n.Output([n.Name('foo', 'load')]),
+            n.Block('a', [n.Output([n.Const('a')])]),
+            n.If(n.Name('bar', 'load'), [
+                n.Block('b', [n.Block('c', [])])
+            ], [])
+        ])
+        node, removed = eliminate_dead_code(template)
+        self.assert_equal(removed, 2)
+        self.assert_equal(node.body, [
+            n.Extends(n.Const('layout.html')),
+            n.Block('a', [n.Output([n.Const('a')])]),
+            n.Block('b', [n.Block('c', [])])
+        ])
+        self.assert_equal(len(template.body), 4)
+
+    def test_code_after_break(self):
+        n = nodes
+        loop = n.For(n.Name('item', 'store'), n.Name('seq', 'load'), [
+            n.Output([n.Name('item', 'load')]),
+            n.Break(),
+            n.Output([n.Const('never')])
+        ], [])
+        node, removed = eliminate_dead_code(n.Template([loop]))
+        self.assert_equal(removed, 1)
+        self.assert_equal(len(node.body[0].body), 2)
+
+    def test_compiled_report(self):
+        n = nodes
+        node = n.Template([
+            n.For(n.Name('item', 'store'), n.Name('seq', 'load'), [
+                n.If(n.Name('item', 'load'), [
+                    n.Output([n.Name('item', 'load')]),
+                    n.Continue(),
+                    n.Output([n.Name('unused', 'load')])
+                ], [])
+            ], []),
+            n.Block('body', [n.Output([n.Const('!')])])
+        ]).set_config(Config())
+        t = CompiledTemplate('index.html', node.config, node,
+                             eliminate_dead_code=True)
+        self.assert_equal(t.render(dict(seq=[1, 0, 2])), '12!')
+        report = t.dead_code_report
+        self.assert_equal(report['statements'], 1)
+        assert report['dummy_yields'] > 0
+        assert report['unused_assignments'] > 0
+        assert 'unused' not in t.dependencies.names
+
+        t = CompiledTemplate('index.html', node.config, node)
+        self.assert_equal(t.dead_code_report, {})
+        self.assert_equal(t.render(dict(seq=[1, 0, 2])), '12!')
+
+
+class PartialEvaluationTestCase(TemplateTestCase):
+
+    def evaluate(self, body):
+        return partial_evaluate(nodes.Template(body).set_config(Config()))
+
+    def test_constant_if(self):
+        n = nodes
+        node = self.evaluate([
+            n.Output([n.Const('a')]),
+            n.If(n.Compare(n.Const(1), [n.Operand('lt', n.Const(2))]), [
+                n.Output([n.Const('b')])
+            ], [
+                n.Output([n.Name('c', 'load')])
+            ]),
+            n.If(n.Not(n.Const(True)), [
+                n.Assign(n.Name('x', 'store'), n.Const(1))
+            ], [])
+        ])
+        self.assert_equal(node.body, [n.Output([n.TemplateData(u'ab')])])
+
+    def test_if_with_blocks_is_kept(self):
+        n = nodes
+        node = self.evaluate([
+            n.If(n.Const(False), [n.Block('body', [])], [])
+        ])
+        assert isinstance(node.body[0], n.If)
+
+    def test_unroll_loop(self):
+        n = nodes
+        node = self.evaluate([
+            n.For(n.Name('item', 'store'), n.List([n.Const(1), n.Const(2)]), [
+                n.Output([n.Name('item', 'load'), n.Const(',')])
+            ], [])
+        ])
+        scope = node.body[0]
+        assert isinstance(scope, n.Scope)
+        self.assert_equal([x.node.value for x in scope.body
+                           if isinstance(x, n.Assign)], [1, 2])
+        t = InterpretedTemplate('x', node.config, node)
+        self.assert_equal(t.render(dict(item='outer')), '1,2,')
+
+        node = self.evaluate([
+            n.For(n.Name('item', 'store'), n.Const(()), [
+                n.Output([n.Name('item', 'load')])
+            ], [n.Output([n.Const('empty')])])
+        ])
+        self.assert_equal(node.body, [n.Output([n.TemplateData(u'empty')])])
+
+    def test_no_unrolling(self):
+        n = nodes
+        loop_accessor = n.For(n.Name('item', 'store'), n.Const((1, 2)), [
+            n.Output([n.Getattr(n.Name('loop', 'load'), n.Const('index'))])
+        ], [])
+        too_long = n.For(n.Name('item', 'store'), n.Const(range(20)), [
+            n.Output([n.Name('item', 'load')])
+        ], [])
+        dynamic = n.For(n.Name('item', 'store'), n.Name('seq', 'load'), [
+            n.Output([n.Name('item', 'load')])
+        ], [])
+        for loop in loop_accessor, too_long, dynamic:
+            node = self.evaluate([loop])
+            assert isinstance(node.body[0], n.For)
+
+    def test_autoescape(self):
+        n = nodes
+        node = self.evaluate([
+            n.Output([n.Const('<b>'), n.Add(n.Const(20), n.Const(22)),
+                      n.TemplateData('<i>')])
+        ])
+        self.assert_equal(node.body[0].nodes, [n.Const('<b>'),
+                                               n.TemplateData(u'42<i>')])
+
+    def test_same_output(self):
+        n = nodes
+        node = n.Template([
+            n.For(n.Name('x', 'store'), n.Const(('<', '>')), [
+                n.If(n.Name('x', 'load'), [n.Output([n.Name('x', 'load')])],
+                     [])
+            ], []),
+            n.Output([n.Const('<'), n.Name('foo', 'load')])
+        ]).set_config(Config())
+        for autoescape in False, True:
+            config = Config()
+            config.get_autoescape_default = lambda name: autoescape
+            node.set_config(config)
+            expected = CompiledTemplate('x', config, node).render(dict(foo=1))
+            for t in [CompiledTemplate('x', config, node,
+                                       partial_evaluation=True),
+                      InterpretedTemplate('x', config, node,
+                                          partial_evaluation=True)]:
+                self.assert_equal(t.render(dict(foo=1)), expected)
+
+
+def suite():
+    import unittest
+
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(InheritanceFlatteningTestCase))
+    suite.addTest(unittest.makeSuite(DeadCodeEliminationTestCase))
+    suite.addTest(unittest.makeSuite(PartialEvaluationTestCase))
+    return suite
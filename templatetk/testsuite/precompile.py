@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.precompile
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the loaders, the bytecode cache and the precompiler.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import sys
+import shutil
+import time
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from . import TemplateTestCase
+from .. import nodes
+from ..config import Config
+from ..loaders import DictLoader, AutoReloader
+from ..cache import LoaderCache
+from ..bccache import MemoryBytecodeCache, FileSystemBytecodeCache
+from ..exceptions import TemplateNotFound
+from ..precompile import build_dependency_graph, iter_dependency_levels, \
+     precompile, main
+
+
+def make_templates():
+    n = nodes
+    return {
+        'index.html':   n.Template([
+            n.Extends(n.Const('layout.html')),
+            n.Block('body', [n.Include(n.Const('item.html'), True)])
+        ]),
+        'layout.html':  n.Template([
+            n.Output([n.Const('<')]),
+            n.Block('body', []),
+            n.Output([n.Const('>')])
+        ]),
+        'item.html':    n.Template([
+            n.Output([n.Const('item '), n.Name('x', 'load')])
+        ]),
+        'other.html':   n.Template([
+            n.Include(n.Name('name', 'load'), True)
+        ])
+    }
+
+
+def setup():
+    return DictLoader(make_templates()), Config()
+
+
+class CountingCache(MemoryBytecodeCache):
+
+    def __init__(self):
+        MemoryBytecodeCache.__init__(self)
+        self.stores = 0
+
+    def dump_bytes(self, key, data):
+        self.stores += 1
+        MemoryBytecodeCache.dump_bytes(self, key, data)
+
+
+class LoaderTestCase(TemplateTestCase):
+
+    def test_dict_loader(self):
+        loader, config = setup()
+        self.assert_equal(loader.list_templates(), ['index.html',
+                          'item.html', 'layout.html', 'other.html'])
+        with self.assert_raises(TemplateNotFound):
+            loader.get_node('missing.html')
+
+    def test_load_through_cache(self):
+        loader, config = setup()
+        cache = CountingCache()
+        t = loader.load('item.html', config, cache)
+        self.assert_equal(t.render(dict(x=1)), 'item 1')
+        t = loader.load('item.html', config, cache)
+        self.assert_equal(t.render(dict(x=2)), 'item 2')
+        self.assert_equal(cache.stores, 1)
+
+        loader.mapping['item.html'] = nodes.Template([
+            nodes.Output([nodes.Const('changed')])])
+        t = loader.load('item.html', config, cache)
+        self.assert_equal(t.render({}), 'changed')
+        self.assert_equal(cache.stores, 2)
+
+    def test_compile_options_variant(self):
+        loader, config = setup()
+        loader.mapping['item.html'].set_lineno(1)
+        cache = CountingCache()
+        loader.load('item.html', config, cache)
+        t = loader.load('item.html', config, cache, instrument=True)
+        self.assert_equal(cache.stores, 2)
+        self.assert_equal(t.render(dict(x=1)), 'item 1')
+        self.assert_equal(t.get_line_stats(), [(1, 1, None)])
+        t = loader.load('item.html', config, cache)
+        assert 'line_counter' not in t.namespace
+        loader.load('item.html', config, cache, instrument=False)
+        self.assert_equal(cache.stores, 2)
+
+    def test_compile_options_need_node(self):
+        loader, config = setup()
+        t = loader.load('layout.html', config, lazy_blocks=True)
+        self.assert_equal(t.render({}), '<>')
+        self.assert_equal(sorted(t._compiled_blocks), ['body'])
+        loader.mapping['dead.html'] = nodes.Template([
+            nodes.If(nodes.Const(False), [
+                nodes.Output([nodes.Const('dead')])
+            ], []),
+            nodes.Output([nodes.Const('alive')])
+        ])
+        t = loader.load('dead.html', config, eliminate_dead_code=True)
+        self.assert_equal(t.render({}), 'alive')
+        assert t.dead_code_report
+        with self.assert_raises(TypeError):
+            loader.load('layout.html', config, CountingCache(),
+                        lazy_blocks=True)
+
+
+class FailingReloader(AutoReloader):
+
+    def __init__(self, *args, **kwargs):
+        AutoReloader.__init__(self, *args, **kwargs)
+        self.failures = {}
+
+    def load_template(self, name):
+        if self.failures.get(name):
+            self.failures[name] -= 1
+            raise SyntaxError('broken ' + name)
+        return AutoReloader.load_template(self, name)
+
+
+class AutoReloaderTestCase(TemplateTestCase):
+
+    def test_reload_dependents(self):
+        loader, config = setup()
+        config.loader_cache = LoaderCache()
+        reloader = AutoReloader(loader, config)
+        for name in 'index.html', 'item.html', 'other.html':
+            reloader.get_template(name)
+        config.loader_cache.lookup('item.html', reloader.get_template)
+        old_item = reloader.get_template('item.html')
+        old_index = reloader.get_template('index.html')
+        old_other = reloader.get_template('other.html')
+        self.assert_equal(reloader.check(), set())
+
+        loader.mapping['item.html'] = nodes.Template([
+            nodes.Output([nodes.Const('new item')])])
+        self.assert_equal(reloader.check(), set(['item.html', 'index.html']))
+        assert reloader.get_template('index.html') is not old_index
+        assert reloader.get_template('other.html') is old_other
+        self.assert_equal(reloader.get_template('item.html').render({}),
+                          'new item')
+        self.assert_equal(old_item.render(dict(x=1)), 'item 1')
+        self.assert_equal(len(config.loader_cache.templates), 0)
+
+        del loader.mapping['item.html']
+        self.assert_equal(reloader.check(), set(['item.html', 'index.html']))
+        assert 'item.html' not in reloader.templates
+
+    def test_reload_error(self):
+        loader, config = setup()
+        reloader = FailingReloader(loader, config)
+        old_item = reloader.get_template('item.html')
+        reloader.get_template('other.html')
+        loader.mapping['item.html'] = nodes.Template([
+            nodes.Output([nodes.Const('new item')])])
+        loader.mapping['other.html'] = nodes.Template([
+            nodes.Output([nodes.Const('new other')])])
+        reloader.failures['item.html'] = 1
+        self.assert_equal(reloader.check(), set(['other.html']))
+        self.assert_equal(sorted(reloader.errors), ['item.html'])
+        assert reloader.get_template('item.html') is old_item
+        self.assert_equal(reloader.get_template('other.html').render({}),
+                          'new other')
+        self.assert_equal(reloader.check(), set(['item.html']))
+        self.assert_equal(reloader.errors, {})
+        self.assert_equal(reloader.get_template('item.html').render({}),
+                          'new item')
+
+    def test_background_thread_survives_errors(self):
+        loader, config = setup()
+        reloader = FailingReloader(loader, config, interval=0.01)
+        reloader.get_template('item.html')
+        reloader.failures['item.html'] = 1
+        reloader.start()
+        try:
+            loader.mapping['item.html'] = nodes.Template([
+                nodes.Output([nodes.Const('new item')])])
+            for x in xrange(100):
+                if reloader.get_template('item.html').render({}) == \
+                   'new item':
+                    break
+                time.sleep(0.01)
+            else:
+                self.fail('template was not reloaded')
+            self.assert_equal(reloader.failures, {'item.html': 0})
+            assert reloader._thread.is_alive()
+        finally:
+            reloader.stop()
+
+    def test_background_thread(self):
+        loader, config = setup()
+        reloader = AutoReloader(loader, config, interval=0.01)
+        reloader.get_template('item.html')
+        reloader.start()
+        try:
+            loader.mapping['item.html'] = nodes.Template([
+                nodes.Output([nodes.Const('new item')])])
+            for x in xrange(100):
+                if reloader.get_template('item.html').render({}) == \
+                   'new item':
+                    break
+                time.sleep(0.01)
+            else:
+                self.fail('template was not reloaded')
+        finally:
+            reloader.stop()
+
+
+class FileSystemBytecodeCacheTestCase(TemplateTestCase):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_roundtrip(self):
+        cache = FileSystemBytecodeCache(self.directory)
+        key = cache.get_cache_key(u'f\xf6\xf6.html', 'abc')
+        self.assert_equal(cache.load_bytecode(key), None)
+        code = compile('x = 42', '<test>', 'exec')
+        cache.dump_bytecode(key, code)
+        ns = {}
+        exec cache.load_bytecode(key) in ns
+        self.assert_equal(ns['x'], 42)
+        cache.clear()
+        self.assert_equal(cache.load_bytecode(key), None)
+
+    def test_invalid_data(self):
+        cache = FileSystemBytecodeCache(self.directory)
+        cache.dump_bytes('foo', 'garbage')
+        self.assert_equal(cache.load_bytecode('foo'), None)
+
+
+class PrecompileTestCase(TemplateTestCase):
+
+    def test_dependency_graph(self):
+        loader, config = setup()
+        graph = build_dependency_graph(loader, config)
+        self.assert_equal(graph, {
+            'index.html':   set(['layout.html', 'item.html']),
+            'layout.html':  set(),
+            'item.html':    set(),
+            'other.html':   set()
+        })
+        self.assert_equal(list(iter_dependency_levels(graph)), [
+            ['item.html', 'layout.html', 'other.html'],
+            ['index.html']
+        ])
+
+    def test_dependency_cycles(self):
+        graph = {'a': set(['b']), 'b': set(['a']), 'c': set(['a', 'x'])}
+        self.assert_equal(list(iter_dependency_levels(graph)),
+                          [['a', 'b'], ['c']])
+
+    def test_precompile(self):
+        for processes in 1, 2:
+            loader, config = setup()
+            cache = CountingCache()
+            rv = precompile(loader, config, cache, processes=processes)
+            self.assert_equal([x[0] for x in rv], ['item.html',
+                              'layout.html', 'other.html', 'index.html'])
+            self.assert_equal(cache.stores, 4)
+            for name, seconds in rv:
+                assert seconds >= 0
+
+            rv = precompile(loader, config, cache, processes=processes)
+            self.assert_equal([x[1] for x in rv], [None] * 4)
+            self.assert_equal(cache.stores, 4)
+
+            t = loader.load('item.html', config, cache)
+            self.assert_equal(t.render(dict(x=23)), 'item 23')
+            self.assert_equal(cache.stores, 4)
+
+    def test_command_line(self):
+        directory = tempfile.mkdtemp()
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            main(['-j', '1', '-d', directory, __name__ + ':setup'])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+            shutil.rmtree(directory)
+        assert 'index.html' in output
+        assert '4 compiled, 0 up to date' in output
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LoaderTestCase))
+    suite.addTest(unittest.makeSuite(AutoReloaderTestCase))
+    suite.addTest(unittest.makeSuite(FileSystemBytecodeCacheTestCase))
+    suite.addTest(unittest.makeSuite(PrecompileTestCase))
+    return suite
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+    templatetk.testsuite.profiling
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the template profilers.
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import pstats
+import threading
+import unittest
+from StringIO import StringIO
+
+from . import TemplateTestCase
+from .. import nodes
+from ..bcinterp import RuntimeState, run_bytecode
+from ..config import Config
+from ..frontend import InterpretedTemplate, CompiledTemplate
+from ..profiling import Profiler, SamplingProfiler, profile_template
+
+
+class FakeTimer(object):
+    """A timer that advances by one for every call."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def make_template():
+    n = nodes
+    node = n.Template([
+        n.Output([n.Const('<')], lineno=1),
+        n.For(n.Name('item', 'store', lineno=2),
+              n.Name('items', 'load', lineno=2), [
+            n.Output([n.Filter(n.Name('item', 'load', lineno=3), 'upper',
+                               [], [], None, None, lineno=3)], lineno=3)
+        ], [], lineno=2),
+        n.Block('footer', [
+            n.Output([n.Const('>')], lineno=5)
+        ], lineno=4)
+    ], lineno=1)
+
+    class CustomConfig(Config):
+        def get_filters(self):
+            return {'upper': lambda x: x.upper()}
+
+    node.set_config(CustomConfig())
+    return InterpretedTemplate('index.html', node.config, node)
+
+
+class ProfilerTestCase(TemplateTestCase):
+
+    def test_profile(self):
+        t = make_template()
+        rv, profiler = profile_template(t, dict(items='abc'))
+        self.assert_equal(rv, '<ABC>')
+        nodes = dict((key, calls) for key, calls, self_time, cumulative
+                     in profiler.iter_results())
+        self.assert_equal(nodes[('index.html', 2, 'For')], 1)
+        self.assert_equal(nodes[('index.html', 3, 'Output')], 3)
+        self.assert_equal(nodes[('index.html', 3, 'Filter')], 3)
+        self.assert_equal(nodes[('index.html', 5, 'Output')], 1)
+        lines = dict((key, calls) for key, calls, self_time, cumulative
+                     in profiler.iter_results('lines'))
+        self.assert_equal(lines[('index.html', 3)], 3 * 3)
+
+    def test_times(self):
+        profiler = Profiler(FakeTimer())
+        t = make_template()
+        profile_template(t, dict(items='ab'), profiler)
+        total_self = sum(x[2] for x in profiler.iter_results())
+        template = [x for x in profiler.iter_results()
+                    if x[0][2] == 'Template'][0]
+        self.assert_equal(template[3], total_self)
+        for key, calls, self_time, cumulative_time in \
+                profiler.iter_results():
+            assert 0 < self_time <= cumulative_time
+        loop = profiler.lines[('index.html', 2)]
+        body = profiler.lines[('index.html', 3)]
+        assert loop.cumulative_time > body.cumulative_time
+
+    def test_pstats(self):
+        t = make_template()
+        profiler = profile_template(t, dict(items='abc'))[1]
+        stream = StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats()
+        stats.print_callers()
+        output = stream.getvalue()
+        assert 'index.html:3(Filter)' in output
+        key = ('index.html', 3, 'Filter')
+        self.assert_equal(stats.stats[key][0], 3)
+        self.assert_equal(stats.stats[key][4],
+                          {('index.html', 3, 'Output'): 3})
+
+    def test_report(self):
+        t = make_template()
+        profiler = profile_template(t, dict(items='abc'))[1]
+        report = profiler.format_report(sort='calls', limit=3).splitlines()
+        self.assert_equal(len(report), 4)
+        assert report[0].split() == ['calls', 'self', 'ms', 'cum', 'ms',
+                                     'location']
+        assert report[1].split()[0] == '3'
+        assert 'index.html:3' in profiler.format_report(by='lines')
+
+
+class SamplingProfilerTestCase(TemplateTestCase):
+
+    def make_config(self):
+        n = nodes
+        templates = {
+            'index.html':   n.Template([
+                n.Output([n.Const('<')], lineno=1),
+                n.Block('body', [
+                    n.Include(n.Const('item.html'), False, lineno=3)
+                ], lineno=2),
+                n.Output([n.Const('>')], lineno=4)
+            ], lineno=1),
+            'item.html':    n.Template([
+                n.Output([n.Call(n.Name('wait', 'load', lineno=1), [], [],
+                                 None, None, lineno=1)], lineno=1)
+            ], lineno=1)
+        }
+
+        class CustomConfig(Config):
+            def get_template(self, name):
+                return CompiledTemplate(name, self, templates[name])
+            def yield_from_template(self, template, info, vars=None):
+                rtstate = RuntimeState(vars, self, template.name, info)
+                template.setup_func(rtstate)
+                return template.root_func(rtstate)
+
+        config = CustomConfig()
+        for node in templates.itervalues():
+            node.set_config(config)
+        return config
+
+    def render_in_thread(self, profiler):
+        config = self.make_config()
+        entered = threading.Event()
+        release = threading.Event()
+        def wait():
+            entered.set()
+            release.wait()
+            return 'x'
+        result = []
+        t = config.get_template('index.html')
+        thread = threading.Thread(target=lambda:
+            result.append(t.render(dict(wait=wait))))
+        thread.start()
+        entered.wait()
+        try:
+            profiler.sample()
+        finally:
+            release.set()
+            thread.join()
+        self.assert_equal(result, ['<x>'])
+
+    def test_sample(self):
+        profiler = SamplingProfiler()
+        self.render_in_thread(profiler)
+        self.assert_equal(profiler.samples, 1)
+        self.assert_equal(profiler.stacks, {
+            'index.html:root:2;index.html:block_body:3;item.html:root:1': 1
+        })
+        self.assert_equal(profiler.format_collapsed(), 'index.html:root:2;'
+                          'index.html:block_body:3;item.html:root:1 1\n')
+
+    def test_only_templates(self):
+        node = nodes.Template([nodes.Output([nodes.Const('x')])])
+        run_bytecode(node.set_config(Config()))
+        namespace = {}
+        exec 'import sys\ndef get_frame():\n return sys._getframe()' \
+            in namespace
+        profiler = SamplingProfiler()
+        self.assert_equal(profiler.get_stack(namespace['get_frame']()), None)
+
+    def test_background_thread(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        try:
+            while profiler.samples < 3:
+                threading.Event().wait(0.001)
+        finally:
+            profiler.stop()
+        samples = profiler.samples
+        assert samples >= 3
+        self.assert_equal(profiler.stacks, {})
+        profiler.clear()
+        self.assert_equal(profiler.samples, 0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ProfilerTestCase))
+    suite.addTest(unittest.makeSuite(SamplingProfilerTestCase))
+    return suite
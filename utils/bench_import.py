@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    bench_import
+    ~~~~~~~~~~~~
+
+    Measures how long it takes a fresh interpreter to import the parts of
+    templatetk a worker needs.  Loader-only workers that run cached
+    bytecode or interpret templates should not pay for the compiler.
+
+    Usage: python utils/bench_import.py [repeats]
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import subprocess
+
+
+SCENARIOS = [
+    ('baseline (python only)', 'pass'),
+    ('loader-only worker', 'import templatetk.frontend, templatetk.bccache'),
+    ('with compiler', 'import templatetk.frontend, templatetk.bccache, '
+                      'templatetk.asttransform'),
+]
+
+TIMER = '''\
+import time
+start = time.time()
+%s
+end = time.time()
+import sys
+compiler = 'templatetk.asttransform' in sys.modules
+print '%%f %%d' %% (end - start, compiler)
+'''
+
+
+def measure(statement):
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.Popen([sys.executable, '-S', '-c',
+                               TIMER % statement],
+                              cwd=os.path.dirname(here),
+                              stdout=subprocess.PIPE).communicate()[0]
+    seconds, compiler = output.split()
+    return float(seconds), compiler == '1'
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    results = []
+    for name, statement in SCENARIOS:
+        timings = []
+        for x in xrange(repeats):
+            seconds, compiler = measure(statement)
+            timings.append(seconds)
+        timings.sort()
+        results.append((name, timings[len(timings) // 2], compiler))
+
+    for name, median, compiler in results:
+        print '%-24s %8.2fms  compiler loaded: %s' % (
+            name, median * 1000, compiler and 'yes' or 'no')
+    saving = results[2][1] - results[1][1]
+    print 'loader-only workers save %.2fms per process start' % (
+        saving * 1000)
+
+
+if __name__ == '__main__':
+    main()
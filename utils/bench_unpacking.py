@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    bench_unpacking
+    ~~~~~~~~~~~~~~~
+
+    Compares loops over dictionary items with the inline tuple unpacking
+    the compiler emits against unpacking every item through the lenient
+    helper.
+
+    Usage: python utils/bench_unpacking.py [items] [repeats]
+
+    :copyright: (c) Copyright 2011 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import ast
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from templatetk import nodes
+from templatetk.config import Config
+from templatetk.frontend import CompiledTemplate
+from templatetk.asttransform import ASTTransformer
+
+
+class HelperOnlyTransformer(ASTTransformer):
+    """Always unpacks through the helper like the compiler used to."""
+
+    def make_lenient_unpack(self, target, iter_name, fstate):
+        rv = ASTTransformer.make_lenient_unpack(self, target, iter_name,
+                                                fstate)
+        if isinstance(rv, ast.If):
+            rv = rv.orelse[0]
+        return rv
+
+
+def make_template():
+    n = nodes
+    return n.Template([
+        n.For(n.Tuple([n.Name('key', 'store'), n.Name('value', 'store')],
+                      'store'), n.Name('items', 'load'), [
+            n.Output([n.Name('key', 'load'), n.Const('='),
+                      n.Name('value', 'load')])
+        ], None)
+    ]).set_config(Config())
+
+
+def compile_template(transformer_class):
+    node = make_template()
+    module = transformer_class(node.config).transform(node)
+    return CompiledTemplate('bench', node.config, module)
+
+
+def measure(template, context, repeats):
+    timings = []
+    for x in xrange(repeats):
+        start = default_timer()
+        template.render(context)
+        timings.append(default_timer() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    context = {'items': dict(('key%d' % x, x) for x in xrange(items))
+                        .items()}
+    inline = compile_template(ASTTransformer)
+    helper = compile_template(HelperOnlyTransformer)
+    assert inline.render(context) == helper.render(context)
+
+    inline_time = measure(inline, context, repeats)
+    helper_time = measure(helper, context, repeats)
+    print 'dict items loop over %d items (median of %d renders)' % (
+        items, repeats)
+    print '%-20s %8.2fms' % ('lenient helper', helper_time * 1000)
+    print '%-20s %8.2fms' % ('inline unpacking', inline_time * 1000)
+    print 'speedup: %.2fx' % (helper_time / inline_time)
+
+
+if __name__ == '__main__':
+    main()